@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.modbus_meter_emulator import start_modbus_emulator, EMULATED_METERS
+from benchmarks.mqtt_broker import MqttBrokerStub
+from benchmarks.p1_emulator import P1Emulator, load_telegrams
+
+# Run from the repository root: python -m benchmarks.bridge_benchmark --meter-type dts353f --meters 4
+#
+# Runs the bridge (main.py) end to end without hardware: Modbus meters are served by an emulated Modbus TCP server, P1
+# meters read recorded telegrams from pseudo-ttys, and the bridge publishes to an in-process MQTT broker stand-in.
+# Reports the samples/s received by the broker, the latency from poll to publish (the packet timestamp to the broker
+# receive time), and the CPU time and RSS of the bridge process.
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOPIC_PREFIX = 'benchmark'
+PACKET_TOPIC = 'packet'
+
+
+class PublishRecorder:
+
+    def __init__(self):
+        self.recording = False
+        self.messages = 0
+        self.samples = 0
+        self.latencies: list[float] = []
+        self.meters: set[str] = set()
+
+    def on_publish(self, topic: str, payload: bytes, receive_time: float):
+        if not self.recording:
+            return
+
+        self.messages += 1
+        if topic.endswith(f'/{PACKET_TOPIC}'):
+            sample = json.loads(payload)
+            self.samples += 1
+            self.latencies.append(receive_time - sample['timestamp'])
+            self.meters.add(sample['meter'])
+
+
+def write_config(path: str, args: argparse.Namespace, modbus_port: int, p1_ports: list[str]):
+    lines = []
+    if args.meter_type in EMULATED_METERS:
+        lines += [
+            '[buses.emulator]',
+            'connection_type = "tcp"',
+            'tcp_address = "127.0.0.1"',
+            f'tcp_port = {modbus_port}',
+            f'tcp_max_in_flight = {args.max_in_flight}',
+            '',
+        ]
+        for slave_id in range(1, args.meters + 1):
+            lines += [
+                '[[meters]]',
+                f'id = "{args.meter_type}-{slave_id}"',
+                f'type = "{args.meter_type}"',
+                'bus = "emulator"',
+                f'modbus_slave_id = {slave_id}',
+                f'measurement_interval = {args.interval}',
+                f'modbus_max_read_gap = {args.max_read_gap}',
+                '',
+            ]
+    else:
+        for index, port in enumerate(p1_ports):
+            lines += [
+                '[[meters]]',
+                f'id = "p1-{index + 1}"',
+                'type = "p1"',
+                f'serial_port = "{port}"',
+                '',
+            ]
+
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines))
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_process_tree(pid: int) -> list[int]:
+    # The process and its children, eg. the worker processes of the bridge.
+    pids = [pid]
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as file:
+            for child in file.read().split():
+                pids += get_process_tree(int(child))
+    return pids
+
+
+def read_cpu_time(pid: int) -> float:
+    cpu_time = 0.0
+    for process in get_process_tree(pid):
+        with open(f'/proc/{process}/stat') as file:
+            # Fields after the command name, which may contain spaces. utime and stime are fields 14 and 15.
+            fields = file.read().rsplit(')', 1)[1].split()
+        cpu_time += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu_time
+
+
+def read_memory(pid: int) -> dict[str, int]:
+    memory = {}
+    for process in get_process_tree(pid):
+        with open(f'/proc/{process}/status') as file:
+            for line in file:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value, _ = line.split()
+                    memory[name[:-1]] = memory.get(name[:-1], 0) + int(value) * 1024
+    return memory
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end benchmark of the bridge against emulated smart meters.')
+    parser.add_argument('--meter-type', choices=[*EMULATED_METERS, 'p1'], default='dts353f')
+    parser.add_argument('--meters', type=int, default=4, help='number of emulated meters')
+    parser.add_argument('--interval', type=float, default=1.0, help='measurement (or telegram) interval in s')
+    parser.add_argument('--latency', type=float, default=0.005, help='Modbus response latency per request in s')
+    parser.add_argument('--baudrate', type=int, default=None, help='emulated bus baud rate (default 9600, P1 115200)')
+    parser.add_argument('--max-read-gap', type=int, default=0)
+    parser.add_argument('--max-in-flight', type=int, default=4, help='Modbus TCP transactions in flight at once')
+    parser.add_argument('--concurrent-gateway', action='store_true',
+                        help='emulate a gateway that answers different meters concurrently, instead of a single bus')
+    parser.add_argument('--worker-processes', action='store_true', help='measure the meters in worker processes')
+    parser.add_argument('--payload-mode', choices=['packet', 'both'], default='both')
+    parser.add_argument('--warmup', type=float, default=3.0, help='s')
+    parser.add_argument('--duration', type=float, default=20.0, help='s')
+    parser.add_argument('--verbose', action='store_true', help='print the output of the bridge')
+    args = parser.parse_args()
+
+    recorder = PublishRecorder()
+    broker = MqttBrokerStub(recorder.on_publish)
+    broker_port = broker.start()
+
+    modbus_port = 0
+    p1_ports = []
+    if args.meter_type in EMULATED_METERS:
+        modbus_port = find_free_port()
+        start_modbus_emulator(args.meter_type, list(range(1, args.meters + 1)), args.latency, args.baudrate or 9600,
+                              modbus_port, concurrent=args.concurrent_gateway)
+    else:
+        telegrams = load_telegrams()
+        p1_ports = [P1Emulator(telegrams, args.interval, args.baudrate or 115200).port for _ in range(args.meters)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, 'meters.toml')
+        write_config(config_path, args, modbus_port, p1_ports)
+
+        env = {
+            **os.environ,
+            'PYTHONUNBUFFERED': '1',
+            'MQTT_BROKER_ADDRESS': '127.0.0.1',
+            'MQTT_BROKER_PORT': str(broker_port),
+            'MQTT_TOPIC_PREFIX': TOPIC_PREFIX,
+            'MQTT_PAYLOAD_MODE': args.payload_mode,
+            'MQTT_PAYLOAD_FORMAT': 'json',
+            'MQTT_PACKET_TOPIC': PACKET_TOPIC,
+            'SMART_METER_CONFIG': config_path,
+            'WORKER_PROCESSES': 'true' if args.worker_processes else 'false',
+        }
+        bridge = subprocess.Popen([sys.executable, 'main.py'], cwd=REPOSITORY_ROOT, env=env,
+                                  stdout=None if args.verbose else subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        try:
+            time.sleep(args.warmup)
+            if bridge.poll() is not None:
+                raise Exception(f'The bridge exited during warmup with code {bridge.returncode}, run with --verbose')
+
+            cpu_start = read_cpu_time(bridge.pid)
+            start = time.monotonic()
+            recorder.recording = True
+            time.sleep(args.duration)
+            recorder.recording = False
+            elapsed = time.monotonic() - start
+            cpu_time = read_cpu_time(bridge.pid) - cpu_start
+            memory = read_memory(bridge.pid)
+        finally:
+            bridge.terminate()
+            bridge.wait()
+
+    expected_rate = args.meters / args.interval
+    print(f'{args.meters}x {args.meter_type}, interval {args.interval} s, payload mode {args.payload_mode}, '
+          f'{"worker processes, " if args.worker_processes else ""}{elapsed:.1f} s measured')
+    print(f'samples: {recorder.samples / elapsed:.2f}/s (expected {expected_rate:.2f}/s), '
+          f'{len(recorder.meters)}/{args.meters} meters reporting, {recorder.messages / elapsed:.1f} messages/s')
+    if len(recorder.latencies) > 0:
+        latencies = recorder.latencies
+        print(f'poll to publish latency: mean {statistics.mean(latencies) * 1e3:.2f} ms, '
+              f'p50 {percentile(latencies, 0.50) * 1e3:.2f} ms, p95 {percentile(latencies, 0.95) * 1e3:.2f} ms, '
+              f'p99 {percentile(latencies, 0.99) * 1e3:.2f} ms, max {max(latencies) * 1e3:.2f} ms')
+    print(f'cpu: {cpu_time / elapsed * 100:.1f}% ({cpu_time:.2f} s), '
+          f'rss: {memory.get("VmRSS", 0) / 2 ** 20:.1f} MiB (peak {memory.get("VmHWM", 0) / 2 ** 20:.1f} MiB)')
+
+
+if __name__ == '__main__':
+    main()
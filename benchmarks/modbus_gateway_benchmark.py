@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Callable
+
+from pymodbus.client import AsyncModbusTcpClient
+
+from benchmarks.bridge_benchmark import find_free_port
+from benchmarks.modbus_meter_emulator import start_modbus_emulator, EMULATED_METERS
+from smart_meter.modbus_bus import ModbusBus
+from smart_meter.modbus_register_map import find_register_map, load_register_map
+from smart_meter.modbus_smart_meter import ModbusSmartMeter
+from smart_meter.modbus_tcp_client import PipelinedModbusTcpClient
+
+# Run from the repository root: python -m benchmarks.modbus_gateway_benchmark --meters 8
+#
+# Measures the time to poll every meter behind a single emulated Modbus TCP gateway once (a cycle), over one pooled
+# connection with an increasing number of transactions in flight, and over a pymodbus client for reference. The
+# emulated gateway answers different meters concurrently, so with as many transactions in flight as there are meters,
+# a cycle should take about as long as polling a single meter.
+
+
+async def measure(meter_type: str, build_bus: Callable[[], ModbusBus], meters: int, cycles: int) -> list[float]:
+    # Asynchronous pymodbus clients can only be built within the event loop.
+    bus = build_bus()
+    register_map = load_register_map(find_register_map(meter_type))
+    smart_meters = [ModbusSmartMeter(modbus_bus=bus, register_map=register_map, measurement_interval=1.0,
+                                     slave_id=slave_id, max_read_gap=64)
+                    for slave_id in range(1, meters + 1)]
+
+    durations = []
+    for _ in range(cycles + 1):
+        start = time.perf_counter()
+        await asyncio.gather(*(smart_meter.fetch_smart_meter_packet_async() for smart_meter in smart_meters))
+        durations.append(time.perf_counter() - start)
+
+    bus.modbus_client.close()
+    return durations[1:]  # the first cycle includes connecting
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of polling meters behind one Modbus TCP gateway.')
+    parser.add_argument('--meter-type', choices=EMULATED_METERS, default='dts353f')
+    parser.add_argument('--meters', type=int, default=8, help='number of emulated meters behind the gateway')
+    parser.add_argument('--latency', type=float, default=0.02, help='response latency per request in s')
+    parser.add_argument('--baudrate', type=int, default=9600, help='emulated serial baud rate behind the gateway')
+    parser.add_argument('--cycles', type=int, default=10)
+    args = parser.parse_args()
+
+    port = find_free_port()
+    start_modbus_emulator(args.meter_type, list(range(1, args.meters + 1)), args.latency, args.baudrate, port,
+                          concurrent=True)
+
+    configurations = [('pymodbus client', lambda: ModbusBus(AsyncModbusTcpClient('127.0.0.1', port=port, retries=0)))]
+    max_in_flight = 1
+    while True:
+        configurations.append((f'pipelined, {max_in_flight} in flight',
+                               lambda n=max_in_flight: ModbusBus(PipelinedModbusTcpClient('127.0.0.1', port), max_in_flight=n)))
+        if max_in_flight >= args.meters:
+            break
+        max_in_flight = min(args.meters, max_in_flight * 2)
+
+    print(f'{args.meters}x {args.meter_type} behind one gateway, latency {args.latency * 1e3:g} ms, '
+          f'{args.baudrate} baud')
+    for name, build_bus in configurations:
+        durations = asyncio.run(measure(args.meter_type, build_bus, args.meters, args.cycles))
+        print(f'{name}: cycle mean {statistics.mean(durations) * 1e3:.1f} ms, max {max(durations) * 1e3:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import asyncio
+import math
+import random
+import struct
+import threading
+import time
+from typing import Optional
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+from pymodbus.server import StartAsyncTcpServer
+
+from smart_meter.modbus_register_map import ModbusRegisterMap, ModbusRegisterField, MODBUS_DATA_TYPES, \
+    find_register_map, list_register_maps, load_register_map
+
+# Emulates the register maps of the supported Modbus smart meters on a Modbus TCP server, so the bridge can be
+# benchmarked without hardware. Every request is delayed by a fixed latency plus the time the request and response
+# frames would take on an RTU bus at the given baud rate. The server handles one request at a time, like a real bus,
+# unless it emulates a concurrent gateway: then every meter handles one request at a time, but different meters answer
+# at the same time, like TCP-native meters or a gateway with a serial port per meter.
+
+# Every smart meter type with a built-in register map.
+EMULATED_METERS = list_register_maps()
+
+RTU_REQUEST_SIZE = 8  # bytes: slave id, function code, address, count, crc
+RTU_RESPONSE_OVERHEAD = 5  # bytes: slave id, function code, byte count, crc
+RTU_CHARACTER_BITS = 11  # start bit, 8 data bits, parity or second stop bit, stop bit
+
+
+class EmulatedMeterDataBlock(ModbusSequentialDataBlock):
+
+    def __init__(self, register_map: ModbusRegisterMap, latency: float, baudrate: int, blocking: bool = True):
+        self.register_map = register_map
+        self.latency = latency
+        self.baudrate = baudrate
+        self.blocking = blocking
+        self.lock = asyncio.Lock()
+
+        self.energy = random.uniform(1000.0, 5000.0)  # kWh
+        self.last_update = time.monotonic()
+        self.requests = 0
+
+        size = max(register_field.address + register_field.register_count for register_field in register_map.fields.values())
+        super().__init__(0, [0] * size)
+
+    def getValues(self, address, count=1):
+        self.requests += 1
+        self.update_values()
+        if self.blocking:
+            time.sleep(self.get_request_time(count))
+
+        return super().getValues(address, count)
+
+    def get_request_time(self, count: int) -> float:
+        transfer_time = (RTU_REQUEST_SIZE + RTU_RESPONSE_OVERHEAD + 2 * count) * RTU_CHARACTER_BITS / self.baudrate
+        return self.latency + transfer_time
+
+    def update_values(self):
+        now = time.monotonic()
+        power = 2.0 + 1.5 * math.sin(now / 10.0) + random.uniform(-0.1, 0.1)  # kW
+        self.energy += power * (now - self.last_update) / 3600.0
+        self.last_update = now
+
+        for name, register_field in self.register_map.fields.items():
+            registers = encode_value(register_field, simulate_value(name, power, self.energy))
+            self.values[register_field.address:register_field.address + len(registers)] = registers
+
+
+class ConcurrentSlaveContext(ModbusSlaveContext):
+
+    async def async_getValues(self, fc_as_hex, address, count=1):
+        block = self.store[self.decode(fc_as_hex)]
+        async with block.lock:
+            await asyncio.sleep(block.get_request_time(count))
+            return self.getValues(fc_as_hex, address, count)
+
+
+def simulate_value(field_name: str, power: float, energy: float) -> float:
+    quantity = field_name.rsplit('_', 1)[-1]
+    phase_share = 1.0 if field_name.startswith('total_') else 1.0 / 3.0
+    if quantity == 'voltage':
+        return 230.0 + random.uniform(-2.0, 2.0)
+    elif quantity == 'amperage':
+        return power * phase_share * 1000.0 / 230.0
+    elif quantity == 'power':
+        return power * phase_share
+    elif quantity == 'delivery':
+        return energy * phase_share
+    elif quantity == 'redelivery':
+        return energy * phase_share * 0.25
+    elif quantity == 'frequency':
+        return 50.0 + random.uniform(-0.05, 0.05)
+    else:
+        return 0.0
+
+
+def encode_value(register_field: ModbusRegisterField, value: float) -> list[int]:
+    # The inverse of ModbusBlockDecoder.
+    format_character, register_count = MODBUS_DATA_TYPES[register_field.data_type]
+    raw_value = value / register_field.scale
+    if format_character not in 'fd':
+        raw_value = round(raw_value)
+
+    registers = list(struct.unpack(f'>{register_count}H', struct.pack(f'>{format_character}', raw_value)))
+    if register_field.word_order == 'little':
+        registers.reverse()
+    return registers
+
+
+def build_server_context(meter_type: str, slave_ids: list[int], latency: float, baudrate: int,
+                         concurrent: bool = False) -> ModbusServerContext:
+    register_map = load_register_map(find_register_map(meter_type))
+    context_class = ConcurrentSlaveContext if concurrent else ModbusSlaveContext
+    slaves = {}
+    for slave_id in slave_ids:
+        # Holding and input registers are served from the same block, register maps may read either.
+        block = EmulatedMeterDataBlock(register_map, latency, baudrate, blocking=not concurrent)
+        slaves[slave_id] = context_class(hr=block, ir=block, zero_mode=True)
+
+    return ModbusServerContext(slaves=slaves, single=False)
+
+
+def start_modbus_emulator(meter_type: str, slave_ids: list[int], latency: float, baudrate: int,
+                          port: int, host: str = '127.0.0.1', concurrent: bool = False) -> ModbusServerContext:
+    # Serves the emulated meters from a daemon thread until the process exits.
+    context = build_server_context(meter_type, slave_ids, latency, baudrate, concurrent)
+    started = threading.Event()
+    error: list[Optional[Exception]] = [None]
+
+    def run():
+        async def serve():
+            asyncio.get_running_loop().call_soon(started.set)
+            await StartAsyncTcpServer(context=context, address=(host, port))
+
+        try:
+            asyncio.run(serve())
+        except Exception as ex:
+            error[0] = ex
+            started.set()
+
+    threading.Thread(target=run, name='modbus-emulator', daemon=True).start()
+    started.wait()
+    if error[0] is not None:
+        raise Exception(f'Could not start the Modbus emulator on {host}:{port}: {error[0]}')
+
+    return context
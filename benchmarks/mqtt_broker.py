@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+# Minimal in-process stand-in for an MQTT broker: accepts MQTT 3.1.1 and 5 clients, acknowledges publishes at QoS 0, 1
+# and 2, subscriptions and pings, and hands every received publish to a callback along with its receive time. MQTT 5
+# clients may use up to topic_alias_maximum topic aliases. Nothing is routed to subscribers, it only measures what the
+# bridge publishes, including the number of bytes received.
+
+CONNECT = 1
+PUBLISH = 3
+PUBREL = 6
+SUBSCRIBE = 8
+PINGREQ = 12
+DISCONNECT = 14
+
+MQTT_V5 = 5
+
+# MQTT 5 property identifiers, and the size of their values (None for UTF-8 strings and binary data, which carry their
+# length, 'pair' for user properties and 'variable' for variable byte integers). Only those of PUBLISH packets.
+TOPIC_ALIAS_MAXIMUM = 0x22
+TOPIC_ALIAS = 0x23
+PUBLISH_PROPERTIES = {0x01: 1, 0x02: 4, 0x03: None, 0x08: None, 0x09: None, 0x0B: 'variable', 0x23: 2, 0x26: 'pair'}
+
+PublishCallback = Callable[[str, bytes, float], None]
+
+
+class MqttBrokerStub:
+
+    def __init__(self, on_publish: PublishCallback, topic_alias_maximum: int = 0):
+        self.on_publish = on_publish
+        self.topic_alias_maximum = topic_alias_maximum
+        self.messages = 0
+        self.bytes = 0  # of all packets received
+        self.connections = 0
+        self.port: Optional[int] = None
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        # Serves from a daemon thread until the process exits, returns the port listened on.
+        started = threading.Event()
+
+        async def serve():
+            server = await asyncio.start_server(self.handle_client, host, port)
+            self.port = server.sockets[0].getsockname()[1]
+            started.set()
+            await server.serve_forever()
+
+        threading.Thread(target=lambda: asyncio.run(serve()), name='mqtt-broker', daemon=True).start()
+        started.wait()
+        return self.port
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        protocol_level = 4
+        topic_aliases: dict[int, str] = {}
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                remaining_length = await read_remaining_length(reader)
+                packet = await reader.readexactly(remaining_length)
+                packet_type = header >> 4
+                self.bytes += 1 + len(encode_variable_length(remaining_length)) + remaining_length
+
+                if packet_type == CONNECT:
+                    protocol_level = packet[2 + int.from_bytes(packet[0:2], 'big')]
+                    writer.write(self.build_connack(protocol_level))
+                elif packet_type == PUBLISH:
+                    self.handle_publish(header, packet, protocol_level, topic_aliases, writer)
+                elif packet_type == PUBREL:
+                    writer.write(b'\x70\x02' + packet[0:2])  # PUBCOMP
+                elif packet_type == SUBSCRIBE:
+                    writer.write(b'\x90\x03' + packet[0:2] + b'\x00')  # SUBACK, granting QoS 0
+                elif packet_type == PINGREQ:
+                    writer.write(b'\xD0\x00')  # PINGRESP
+                elif packet_type == DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as ex:
+            # A protocol error, on which a broker closes the connection.
+            print(f'MQTT broker stub closed a connection: {ex}')
+        finally:
+            writer.close()
+
+    def build_connack(self, protocol_level: int) -> bytes:
+        if protocol_level != MQTT_V5:
+            return b'\x20\x02\x00\x00'
+        if self.topic_alias_maximum == 0:
+            return b'\x20\x03\x00\x00\x00'
+        return b'\x20\x06\x00\x00\x03' + bytes([TOPIC_ALIAS_MAXIMUM]) + self.topic_alias_maximum.to_bytes(2, 'big')
+
+    def handle_publish(self, header: int, packet: bytes, protocol_level: int, topic_aliases: dict[int, str],
+                       writer: asyncio.StreamWriter):
+        receive_time = time.time()
+        qos = (header >> 1) & 0x03
+
+        topic_length = int.from_bytes(packet[0:2], 'big')
+        topic = packet[2:2 + topic_length].decode()
+        offset = 2 + topic_length
+
+        packet_id = b''
+        if qos > 0:
+            packet_id = packet[offset:offset + 2]
+            offset += 2
+
+        if protocol_level == MQTT_V5:
+            properties_length, size = decode_variable_length(packet, offset)
+            offset += size
+            alias = decode_properties(packet[offset:offset + properties_length]).get(TOPIC_ALIAS)
+            offset += properties_length
+
+            if alias is not None:
+                if alias == 0 or alias > self.topic_alias_maximum:
+                    raise Exception(f'Invalid topic alias {alias}')
+                if topic != '':
+                    topic_aliases[alias] = topic
+                elif alias in topic_aliases:
+                    topic = topic_aliases[alias]
+                else:
+                    raise Exception(f'Unknown topic alias {alias}')
+
+        self.messages += 1
+        self.on_publish(topic, packet[offset:], receive_time)
+
+        if qos == 1:
+            writer.write(b'\x40\x02' + packet_id)  # PUBACK
+        elif qos == 2:
+            writer.write(b'\x50\x02' + packet_id)  # PUBREC
+
+
+async def read_remaining_length(reader: asyncio.StreamReader) -> int:
+    length = 0
+    for shift in range(0, 28, 7):
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if byte & 0x80 == 0:
+            return length
+    raise Exception('Malformed MQTT remaining length')
+
+
+def decode_variable_length(data: bytes, offset: int) -> tuple[int, int]:
+    # Returns the value and the number of bytes it was encoded in.
+    length = 0
+    for index in range(4):
+        byte = data[offset + index]
+        length |= (byte & 0x7F) << (7 * index)
+        if byte & 0x80 == 0:
+            return length, index + 1
+    raise Exception('Malformed MQTT variable byte integer')
+
+
+def encode_variable_length(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        encoded.append(byte | 0x80 if value > 0 else byte)
+        if value == 0:
+            return bytes(encoded)
+
+
+def decode_properties(data: bytes) -> dict[int, int | bytes]:
+    # Decodes the properties of a PUBLISH packet, integer properties as int and the others as their raw bytes.
+    properties = {}
+    offset = 0
+    while offset < len(data):
+        identifier = data[offset]
+        offset += 1
+        if identifier not in PUBLISH_PROPERTIES:
+            raise Exception(f'Unsupported MQTT property 0x{identifier:02X}')
+        size = PUBLISH_PROPERTIES[identifier]
+
+        if size == 'variable':
+            value, size = decode_variable_length(data, offset)
+            properties[identifier] = value
+        elif size == 'pair':
+            key_size = 2 + int.from_bytes(data[offset:offset + 2], 'big')
+            size = key_size + 2 + int.from_bytes(data[offset + key_size:offset + key_size + 2], 'big')
+            properties[identifier] = data[offset:offset + size]
+        elif size is None:
+            size = 2 + int.from_bytes(data[offset:offset + 2], 'big')
+            properties[identifier] = data[offset + 2:offset + size]
+        else:
+            properties[identifier] = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+
+    return properties
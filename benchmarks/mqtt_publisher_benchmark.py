@@ -0,0 +1,95 @@
+import argparse
+import threading
+import time
+from array import array
+
+from benchmarks.bridge_benchmark import TOPIC_PREFIX, percentile
+from benchmarks.mqtt_broker import MqttBrokerStub
+from bridge.mqtt_publisher import MqttPublisher
+from smart_meter.packet_layout import PacketTopics, FIELD_COUNT
+
+# Run from the repository root: python -m benchmarks.mqtt_publisher_benchmark --meters 8 --qos 1
+#
+# Publishes the topics of every meter's packets (every field present, as a three phase meter publishes them) through
+# the MqttPublisher to an in-process MQTT broker stand-in, on MQTT 3.1.1, on MQTT 5, and on MQTT 5 with topic aliases.
+# Reports the messages/s, the bytes the broker received per message and the latency from publish to the broker receive
+# time. Messages arrive in publish order over the single connection, which pairs publishes with their receipt.
+
+
+class ReceiveRecorder:
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.receive_times: list[float] = []
+        self.done = threading.Event()
+
+    def on_publish(self, topic: str, payload: bytes, receive_time: float):
+        self.receive_times.append(receive_time)
+        if len(self.receive_times) == self.expected:
+            self.done.set()
+
+
+def build_topics(meters: int) -> list[tuple[str, float]]:
+    values = array('d', [float(index) + 0.123 for index in range(FIELD_COUNT)])
+    topics = []
+    for meter in range(1, meters + 1):
+        topics += PacketTopics(f'{TOPIC_PREFIX}/meter-{meter}').to_topics(values).items()
+    return topics
+
+
+def measure(args: argparse.Namespace, protocol: str, topic_alias_maximum: int) -> str:
+    topics = build_topics(args.meters)
+    recorder = ReceiveRecorder(len(topics) * args.packets)
+    broker = MqttBrokerStub(recorder.on_publish, topic_alias_maximum=args.broker_topic_alias_maximum)
+    port = broker.start()
+
+    publisher = MqttPublisher(protocol=protocol, max_inflight=args.max_inflight, max_queued=0,
+                              topic_alias_maximum=topic_alias_maximum)
+    publisher.connect('127.0.0.1', port)
+    while not publisher.is_connected():
+        time.sleep(0.01)
+    time.sleep(0.1)  # until the CONNACK was handled, which sets the topic alias maximum
+    connect_bytes = broker.bytes
+
+    send_times = []
+    start = time.perf_counter()
+    for packet in range(args.packets):
+        for topic, value in topics:
+            send_times.append(time.time())
+            publisher.publish(topic, value, qos=args.qos, retain=True)
+        if args.rate > 0:
+            time.sleep(max(0.0, start + (packet + 1) / args.rate - time.perf_counter()))
+
+    if not recorder.done.wait(args.timeout):
+        raise Exception(f'The broker received {len(recorder.receive_times)} of {recorder.expected} messages')
+    duration = time.perf_counter() - start
+    publisher.client.disconnect()
+    publisher.client.loop_stop()
+
+    latencies = [receive - send for send, receive in zip(send_times, recorder.receive_times)]
+    return (f'{recorder.expected / duration:.0f} messages/s, '
+            f'{(broker.bytes - connect_bytes) / recorder.expected:.1f} bytes/message, '
+            f'latency p50 {percentile(latencies, 0.5) * 1e3:.2f} ms / p99 {percentile(latencies, 0.99) * 1e3:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of publishing over MQTT 3.1.1, 5 and 5 with topic aliases.')
+    parser.add_argument('--meters', type=int, default=8)
+    parser.add_argument('--packets', type=int, default=100, help='packets published per meter')
+    parser.add_argument('--rate', type=float, default=0.0, help='packets/s per meter, 0 publishes as fast as possible')
+    parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=1)
+    parser.add_argument('--max-inflight', type=int, default=20, help='QoS 1 and 2 messages awaiting acknowledgement')
+    parser.add_argument('--broker-topic-alias-maximum', type=int, default=65535,
+                        help='topic aliases the broker allows (Mosquitto defaults to 10)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='s')
+    args = parser.parse_args()
+
+    print(f'{args.meters} meters, {len(build_topics(1))} topics per packet, {args.packets} packets per meter, '
+          f'QoS {args.qos}, {args.max_inflight} in flight')
+    for name, protocol, topic_alias_maximum in (('MQTT 3.1.1', '3.1.1', 0), ('MQTT 5', '5', 0),
+                                                ('MQTT 5, topic aliases', '5', 65535)):
+        print(f'{name}: {measure(args, protocol, topic_alias_maximum)}')
+
+
+if __name__ == '__main__':
+    main()
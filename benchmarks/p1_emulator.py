@@ -0,0 +1,53 @@
+import glob
+import os
+import pty
+import threading
+import time
+import tty
+
+# Replays recorded DSMR telegrams on a pseudo-tty, so P1SmartMeter can read them like a real P1 port. Telegrams are
+# written at the given interval, paced at the given baud rate.
+
+TELEGRAMS = os.path.join(os.path.dirname(__file__), 'telegrams', '*.txt')
+P1_CHARACTER_BITS = 10  # start bit, 8 data bits, stop bit
+P1_WRITE_CHUNK_SIZE = 64  # bytes
+
+
+def load_telegrams(pattern: str = TELEGRAMS) -> list[bytes]:
+    telegrams = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'rb') as file:
+            telegrams.append(file.read())
+
+    if len(telegrams) == 0:
+        raise Exception(f'No telegrams found matching {pattern}')
+    return telegrams
+
+
+class P1Emulator:
+
+    def __init__(self, telegrams: list[bytes], interval: float, baudrate: int = 115200):
+        self.telegrams = telegrams
+        self.interval = interval
+        self.baudrate = baudrate
+        self.telegrams_written = 0
+
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+
+        threading.Thread(target=self.run, name=f'p1-emulator-{self.port}', daemon=True).start()
+
+    def run(self):
+        next_telegram = time.monotonic()
+        while True:
+            telegram = self.telegrams[self.telegrams_written % len(self.telegrams)]
+            for offset in range(0, len(telegram), P1_WRITE_CHUNK_SIZE):
+                chunk = telegram[offset:offset + P1_WRITE_CHUNK_SIZE]
+                os.write(self.master, chunk)
+                time.sleep(len(chunk) * P1_CHARACTER_BITS / self.baudrate)
+            self.telegrams_written += 1
+
+            next_telegram += self.interval
+            time.sleep(max(0.0, next_telegram - time.monotonic()))
@@ -0,0 +1,88 @@
+import glob
+import os
+import timeit
+from typing import Optional
+
+from smart_meter.dsmr_telegram import parse_telegram
+from smart_meter.p1_smart_meter import build_smart_meter_packet
+from smart_meter.smart_meter_packet import SmartMeterPacket, PhaseData, EnergyData, EnergyTariff
+
+# Run from the repository root: python -m benchmarks.p1_parser_benchmark
+
+TELEGRAM_DIRECTORY = os.path.join(os.path.dirname(__file__), 'telegrams')
+ITERATIONS = 5000
+
+
+# The line-list/find_measurement implementation P1SmartMeter used before the OBIS index, kept as a baseline.
+def legacy_read_p1_packet(data: bytes) -> list[str]:
+    packet = []
+    for line in data.splitlines(keepends=True):
+        line = line.decode()
+        line = line.replace('\r', '')
+        line = line.replace('\n', '')
+        packet.append(line)
+        if '!' in line:
+            break
+
+    return packet
+
+
+def legacy_find_measurement(p1_packet: list[str], obis_reference: str, value_index: int = 0) -> Optional[float]:
+    lines = list(filter(lambda line: obis_reference in line, p1_packet))
+    if len(lines) == 0:
+        return None
+
+    values = lines[0].split('(')[1:]
+    values = [d[0:-1] for d in values]
+
+    if len(values) <= value_index:
+        return None
+
+    value = values[value_index]
+    return float(value.split('*', 2)[0])
+
+
+def legacy_build_smart_meter_packet(data: bytes) -> SmartMeterPacket:
+    packet = legacy_read_p1_packet(data)
+    find_measurement = legacy_find_measurement
+
+    l1_voltage = find_measurement(packet, '32.7.0')
+    l1_power = find_measurement(packet, '21.7.0') - find_measurement(packet, '22.7.0')
+    l2_voltage = find_measurement(packet, '52.7.0')
+    l2_power = find_measurement(packet, '41.7.0') - find_measurement(packet, '42.7.0')
+    l3_voltage = find_measurement(packet, '72.7.0')
+    l3_power = find_measurement(packet, '61.7.0') - find_measurement(packet, '62.7.0')
+
+    return SmartMeterPacket(
+        phase_l1=PhaseData(voltage=l1_voltage, amperage=(l1_power * 1000.0) / l1_voltage, power=l1_power),
+        phase_l2=PhaseData(voltage=l2_voltage, amperage=(l2_power * 1000.0) / l2_voltage, power=l2_power),
+        phase_l3=PhaseData(voltage=l3_voltage, amperage=(l3_power * 1000.0) / l3_voltage, power=l3_power),
+        power=find_measurement(packet, '1.7.0') - find_measurement(packet, '2.7.0'),
+        energy=EnergyData(
+            delivery=find_measurement(packet, '1.8.1') + find_measurement(packet, '1.8.2'),
+            redelivery=find_measurement(packet, '2.8.1') + find_measurement(packet, '2.8.2')
+        ),
+        tariff=EnergyTariff(int(find_measurement(packet, '96.14.0'))),
+        gas=find_measurement(packet, '24.2.1', 1),
+        water=None,
+    )
+
+
+def indexed_build_smart_meter_packet(data: bytes) -> SmartMeterPacket:
+    return build_smart_meter_packet(parse_telegram(data))
+
+
+def main():
+    for path in sorted(glob.glob(os.path.join(TELEGRAM_DIRECTORY, '*.txt'))):
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        legacy = timeit.timeit(lambda: legacy_build_smart_meter_packet(data), number=ITERATIONS) / ITERATIONS
+        indexed = timeit.timeit(lambda: indexed_build_smart_meter_packet(data), number=ITERATIONS) / ITERATIONS
+
+        print(f'{os.path.basename(path)}: find_measurement {legacy * 1e6:.1f} us/telegram, '
+              f'OBIS index {indexed * 1e6:.1f} us/telegram ({legacy / indexed:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
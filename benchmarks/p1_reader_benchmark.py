@@ -0,0 +1,66 @@
+import glob
+import os
+import time
+
+from smart_meter.dsmr_bulk_reader import DsmrBulkTelegramReader
+from smart_meter.dsmr_telegram_reader import DsmrTelegramReader
+from smart_meter.p1_smart_meter import build_smart_meter_packet, P1_OBIS_REFERENCES
+
+# Run from the repository root: python -m benchmarks.p1_reader_benchmark
+#
+# Compares the cost per telegram of reading telegrams from the serial port and building packets, between the line
+# based DsmrTelegramReader and the bulk DsmrBulkTelegramReader, on recorded telegrams served from memory.
+
+TELEGRAM_DIRECTORY = os.path.join(os.path.dirname(__file__), 'telegrams')
+TELEGRAMS = 2000
+SERIAL_BUFFER_SIZE = 512  # bytes available per read, roughly what arrives between reads at 115200 baud
+
+
+class MemorySerial:
+    # Serves data like serial.Serial would, with up to SERIAL_BUFFER_SIZE bytes waiting at any time.
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    @property
+    def in_waiting(self) -> int:
+        return min(SERIAL_BUFFER_SIZE, len(self.data) - self.position)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def readline(self) -> bytes:
+        end = self.data.find(b'\n', self.position)
+        end = len(self.data) if end < 0 else end + 1
+        data = self.data[self.position:end]
+        self.position = end
+        return data
+
+
+def measure(reader, telegrams: int) -> float:
+    start = time.perf_counter()
+    for _ in range(telegrams):
+        build_smart_meter_packet(reader.read_telegram())
+    return (time.perf_counter() - start) / telegrams
+
+
+def main():
+    for path in sorted(glob.glob(os.path.join(TELEGRAM_DIRECTORY, '*.txt'))):
+        with open(path, 'rb') as file:
+            data = file.read() * TELEGRAMS
+
+        line = measure(DsmrTelegramReader(MemorySerial(data)), TELEGRAMS)
+        bulk = measure(DsmrBulkTelegramReader(MemorySerial(data), P1_OBIS_REFERENCES), TELEGRAMS)
+        decimated = measure(DsmrBulkTelegramReader(MemorySerial(data), P1_OBIS_REFERENCES, decimation=5),
+                            TELEGRAMS // 5) / 5
+
+        print(f'{os.path.basename(path)}: line reader {line * 1e6:.1f} us/telegram, '
+              f'bulk reader {bulk * 1e6:.1f} us/telegram ({line / bulk:.1f}x), '
+              f'bulk reader with decimation 5 {decimated * 1e6:.1f} us/telegram ({line / decimated:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
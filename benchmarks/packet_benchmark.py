@@ -0,0 +1,57 @@
+import os
+import timeit
+import tracemalloc
+
+from smart_meter.dsmr_telegram import parse_telegram
+from smart_meter.p1_smart_meter import build_smart_meter_packet
+from smart_meter.packet_layout import packet_to_array, PacketTransform, PacketTopics
+from smart_meter.smart_meter_packet import SmartMeterPacket
+
+# Run from the repository root: python -m benchmarks.packet_benchmark
+#
+# Compares the per-packet cost of reversing power and energy direction and building the topics, between the
+# dataclass API and the flat packet layout with a precomputed transform and topic names.
+
+TELEGRAM = os.path.join(os.path.dirname(__file__), 'telegrams', 'dsmr5.txt')
+TOPIC_PREFIX = 'smart-meter'
+ITERATIONS = 20000
+
+
+def dataclass_path(packet: SmartMeterPacket) -> dict[str, float]:
+    packet = packet.reverse_power_direction().reverse_energy_direction()
+    return packet.to_topics(topic_prefix=TOPIC_PREFIX)
+
+
+def flat_path(packet: SmartMeterPacket, transform: PacketTransform, topics: PacketTopics) -> dict[str, float]:
+    return topics.to_topics(transform.apply(packet_to_array(packet)))
+
+
+def measure_allocations(function) -> int:
+    # Bytes allocated (and not yet freed) by a single call, the result of the call included.
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    result = function()
+    allocated = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    tracemalloc.stop()
+    del result
+    return allocated
+
+
+def main():
+    with open(TELEGRAM, 'rb') as file:
+        packet = build_smart_meter_packet(parse_telegram(file.read()))
+
+    transform = PacketTransform(reverse_power=True, reverse_energy=True)
+    topics = PacketTopics(TOPIC_PREFIX)
+    assert dataclass_path(packet) == flat_path(packet, transform, topics)
+
+    for name, function in (
+            ('dataclass', lambda: dataclass_path(packet)),
+            ('flat layout', lambda: flat_path(packet, transform, topics)),
+    ):
+        duration = timeit.timeit(function, number=ITERATIONS) / ITERATIONS
+        print(f'{name}: {duration * 1e6:.1f} us/packet, {measure_allocations(function)} bytes allocated/packet')
+
+
+if __name__ == '__main__':
+    main()
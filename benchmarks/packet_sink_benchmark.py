@@ -0,0 +1,116 @@
+import argparse
+import threading
+import time
+from array import array
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from benchmarks.bridge_benchmark import TOPIC_PREFIX
+from benchmarks.mqtt_broker import MqttBrokerStub
+from bridge.mqtt_publisher import MqttPublisher
+from bridge.packet_sink import LineProtocolSink, build_sink_transport
+from smart_meter.packet_layout import PacketTopics, FIELD_COUNT, FIELD_INDEX
+
+# Run from the repository root: python -m benchmarks.packet_sink_benchmark --meters 8 --samples 2000
+#
+# Hands the same samples (every field present, as a three phase meter reads them) to the per-topic MQTT publishing
+# path and to the line protocol sink, which writes them over HTTP to an in-process stand-in for InfluxDB's write API.
+# Reports the samples/s until everything was received, the time the publishing thread spent per sample, and the
+# number of writes (MQTT messages or HTTP requests) and bytes per sample.
+
+
+class WriteRecorder(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+    bytes = 0
+    lines = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        WriteRecorder.requests += 1
+        WriteRecorder.bytes += len(body)
+        WriteRecorder.lines += body.count(b'\n')
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def build_values() -> array:
+    values = array('d', [float(index) + 0.123 for index in range(FIELD_COUNT)])
+    values[FIELD_INDEX['tariff']] = 2.0
+    return values
+
+
+def measure_mqtt(args: argparse.Namespace) -> str:
+    values = build_values()
+    topics = [PacketTopics(f'{TOPIC_PREFIX}/meter-{meter}') for meter in range(1, args.meters + 1)]
+    expected = args.samples * len(topics[0].to_topics(values))
+    done = threading.Event()
+    broker = MqttBrokerStub(lambda topic, payload, receive_time: done.set() if broker.messages >= expected else None)
+    port = broker.start()
+
+    publisher = MqttPublisher(max_inflight=20, max_queued=0)
+    publisher.connect('127.0.0.1', port)
+    while not publisher.is_connected():
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    for sample in range(args.samples):
+        for topic, value in topics[sample % args.meters].to_topics(values).items():
+            publisher.publish(topic, value, qos=0, retain=True)
+    published = time.perf_counter()
+    if not done.wait(args.timeout):
+        raise Exception(f'The broker received {broker.messages} of {expected} messages')
+    duration = time.perf_counter() - start
+    publisher.client.disconnect()
+    publisher.client.loop_stop()
+
+    return (f'{args.samples / duration:.0f} samples/s, {(published - start) / args.samples * 1e6:.1f} us/sample '
+            f'publishing, {broker.messages / args.samples:.1f} writes/sample, '
+            f'{broker.bytes / args.samples:.0f} bytes/sample')
+
+
+def measure_sink(args: argparse.Namespace) -> str:
+    values = build_values()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WriteRecorder)
+    threading.Thread(target=server.serve_forever, name='write-api', daemon=True).start()
+
+    sink = LineProtocolSink(
+        transport=build_sink_transport(f'http://127.0.0.1:{server.server_port}/api/v2/write?bucket=benchmark'
+                                       f'&precision=ns', None, 0, 0),
+        batch_size=args.batch_size,
+        flush_interval=1.0,
+    )
+
+    start = time.perf_counter()
+    timestamp = time.time()
+    for sample in range(args.samples):
+        sink.write(f'meter-{sample % args.meters + 1}', timestamp + sample * 0.001, values)
+    published = time.perf_counter()
+    sink.close()
+    duration = time.perf_counter() - start
+    server.shutdown()
+
+    if WriteRecorder.lines != args.samples:
+        raise Exception(f'The write API received {WriteRecorder.lines} of {args.samples} lines')
+    return (f'{args.samples / duration:.0f} samples/s, {(published - start) / args.samples * 1e6:.1f} us/sample '
+            f'publishing, {WriteRecorder.requests / args.samples:.4f} writes/sample, '
+            f'{WriteRecorder.bytes / args.samples:.0f} bytes/sample')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the line protocol sink against per-topic MQTT.')
+    parser.add_argument('--meters', type=int, default=8)
+    parser.add_argument('--samples', type=int, default=2000, help='samples in total, spread over the meters')
+    parser.add_argument('--batch-size', type=int, default=5000, help='lines per write of the sink')
+    parser.add_argument('--timeout', type=float, default=60.0, help='s')
+    args = parser.parse_args()
+
+    print(f'{args.meters} meters, {args.samples} samples')
+    print(f'MQTT topics: {measure_mqtt(args)}')
+    print(f'Line protocol over HTTP: {measure_sink(args)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bridge_benchmark import REPOSITORY_ROOT, TOPIC_PREFIX, PACKET_TOPIC, write_config, find_free_port
+from benchmarks.modbus_meter_emulator import start_modbus_emulator, EMULATED_METERS
+from benchmarks.mqtt_broker import MqttBrokerStub
+from benchmarks.p1_emulator import P1Emulator, load_telegrams
+
+# Run from the repository root: python -m benchmarks.startup_benchmark --meter-type p1
+#
+# Measures how long a freshly started bridge (main.py) takes to import its modules, and to publish its first packet
+# to an in-process MQTT broker stand-in, served by an emulated meter. The emulated meters send packets every
+# --interval s, which bounds the time waiting for the first packet after the bridge is up.
+
+IMPORT_SCRIPT = 'import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)'
+
+
+class FirstPacket:
+
+    def __init__(self):
+        self.received = threading.Event()
+
+    def on_publish(self, topic: str, payload: bytes, receive_time: float):
+        if topic.endswith(f'/{PACKET_TOPIC}'):
+            self.received.set()
+
+
+def measure_import() -> float:
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=REPOSITORY_ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_first_packet(env: dict[str, str], first_packet: FirstPacket, timeout: float) -> float:
+    first_packet.received.clear()
+    start = time.perf_counter()
+    bridge = subprocess.Popen([sys.executable, 'main.py'], cwd=REPOSITORY_ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    try:
+        if not first_packet.received.wait(timeout):
+            raise Exception(f'No packet published within {timeout:g} s')
+        return time.perf_counter() - start
+    finally:
+        bridge.terminate()
+        bridge.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the startup time of the bridge.')
+    parser.add_argument('--meter-type', choices=[*EMULATED_METERS, 'p1'], default='p1')
+    parser.add_argument('--interval', type=float, default=0.1, help='measurement (or telegram) interval in s')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=30.0, help='s')
+    args = parser.parse_args()
+    args.meters = 1
+    args.max_in_flight = 1
+    args.max_read_gap = 0
+
+    first_packet = FirstPacket()
+    broker_port = MqttBrokerStub(first_packet.on_publish).start()
+
+    modbus_port = 0
+    p1_ports = []
+    if args.meter_type in EMULATED_METERS:
+        modbus_port = find_free_port()
+        start_modbus_emulator(args.meter_type, [1], 0.005, 9600, modbus_port)
+    else:
+        p1_ports = [P1Emulator(load_telegrams(), args.interval).port]
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, 'meters.toml')
+        write_config(config_path, args, modbus_port, p1_ports)
+        env = {
+            **os.environ,
+            'MQTT_BROKER_ADDRESS': '127.0.0.1',
+            'MQTT_BROKER_PORT': str(broker_port),
+            'MQTT_TOPIC_PREFIX': TOPIC_PREFIX,
+            'MQTT_PAYLOAD_MODE': 'packet',
+            'MQTT_PACKET_TOPIC': PACKET_TOPIC,
+            'SMART_METER_CONFIG': config_path,
+        }
+
+        imports = [measure_import() for _ in range(args.runs)]
+        first_packets = [measure_first_packet(env, first_packet, args.timeout) for _ in range(args.runs)]
+
+    print(f'{args.meter_type}, interval {args.interval} s, {args.runs} runs')
+    print(f'import main: median {statistics.median(imports) * 1e3:.1f} ms, max {max(imports) * 1e3:.1f} ms')
+    print(f'start to first published packet: median {statistics.median(first_packets) * 1e3:.1f} ms, '
+          f'max {max(first_packets) * 1e3:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Aggregation windows and their settings. PacketAggregator, which depends on numpy, lives in packet_aggregator and is
+# only imported when aggregation is enabled.
+
+DEFAULT_AGGREGATION_FIELDS = 'l1/power,l2/power,l3/power,power'
+DEFAULT_AGGREGATION_BUFFER_SIZE = 4096  # samples
+
+
+@dataclass
+class AggregationWindow:
+    length: float  # s
+    label: str  # eg. '15m', used in the topics
+    end: Optional[float] = None  # unix time (s) at which the current window ends
+
+
+@dataclass
+class WindowAggregate:
+    label: str
+    start: float  # unix time (s)
+    end: float  # unix time (s)
+    samples: int
+    fields: dict[str, dict[str, float]] = field(default_factory=dict)  # field -> statistic -> value
+
+
+def format_window(length: float) -> str:
+    if length % 3600 == 0:
+        return f'{length / 3600:g}h'
+    if length % 60 == 0:
+        return f'{length / 60:g}m'
+    return f'{length:g}s'
+
+
+def parse_windows(value: Optional[str]) -> list[float]:
+    # Parses eg. '60,900' into window lengths in seconds.
+    if not value:
+        return []
+
+    windows = [float(window) for window in value.split(',') if window.strip() != '']
+    for window in windows:
+        if window <= 0.0:
+            raise Exception(f'Invalid aggregation window {window:g} (must be positive)')
+    return windows
+
+
+def parse_fields(value: str) -> list[str]:
+    return [name.strip() for name in value.split(',') if name.strip() != '']
@@ -0,0 +1,121 @@
+import tomllib
+from dataclasses import dataclass
+from typing import Any, TYPE_CHECKING
+
+from bridge.bridge_meter import BridgeMeter, BridgeMeterDefaults
+from bridge.aggregation_windows import parse_windows, parse_fields
+from bridge.publish_filter import PublishFilter, parse_deadbands
+from smart_meter.smart_meter import SmartMeter
+from smart_meter.smart_meter_factory import build_smart_meter, SMART_METER_MODBUS_BUS
+
+if TYPE_CHECKING:
+    from smart_meter.modbus_bus import ModbusBus
+
+# Meter keys that configure the bridge rather than the smart meter itself.
+BRIDGE_METER_KEYS = {'id', 'bus', 'topic_prefix', 'reverse_power', 'reverse_energy', 'publish_on_change',
+                     'publish_deadbands', 'publish_max_silence', 'aggregation_windows', 'aggregation_fields',
+                     'aggregation_buffer_size'}
+
+
+@dataclass
+class MeterConfig:
+    id: str
+    settings: dict[str, str]  # smart-meter settings, as environment variables, see build_smart_meter
+    config: dict[str, Any]  # the meter's TOML table, for the bridge keys
+
+
+def load_bridge_meters(path: str, defaults: BridgeMeterDefaults) -> list[BridgeMeter]:
+    # Modbus meters on the same bus share a single Modbus client.
+    modbus_buses: dict[str, 'ModbusBus'] = {}
+    return [build_bridge_meter(meter.id, build_smart_meter(asynchronous=True, settings=meter.settings,
+                                                           modbus_buses=modbus_buses), meter.config, defaults)
+            for meter in load_meter_configs(path, defaults)]
+
+
+def load_meter_configs(path: str, defaults: BridgeMeterDefaults) -> list[MeterConfig]:
+    # Loads a TOML file describing any number of smart meters, eg:
+    #
+    #   [buses.rs485]
+    #   connection_type = "serial"
+    #   serial_port = "/dev/ttyUSB0"
+    #
+    #   [[meters]]
+    #   id = "heat-pump"
+    #   type = "sdm72dm"
+    #   bus = "rs485"
+    #   modbus_slave_id = 2
+    #   measurement_interval = 5.0
+    #
+    # Meter and bus keys are the smart-meter environment variables without the SMART_METER_ prefix, in lowercase.
+    # Bridge keys (see BRIDGE_METER_KEYS) fall back to the defaults.
+    with open(path, 'rb') as file:
+        config = tomllib.load(file)
+
+    buses = config.get('buses', {})
+    meters = []
+
+    for index, meter_config in enumerate(config.get('meters', [])):
+        meter_id = str(meter_config.get('id', f'meter{index + 1}'))
+
+        settings = {}
+        bus_name = meter_config.get('bus')
+        if bus_name is not None:
+            if bus_name not in buses:
+                raise Exception(f'Smart meter {meter_id} refers to unknown bus "{bus_name}" in {path}')
+            settings.update(to_settings(buses[bus_name]))
+            settings[SMART_METER_MODBUS_BUS] = bus_name
+        settings.update(to_settings({key: value for key, value in meter_config.items() if key not in BRIDGE_METER_KEYS}))
+
+        meter_config = {'topic_prefix': f'{defaults.topic_prefix}/{meter_id}', **meter_config}
+        meters.append(MeterConfig(meter_id, settings, meter_config))
+
+    if len(meters) == 0:
+        raise Exception(f'No smart meters defined in {path}')
+
+    return meters
+
+
+def build_bridge_meter(meter_id: str, smart_meter: SmartMeter, meter_config: dict[str, Any],
+                       defaults: BridgeMeterDefaults) -> BridgeMeter:
+    topic_prefix = meter_config.get('topic_prefix', defaults.topic_prefix)
+
+    publish_filter = None
+    if meter_config.get('publish_on_change', defaults.publish_on_change):
+        publish_filter = PublishFilter(
+            topic_prefix=topic_prefix,
+            deadbands=parse_deadbands(meter_config.get('publish_deadbands', defaults.publish_deadbands)),
+            max_silence=float(meter_config.get('publish_max_silence', defaults.publish_max_silence)),
+        )
+
+    aggregator = None
+    windows = parse_windows(to_setting_value(meter_config.get('aggregation_windows', defaults.aggregation_windows)))
+    if len(windows) > 0:
+        # numpy is only imported when aggregating.
+        from bridge.packet_aggregator import PacketAggregator
+        aggregator = PacketAggregator(
+            fields=parse_fields(to_setting_value(meter_config.get('aggregation_fields', defaults.aggregation_fields))),
+            windows=windows,
+            buffer_size=int(meter_config.get('aggregation_buffer_size', defaults.aggregation_buffer_size)),
+        )
+
+    return BridgeMeter(
+        id=meter_id,
+        topic_prefix=topic_prefix,
+        smart_meter=smart_meter,
+        reverse_power=meter_config.get('reverse_power', defaults.reverse_power),
+        reverse_energy=meter_config.get('reverse_energy', defaults.reverse_energy),
+        publish_filter=publish_filter,
+        aggregator=aggregator,
+    )
+
+
+def to_settings(config: dict[str, Any]) -> dict[str, str]:
+    return {f'SMART_METER_{key.upper()}': to_setting_value(value) for key, value in config.items()}
+
+
+def to_setting_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list):
+        return ','.join(to_setting_value(item) for item in value)
+    return str(value)
@@ -0,0 +1,57 @@
+from dataclasses import dataclass, field
+from typing import Optional, TYPE_CHECKING
+
+from bridge.aggregation_windows import DEFAULT_AGGREGATION_FIELDS, DEFAULT_AGGREGATION_BUFFER_SIZE
+from bridge.publish_filter import PublishFilter
+from smart_meter.metrics import Labels
+from smart_meter.packet_layout import PacketTransform, PacketTopics
+from smart_meter.smart_meter import SmartMeter
+from smart_meter.smart_meter_packet import SmartMeterPacket
+
+if TYPE_CHECKING:
+    from bridge.packet_aggregator import PacketAggregator
+
+
+@dataclass
+class BridgeMeterDefaults:
+    # Bridge settings of a meter when they are not configured for that meter specifically.
+    topic_prefix: str
+    reverse_power: bool = False
+    reverse_energy: bool = False
+    publish_on_change: bool = False
+    publish_deadbands: str = ''
+    publish_max_silence: float = 60.0  # s
+    aggregation_windows: str = ''
+    aggregation_fields: str = DEFAULT_AGGREGATION_FIELDS
+    aggregation_buffer_size: int = DEFAULT_AGGREGATION_BUFFER_SIZE
+
+
+@dataclass
+class BridgeMeter:
+    id: str
+    topic_prefix: str
+    smart_meter: SmartMeter
+    reverse_power: bool = False
+    reverse_energy: bool = False
+    publish_filter: Optional[PublishFilter] = None
+    aggregator: Optional['PacketAggregator'] = None
+
+    # Precomputed once per meter, used for every packet
+    packet_transform: PacketTransform = field(init=False)
+    packet_topics: PacketTopics = field(init=False)
+    metrics_labels: Labels = field(init=False)
+
+    def __post_init__(self):
+        self.packet_transform = PacketTransform(self.reverse_power, self.reverse_energy)
+        self.packet_topics = PacketTopics(self.topic_prefix)
+
+        # Metrics of the smart meter itself are labeled by the meter's id as well.
+        self.metrics_labels = (('meter', self.id),)
+        self.smart_meter.metrics_labels = self.metrics_labels
+
+
+@dataclass
+class MeterSample:
+    meter: BridgeMeter
+    packet: SmartMeterPacket
+    timestamp: float  # unix time (s) at which the packet was acquired
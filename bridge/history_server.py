@@ -0,0 +1,68 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from bridge.history_store import HistoryStore
+from bridge.payload_encoding import build_payload_encoder
+from smart_meter.packet_layout import PACKET_FIELDS
+
+HISTORY_CONTENT_TYPES = {'json': 'application/json', 'msgpack': 'application/msgpack', 'cbor': 'application/cbor'}
+DEFAULT_HISTORY_RANGE = 3600.0  # s
+
+
+class HistoryRequestHandler(BaseHTTPRequestHandler):
+    # GET /history lists the meters and their tiers, GET /history/{meter} returns a range of a meter's history, eg.
+    # /history/main?tier=1m&fields=power,l1/power&start=-86400 for the last day of 1 minute means. Negative start and
+    # end are relative to now. The range defaults to the last hour, the fields to all fields.
+    history: HistoryStore
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        payload_format = query.get('format', 'json')
+
+        try:
+            encode = build_payload_encoder(payload_format)
+            if url.path in ('/history', '/history/'):
+                body = encode(self.history.describe())
+            elif url.path.startswith('/history/'):
+                body = encode(self.query_history(unquote(url.path[len('/history/'):]), query))
+            else:
+                self.send_error(404)
+                return
+        except Exception as ex:
+            self.send_error(400, str(ex))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', HISTORY_CONTENT_TYPES[payload_format])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def query_history(self, meter_id: str, query: dict[str, str]) -> dict:
+        now = time.time()
+        end = float(query.get('end', now))
+        start = float(query.get('start', -DEFAULT_HISTORY_RANGE))
+        fields = [name for name in query.get('fields', '').split(',') if name != ''] or list(PACKET_FIELDS)
+        return self.history.query(
+            meter_id=meter_id,
+            tier_label=query.get('tier', 'raw'),
+            fields=fields,
+            start=start if start > 0 else now + start,
+            end=end if end > 0 else now + end,
+        )
+
+    def log_message(self, format, *args):
+        # Dashboards poll, which isn't worth a log line per request.
+        pass
+
+
+def start_history_server(history: HistoryStore, port: int, address: str = '') -> ThreadingHTTPServer:
+    # Serves the history on http://{address}:{port}/history from a daemon thread, see HistoryRequestHandler.
+    handler = type('BoundHistoryRequestHandler', (HistoryRequestHandler,), {'history': history})
+    server = ThreadingHTTPServer((address, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='history-server', daemon=True).start()
+    return server
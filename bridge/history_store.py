@@ -0,0 +1,267 @@
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from bridge.aggregation_windows import format_window
+from smart_meter.packet_layout import PACKET_FIELDS, FIELD_INDEX, FIELD_COUNT, FIELD_DECIMALS, DEFAULT_DECIMALS
+
+# Header of a history file: magic, number of rows written in total, capacity (rows), number of fields, tier interval
+# (s, 0 for raw samples). The header is followed by one column of capacity float64 values for the timestamps, and one
+# per field.
+HISTORY_MAGIC = b'SMHIST01'
+HISTORY_HEADER = struct.Struct('<8sQQQd')
+HISTORY_HEADER_SIZE = 64  # bytes, the columns start 8-byte aligned after the padded header
+
+# Downsampled rows hold the mean of every field within the interval, except for counters, which hold their last value.
+COUNTER_FIELDS = np.array([name.endswith(('delivery', 'redelivery')) or name in ('tariff', 'gas', 'water')
+                           for name in PACKET_FIELDS])
+
+
+@dataclass
+class HistoryTierConfig:
+    interval: float  # s, 0 for raw samples
+    capacity: int  # rows
+
+    @property
+    def label(self) -> str:
+        return 'raw' if self.interval == 0 else format_window(self.interval)
+
+
+class HistoryTier:
+    # Fixed-size columnar ring of (timestamp, fields) rows in a memory-mapped file. Appending writes a single element
+    # per column, and a range is a binary search on the timestamps plus at most two contiguous slices per column. The
+    # row count in the header is written last, so a crash never exposes a partially written row. Rows are appended in
+    # timestamp order, older ones are skipped.
+
+    def __init__(self, path: str, config: HistoryTierConfig):
+        self.path = path
+        self.interval = config.interval
+        self.capacity = config.capacity
+        if self.capacity < 1:
+            raise Exception(f'Invalid history capacity {self.capacity} of tier {config.label} (must be at least 1)')
+
+        size = HISTORY_HEADER_SIZE + (FIELD_COUNT + 1) * self.capacity * 8
+        if not self.is_compatible(path, size):
+            if os.path.exists(path):
+                print(f'History file {path} has a different layout, starting a new history')
+            with open(path, 'wb') as file:
+                file.truncate(size)
+                file.write(HISTORY_HEADER.pack(HISTORY_MAGIC, 0, self.capacity, FIELD_COUNT, self.interval))
+
+        self.file = open(path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), size)
+        # Column 0 holds the timestamps, column i + 1 field i of PACKET_FIELDS.
+        self.columns = np.ndarray((FIELD_COUNT + 1, self.capacity), dtype='<f8', buffer=self.mmap,
+                                  offset=HISTORY_HEADER_SIZE)
+        self.count = HISTORY_HEADER.unpack_from(self.mmap)[1]
+        self.last_timestamp = self.columns[0, (self.count - 1) % self.capacity] if self.count > 0 else -math.inf
+
+        # Downsampling state: the interval being accumulated, and the sums and counts of the fields within it.
+        self.window: Optional[float] = None
+        self.sums = np.zeros(FIELD_COUNT)
+        self.counts = np.zeros(FIELD_COUNT)
+        self.last = np.full(FIELD_COUNT, np.nan)
+
+    def is_compatible(self, path: str, size: int) -> bool:
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+        with open(path, 'rb') as file:
+            magic, _, capacity, field_count, interval = HISTORY_HEADER.unpack(file.read(HISTORY_HEADER.size))
+        return magic == HISTORY_MAGIC and capacity == self.capacity and field_count == FIELD_COUNT \
+            and interval == self.interval
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def add(self, timestamp: float, values: np.ndarray):
+        if self.interval == 0:
+            self.append(timestamp, values)
+            return
+
+        window = math.floor(timestamp / self.interval) * self.interval
+        if self.window is not None and window != self.window:
+            if window < self.window:
+                return
+            self.flush()
+        self.window = window
+
+        valid = ~np.isnan(values)
+        self.sums[valid] += values[valid]
+        self.counts[valid] += 1
+        self.last[valid] = values[valid]
+
+    def flush(self):
+        # Appends the row of the interval accumulated so far.
+        with np.errstate(invalid='ignore', divide='ignore'):
+            row = np.where(COUNTER_FIELDS, self.last, self.sums / self.counts)
+        self.append(self.window, row)
+
+        self.sums.fill(0.0)
+        self.counts.fill(0)
+        self.last.fill(np.nan)
+
+    def append(self, timestamp: float, values: np.ndarray):
+        if timestamp <= self.last_timestamp:
+            return
+
+        position = self.count % self.capacity
+        self.columns[0, position] = timestamp
+        self.columns[1:, position] = values
+        self.count += 1
+        self.last_timestamp = timestamp
+        struct.pack_into('<Q', self.mmap, 8, self.count)
+
+    def position(self, index: int) -> int:
+        # Position in the ring of the index-th oldest row.
+        return (self.count - len(self) + index) % self.capacity
+
+    def bisect(self, timestamp: float) -> int:
+        # Index of the oldest row at or after the timestamp.
+        low, high = 0, len(self)
+        timestamps = self.columns[0]
+        while low < high:
+            middle = (low + high) // 2
+            if timestamps[self.position(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, start: float, end: float, field_indices: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        # Returns the timestamps of the rows within [start, end), and the given fields' columns of those rows.
+        first = self.bisect(start)
+        count = self.bisect(end) - first
+        rows = [0, *(index + 1 for index in field_indices)]
+
+        begin = self.position(first) if count > 0 else 0
+        if begin + count <= self.capacity:
+            data = self.columns[rows, begin:begin + count]
+        else:
+            data = np.concatenate((self.columns[rows, begin:], self.columns[rows, :begin + count - self.capacity]), axis=1)
+        return data[0], data[1:]
+
+    def close(self):
+        self.mmap.flush()
+        # The ndarray holds a buffer export of the mmap, which must be released before the mmap can be closed.
+        del self.columns
+        self.mmap.close()
+        self.file.close()
+
+
+class HistoryStore:
+    # Embedded history of every meter's packets, in a HistoryTier per meter and tier: raw samples and downsampled
+    # intervals, each a fixed number of rows, so disk use is bounded by the tiers' capacities. The history already in
+    # the directory is opened right away, so it can be queried before (or without) its meter producing new samples.
+
+    def __init__(self, directory: str, tiers: list[HistoryTierConfig]):
+        self.directory = directory
+        self.tiers = tiers
+        self.meters: dict[str, list[HistoryTier]] = {}  # file name of the meter -> its tiers
+        self.file_names: dict[str, str] = {}  # meter id -> file name
+        self.meter_ids: dict[str, str] = {}  # file name -> meter id, the file name until the meter produced a sample
+        # Packets of different meters are added from different threads, and queries come from the history server.
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        suffixes = tuple(f'.{tier.label}.hist' for tier in tiers)
+        for file_name in sorted(os.listdir(directory)):
+            for suffix in suffixes:
+                if file_name.endswith(suffix):
+                    self.get_tiers(file_name.removesuffix(suffix))
+
+    def get_tiers(self, meter_id: str) -> list[HistoryTier]:
+        name = self.file_names.get(meter_id)
+        if name is None:
+            name = self.file_names[meter_id] = get_file_name(meter_id)
+            self.meter_ids[name] = meter_id
+        if name not in self.meters:
+            self.meters[name] = [HistoryTier(os.path.join(self.directory, f'{name}.{tier.label}.hist'), tier)
+                                 for tier in self.tiers]
+        return self.meters[name]
+
+    def add(self, meter_id: str, timestamp: float, values: array):
+        row = np.frombuffer(values, dtype='d')
+        with self.lock:
+            for tier in self.get_tiers(meter_id):
+                tier.add(timestamp, row)
+
+    def query(self, meter_id: str, tier_label: str, fields: list[str], start: float, end: float) -> dict:
+        for name in fields:
+            if name not in FIELD_INDEX:
+                raise Exception(f'Invalid history field "{name}" (must be one of {", ".join(FIELD_INDEX)})')
+
+        labels = [config.label for config in self.tiers]
+        if tier_label not in labels:
+            raise Exception(f'Invalid history tier "{tier_label}" (must be one of {", ".join(labels)})')
+
+        with self.lock:
+            name = self.file_names.get(meter_id, get_file_name(meter_id))
+            if name not in self.meters:
+                raise Exception(f'No history of meter "{meter_id}"')
+            tier = self.meters[name][labels.index(tier_label)]
+            timestamps, columns = tier.query(start, end, [FIELD_INDEX[name] for name in fields])
+
+        return {
+            'meter': meter_id,
+            'tier': tier_label,
+            'timestamps': [round(timestamp, 3) for timestamp in timestamps.tolist()],
+            'fields': {name: [None if value != value else round(value, get_decimals(name)) for value in column.tolist()]
+                       for name, column in zip(fields, columns)},
+        }
+
+    def describe(self) -> dict:
+        # The meters with history, and the number of rows and time range of each of their tiers.
+        with self.lock:
+            return {self.meter_ids[name]: {config.label: {
+                'interval': config.interval,
+                'capacity': tier.capacity,
+                'rows': len(tier),
+                'start': float(tier.columns[0, tier.position(0)]) if len(tier) > 0 else None,
+                'end': float(tier.last_timestamp) if len(tier) > 0 else None,
+            } for config, tier in zip(self.tiers, tiers)} for name, tiers in self.meters.items()}
+
+    def close(self):
+        with self.lock:
+            for tiers in self.meters.values():
+                for tier in tiers:
+                    tier.close()
+            self.meters.clear()
+            self.file_names.clear()
+            self.meter_ids.clear()
+
+
+def get_file_name(meter_id: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', meter_id)
+
+
+def get_decimals(name: str) -> int:
+    return FIELD_DECIMALS.get(name.rsplit('/', 1)[-1], DEFAULT_DECIMALS)
+
+
+def parse_history_tiers(value: str) -> list[HistoryTierConfig]:
+    # Parses eg. 'raw=3600,60=10080,900=35040' into tiers: raw samples, or intervals in seconds, and their capacity
+    # in rows.
+    tiers = []
+    for item in value.split(','):
+        if item.strip() == '':
+            continue
+        if '=' not in item:
+            raise Exception(f'Invalid history tier "{item}" (must be eg. "raw=3600" or "60=10080")')
+
+        interval, capacity = (part.strip() for part in item.split('=', 1))
+        tier = HistoryTierConfig(interval=0.0 if interval == 'raw' else float(interval), capacity=int(capacity))
+        if tier.interval < 0.0:
+            raise Exception(f'Invalid history tier interval {tier.interval:g} (must be positive)')
+        tiers.append(tier)
+
+    if len(tiers) == 0:
+        raise Exception('No history tiers defined')
+    return sorted(tiers, key=lambda tier: tier.interval)
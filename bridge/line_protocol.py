@@ -0,0 +1,51 @@
+import math
+from array import array
+
+from smart_meter.packet_layout import PACKET_FIELDS, FIELD_DECIMALS, DEFAULT_DECIMALS
+
+# Characters escaped with a backslash in InfluxDB line protocol, see
+# https://docs.influxdata.com/influxdb/v2/reference/syntax/line-protocol/#special-characters
+MEASUREMENT_ESCAPES = str.maketrans({',': '\\,', ' ': '\\ '})
+KEY_ESCAPES = str.maketrans({',': '\\,', '=': '\\=', ' ': '\\ '})
+
+INTEGER_FIELDS = ('tariff',)
+
+
+class LineProtocolEncoder:
+    # Encodes the flat packets of one meter as InfluxDB line protocol, one line per packet, eg.
+    #
+    #   smart_meter,meter=main l1_voltage=230.1,l1_power=0.276,power=0.276,tariff=2i 1700000000123456000
+    #
+    # Field keys are the packet fields with '_' for '/' (eg. l1_energy_delivery), rounded like the published topics.
+    # Missing (and infinite) fields are left out, and packets without any field are skipped. The line prefix and the
+    # field keys are built once, instead of for every packet.
+
+    def __init__(self, measurement: str, tags: dict[str, str]):
+        self.prefix = measurement.translate(MEASUREMENT_ESCAPES) + ''.join(
+            f',{key.translate(KEY_ESCAPES)}={value.translate(KEY_ESCAPES)}' for key, value in sorted(tags.items())
+            if value != '') + ' '
+
+        # (index, 'key=', decimals), decimals is None for integer fields
+        self.fields: list[tuple[int, str, int | None]] = []
+        for index, name in enumerate(PACKET_FIELDS):
+            key = name.replace('/', '_').translate(KEY_ESCAPES)
+            decimals = None if name in INTEGER_FIELDS else FIELD_DECIMALS.get(name.rsplit('/', 1)[-1], DEFAULT_DECIMALS)
+            self.fields.append((index, f'{key}=', decimals))
+
+    def encode(self, timestamp: float, values: array) -> str | None:
+        # The line of a packet acquired at the given unix time (s), with a nanosecond timestamp.
+        fields = []
+        for index, key, decimals in self.fields:
+            value = values[index]
+            if not math.isfinite(value):
+                continue
+            if decimals is None:
+                fields.append(f'{key}{int(value)}i')
+            else:
+                fields.append(f'{key}{round(value, decimals)!r}')
+
+        if len(fields) == 0:
+            return None
+        # A float unix time only holds about microseconds, so the nanoseconds are rounded to microseconds rather than
+        # carrying float noise.
+        return f'{self.prefix}{",".join(fields)} {round(timestamp * 1e6) * 1000}\n'
@@ -0,0 +1,317 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+import time
+from array import array
+from dataclasses import dataclass, field
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Optional
+
+from bridge.bridge_config import MeterConfig
+from smart_meter.metrics import metrics, Labels
+from smart_meter.packet_layout import FIELD_COUNT, packet_to_array, array_to_packet
+from smart_meter.smart_meter import SmartMeter
+from smart_meter.smart_meter_factory import build_smart_meter, SMART_METER_CONNECTION_TYPE, SMART_METER_TCP_ADDRESS, \
+    SMART_METER_TCP_PORT, SMART_METER_MODBUS_BUS, SMART_METER_SERIAL_PORT
+from smart_meter.smart_meter_packet import SmartMeterPacket
+
+# Ring header: number of samples written and monotonic time (s) of the worker's last heartbeat, followed by the activity
+# of every meter of the worker: the monotonic time (s) of its last sample, or of its next read attempt when it reported
+# one (see SmartMeter.report_activity).
+RING_HEADER = struct.Struct('<Qd')
+RING_METER_ACTIVITY = struct.Struct('<d')
+# Ring slot: sequence number of the sample (0 while it is being written), meter index, unix timestamp (s), followed by
+# the packet in the flat packet layout.
+RING_SLOT_HEADER = struct.Struct('<Qqd')
+RING_SLOT = struct.Struct(f'<Qqd{FIELD_COUNT}d')
+
+WORKER_HEARTBEAT_INTERVAL = 1.0  # s
+WORKER_READ_INTERVAL = 0.01  # s between reads of the rings
+WORKER_SUPERVISE_INTERVAL = 1.0  # s
+WORKER_RESTART_DELAY = 1.0  # s, doubled after every restart that didn't produce a sample
+WORKER_MAX_RESTART_DELAY = 60.0  # s
+
+
+class SampleRing:
+    # Single-producer, single-consumer ring buffer of samples in shared memory. The worker process writes a slot,
+    # then its sequence number, then the number of samples written. The reader copies a slot and checks its sequence
+    # number before and after, so a slot the writer lapped while it was being read is counted as dropped rather than
+    # read torn. When the reader falls more than a whole ring behind, the oldest samples are dropped.
+
+    def __init__(self, shared_memory: SharedMemory, capacity: int, meters: int):
+        self.shared_memory = shared_memory
+        self.capacity = capacity
+        self.buffer = shared_memory.buf
+        self.slots_offset = get_activity_offset(meters)
+
+        self.written = RING_HEADER.unpack_from(self.buffer)[0]  # a restarted worker continues the sequence
+        self.read = self.written
+        self.dropped = 0
+
+    @staticmethod
+    def create(capacity: int, meters: int) -> 'SampleRing':
+        if capacity < 1:
+            raise Exception(f'Invalid ring size {capacity} (must be at least 1)')
+        size = get_activity_offset(meters) + capacity * RING_SLOT.size
+        shared_memory = SharedMemory(create=True, size=size)
+        shared_memory.buf[:size] = bytes(size)
+        return SampleRing(shared_memory, capacity, meters)
+
+    @staticmethod
+    def attach(name: str, capacity: int, meters: int) -> 'SampleRing':
+        return SampleRing(SharedMemory(name=name), capacity, meters)
+
+    @property
+    def name(self) -> str:
+        return self.shared_memory.name
+
+    @property
+    def heartbeat(self) -> float:
+        return RING_HEADER.unpack_from(self.buffer)[1]
+
+    def activity(self, meter_index: int) -> float:
+        return RING_METER_ACTIVITY.unpack_from(self.buffer, get_activity_offset(meter_index))[0]
+
+    def write(self, meter_index: int, timestamp: float, values: array):
+        sequence = self.written + 1
+        offset = self.slots_offset + (sequence - 1) % self.capacity * RING_SLOT.size
+        RING_SLOT.pack_into(self.buffer, offset, 0, meter_index, timestamp, *values)
+        struct.pack_into('<Q', self.buffer, offset, sequence)
+
+        self.written = sequence
+        now = time.monotonic()
+        RING_HEADER.pack_into(self.buffer, 0, sequence, now)
+        self.report_activity(meter_index, now)
+
+    def report_activity(self, meter_index: int, next_attempt: float):
+        RING_METER_ACTIVITY.pack_into(self.buffer, get_activity_offset(meter_index), next_attempt)
+
+    def beat(self):
+        struct.pack_into('<d', self.buffer, 8, time.monotonic())
+
+    def read_samples(self) -> list[tuple[int, float, array]]:
+        # Returns the (meter index, timestamp, values) of every sample written since the last call.
+        written = RING_HEADER.unpack_from(self.buffer)[0]
+        if written - self.read > self.capacity:
+            self.dropped += written - self.read - self.capacity
+            self.read = written - self.capacity
+
+        samples = []
+        while self.read < written:
+            sequence = self.read + 1
+            self.read = sequence
+            offset = self.slots_offset + (sequence - 1) % self.capacity * RING_SLOT.size
+
+            if struct.unpack_from('<Q', self.buffer, offset)[0] != sequence:
+                self.dropped += 1
+                continue
+            _, meter_index, timestamp = RING_SLOT_HEADER.unpack_from(self.buffer, offset)
+            values = array('d')
+            values.frombytes(self.buffer[offset + RING_SLOT_HEADER.size:offset + RING_SLOT.size])
+            if struct.unpack_from('<Q', self.buffer, offset)[0] != sequence:
+                # Overwritten while it was being copied.
+                self.dropped += 1
+                continue
+            samples.append((meter_index, timestamp, values))
+
+        return samples
+
+    def close(self, unlink: bool = False):
+        self.buffer = None
+        self.shared_memory.close()
+        if unlink:
+            self.shared_memory.unlink()
+
+
+def get_activity_offset(meter_index: int) -> int:
+    return RING_HEADER.size + meter_index * RING_METER_ACTIVITY.size
+
+
+class WorkerSmartMeter(SmartMeter):
+    # Stands in for a smart meter that is measured by a worker process, see MeterWorkerPool.
+
+    def __init__(self, meter_id: str):
+        self.meter_id = meter_id
+        self.sample_callback: Optional[Callable[[SmartMeterPacket, float], None]] = None
+
+    def start_measuring(self, packet_callback: Callable[[SmartMeterPacket], None]):
+        raise Exception(f'Smart meter {self.meter_id} is measured by a worker process')
+
+    async def receive_samples(self, sample_callback: Callable[[SmartMeterPacket, float], None]):
+        # Samples are passed on with the timestamp at which the worker process acquired them.
+        self.sample_callback = sample_callback
+        await asyncio.get_running_loop().create_future()
+
+
+@dataclass
+class MeterWorker:
+    name: str
+    meters: list[MeterConfig]
+    smart_meters: list[WorkerSmartMeter]
+    ring: SampleRing
+    process: Optional[multiprocessing.Process] = None
+    started: float = 0.0  # monotonic time (s)
+    restarts: int = 0
+    restart_delay: float = WORKER_RESTART_DELAY
+    next_start: float = 0.0  # monotonic time (s)
+    reported_dropped: int = 0
+    metrics_labels: Labels = field(init=False)
+
+    def __post_init__(self):
+        self.metrics_labels = (('worker', self.name),)
+
+
+class MeterWorkerPool:
+    # Measures the smart meters in worker processes, one per physical bus or meter source (see get_worker_name), so
+    # a blocking serial read or a hung Modbus transaction only ever stalls the meters on that same bus, and decoding
+    # isn't limited to the bridge process' GIL. Workers write their samples into a SampleRing each, which the bridge
+    # process reads and hands to the WorkerSmartMeter of every meter. Workers that exit, whose event loop stops
+    # producing heartbeats, or with a meter that neither acquired a sample nor completed a read attempt for the timeout
+    # (a meter that is offline keeps completing failed polls, backing off), are killed and restarted.
+
+    def __init__(self, meters: list[MeterConfig], ring_size: int, timeout: float):
+        self.timeout = timeout
+        # Spawned rather than forked, so workers don't inherit the event loop and the MQTT client's thread.
+        self.context = multiprocessing.get_context('spawn')
+
+        groups: dict[str, list[MeterConfig]] = {}
+        for meter in meters:
+            groups.setdefault(get_worker_name(meter), []).append(meter)
+
+        self.smart_meters: dict[str, WorkerSmartMeter] = {meter.id: WorkerSmartMeter(meter.id) for meter in meters}
+        self.workers = [MeterWorker(name, group, [self.smart_meters[meter.id] for meter in group],
+                                    SampleRing.create(ring_size, len(group)))
+                        for name, group in groups.items()]
+
+    async def run(self):
+        try:
+            for worker in self.workers:
+                self.start_worker(worker)
+
+            next_supervise = time.monotonic() + WORKER_SUPERVISE_INTERVAL
+            while True:
+                await asyncio.sleep(WORKER_READ_INTERVAL)
+                for worker in self.workers:
+                    self.read_worker(worker)
+
+                if time.monotonic() >= next_supervise:
+                    next_supervise += WORKER_SUPERVISE_INTERVAL
+                    for worker in self.workers:
+                        self.supervise_worker(worker)
+        finally:
+            self.stop()
+
+    def start_worker(self, worker: MeterWorker):
+        worker.process = self.context.Process(target=run_worker, name=f'meter-worker-{worker.name}', daemon=True,
+                                              args=(worker.meters, worker.ring.name, worker.ring.capacity))
+        worker.process.start()
+        worker.started = time.monotonic()
+        print(f'Started worker process {worker.process.pid} for {worker.name} '
+              f'({", ".join(meter.id for meter in worker.meters)})')
+
+    def read_worker(self, worker: MeterWorker):
+        for meter_index, timestamp, values in worker.ring.read_samples():
+            smart_meter = worker.smart_meters[meter_index]
+            if smart_meter.sample_callback is not None:
+                smart_meter.sample_callback(array_to_packet(values), timestamp)
+            worker.restart_delay = WORKER_RESTART_DELAY
+
+        if worker.ring.dropped != worker.reported_dropped:
+            print(f'Reading samples of worker {worker.name} fell behind, dropped '
+                  f'{worker.ring.dropped - worker.reported_dropped} sample(s) ({worker.ring.dropped} in total)')
+            worker.reported_dropped = worker.ring.dropped
+            if metrics.enabled:
+                metrics.set('bridge_worker_dropped_total', worker.metrics_labels, worker.ring.dropped, 'counter')
+
+    def supervise_worker(self, worker: MeterWorker):
+        now = time.monotonic()
+        if worker.process is None:
+            if now >= worker.next_start:
+                self.start_worker(worker)
+            return
+
+        reason = None
+        if not worker.process.is_alive():
+            reason = f'exited with code {worker.process.exitcode}'
+        elif now - max(worker.started, worker.ring.heartbeat) > self.timeout:
+            reason = f'sent no heartbeat for {self.timeout:g} s'
+        else:
+            for meter_index, meter in enumerate(worker.meters):
+                if now - max(worker.started, worker.ring.activity(meter_index)) > self.timeout:
+                    reason = f'acquired no samples and attempted no reads of {meter.id} for {self.timeout:g} s'
+                    break
+        if reason is None:
+            return
+
+        print(f'Worker process {worker.process.pid} for {worker.name} {reason}, '
+              f'restarting in {worker.restart_delay:g} s')
+        stop_process(worker.process)
+        worker.process = None
+        worker.restarts += 1
+        worker.next_start = now + worker.restart_delay
+        worker.restart_delay = min(WORKER_MAX_RESTART_DELAY, worker.restart_delay * 2)
+        if metrics.enabled:
+            metrics.increment('bridge_worker_restarts_total', worker.metrics_labels)
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.process is not None:
+                stop_process(worker.process)
+                worker.process = None
+            worker.ring.close(unlink=True)
+
+
+def get_worker_name(meter: MeterConfig) -> str:
+    # Meters behind the same Modbus TCP gateway, on the same named bus or on the same serial port share a worker.
+    settings = meter.settings
+    if settings.get(SMART_METER_CONNECTION_TYPE) == 'tcp':
+        return f'{settings.get(SMART_METER_TCP_ADDRESS)}:{settings.get(SMART_METER_TCP_PORT, "502")}'
+    return settings.get(SMART_METER_MODBUS_BUS) or settings.get(SMART_METER_SERIAL_PORT) or meter.id
+
+
+def stop_process(process: multiprocessing.Process):
+    # A worker stuck in a blocking read won't handle SIGTERM in time, so it is killed outright.
+    process.kill()
+    process.join(timeout=5.0)
+
+
+def run_worker(meters: list[MeterConfig], ring_name: str, ring_size: int):
+    # Entry point of a worker process.
+    ring = SampleRing.attach(ring_name, ring_size, len(meters))
+    try:
+        asyncio.run(measure_worker(meters, ring))
+    finally:
+        ring.close()
+
+
+async def measure_worker(meters: list[MeterConfig], ring: SampleRing):
+    # Meters are built from within the event loop, as the asyncio Modbus clients require a running loop.
+    modbus_buses = {}
+    smart_meters = [build_smart_meter(asynchronous=True, settings=meter.settings, modbus_buses=modbus_buses)
+                    for meter in meters]
+    for index, (meter, smart_meter) in enumerate(zip(meters, smart_meters)):
+        smart_meter.metrics_labels = (('meter', meter.id),)
+        smart_meter.activity_callback = lambda next_attempt, index=index: ring.report_activity(index, next_attempt)
+
+    def write_sample(meter_index: int, packet: SmartMeterPacket):
+        ring.write(meter_index, time.time(), packet_to_array(packet))
+
+    await asyncio.gather(
+        beat(ring),
+        *(smart_meter.start_measuring_async(lambda packet, index=index: write_sample(index, packet))
+          for index, smart_meter in enumerate(smart_meters)),
+    )
+
+
+async def beat(ring: SampleRing):
+    # Heartbeats are written from the event loop, so they stop when the event loop of the worker is blocked.
+    parent = multiprocessing.parent_process()
+    while True:
+        if not parent.is_alive():
+            # The bridge process was killed without stopping its workers. Exiting right away, as a thread blocked in
+            # a serial read would keep the interpreter from shutting down.
+            os._exit(0)
+
+        ring.beat()
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
@@ -0,0 +1,153 @@
+import threading
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.reasoncodes import ReasonCode
+
+from smart_meter.metrics import metrics
+
+MQTT_PROTOCOLS = {'3.1.1': mqtt.MQTTv311, '5': mqtt.MQTTv5}
+
+
+class MqttPublisher:
+    # Publishes over a single paho client, on MQTT 3.1.1 or 5.
+    #
+    # On MQTT 5, every topic gets a topic alias the first time it is published (as long as the broker allows more
+    # aliases, see its CONNACK), after which it is published as its two byte alias instead of the whole topic string.
+    # Aliases only live as long as a connection, so they are assigned again after every reconnect, and messages that
+    # were still queued as an alias are sent with their whole topic. With a message_expiry, the broker drops messages
+    # it couldn't deliver within that many seconds instead of handing stale samples to subscribers that reconnect.
+    # Retained messages never expire, so the retained last values stay available.
+    #
+    # max_inflight limits the QoS 1 and 2 messages awaiting their acknowledgement, after which messages queue in the
+    # client, up to max_queued messages (0 is unlimited). Publishing to a full queue fails.
+
+    def __init__(self, protocol: str = '3.1.1', max_inflight: int = 20, max_queued: int = 0,
+                 message_expiry: float = 0.0, topic_alias_maximum: int = 65535):
+        if protocol not in MQTT_PROTOCOLS:
+            raise Exception(f'Invalid MQTT protocol "{protocol}" (must be one of {", ".join(MQTT_PROTOCOLS)})')
+        if message_expiry > 0.0 and protocol != '5':
+            raise Exception('Message expiry requires MQTT protocol 5')
+
+        self.is_v5 = protocol == '5'
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=MQTT_PROTOCOLS[protocol])
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.max_queued_messages_set(max_queued)
+        self.client.on_connect = self.on_connect
+
+        self.message_expiry = round(message_expiry)
+        self.topic_alias_maximum = topic_alias_maximum if self.is_v5 else 0
+        if self.topic_alias_maximum > 0 and get_out_messages(self.client) is None:
+            # Messages queued with an alias couldn't be recovered after a reconnect, see on_connect.
+            print('Warning: this paho-mqtt version does not expose its message queue, topic aliases are disabled')
+            self.topic_alias_maximum = 0
+        self.properties = self.build_properties_pair()  # of messages without an alias, see build_properties_pair
+
+        # Publishes come from the publishing threads, connects from the paho network thread.
+        self.lock = threading.Lock()
+        self.alias_maximum = 0  # of the current connection
+        self.aliases: dict[str, int] = {}  # topic -> alias, assigned on the current connection
+        self.alias_topics: list[bytes] = []  # topic of alias i + 1
+        self.alias_properties: list[tuple[Optional[Properties], Optional[Properties]]] = []  # of alias i + 1
+        self.established: set[str] = set()  # topics of which the alias was sent along with the topic
+
+    def connect(self, address: str, port: int, keepalive: int = 60, blocking: bool = True):
+        # Without blocking, the client connects from its network thread, so the bridge starts even when the broker is
+        # unreachable.
+        if blocking:
+            self.client.connect(address, port, keepalive)
+        else:
+            self.client.connect_async(address, port, keepalive)
+        self.client.loop_start()
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    def publish(self, topic: str, payload: float | bytes, qos: int = 0, retain: bool = False) -> mqtt.MQTTMessageInfo:
+        if self.topic_alias_maximum == 0:
+            return self.client.publish(topic=topic, payload=payload, qos=qos, retain=retain,
+                                       properties=self.properties[retain])
+
+        with self.lock:
+            if topic in self.established:
+                alias = self.aliases[topic]
+                return self.client.publish(topic='', payload=payload, qos=qos, retain=retain,
+                                           properties=self.alias_properties[alias - 1][retain])
+
+            alias = self.aliases.get(topic)
+            if alias is None and len(self.aliases) < self.alias_maximum:
+                alias = self.assign_alias(topic)
+            if alias is None:
+                return self.client.publish(topic=topic, payload=payload, qos=qos, retain=retain,
+                                           properties=self.properties[retain])
+
+            info = self.client.publish(topic=topic, payload=payload, qos=qos, retain=retain,
+                                       properties=self.alias_properties[alias - 1][retain])
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.established.add(topic)
+            return info
+
+    def assign_alias(self, topic: str) -> int:
+        alias = len(self.aliases) + 1
+        self.aliases[topic] = alias
+        self.alias_topics.append(topic.encode())
+        self.alias_properties.append(self.build_properties_pair(alias))
+        if metrics.enabled:
+            metrics.set('bridge_mqtt_topic_aliases', (), len(self.aliases))
+        return alias
+
+    def build_properties_pair(self, alias: Optional[int] = None) -> tuple[Optional[Properties], Optional[Properties]]:
+        # The properties of messages that are not retained, and of retained ones, indexed by retain.
+        return self.build_properties(alias, self.message_expiry), self.build_properties(alias, 0)
+
+    @staticmethod
+    def build_properties(alias: Optional[int], message_expiry: int) -> Optional[Properties]:
+        if alias is None and message_expiry == 0:
+            return None
+
+        properties = Properties(PacketTypes.PUBLISH)
+        if alias is not None:
+            properties.TopicAlias = alias
+        if message_expiry > 0:
+            properties.MessageExpiryInterval = message_expiry
+        return properties
+
+    def on_connect(self, client: mqtt.Client, userdata, flags: mqtt.ConnectFlags, reason_code: ReasonCode,
+                   properties: Optional[Properties]):
+        if reason_code.is_failure:
+            print(f'Failed to connect to the MQTT broker: {reason_code}')
+            return
+        if self.topic_alias_maximum == 0:
+            return
+
+        with self.lock:
+            # Messages still queued from the previous connection are (re)sent after this callback, on a connection
+            # that doesn't know their aliases, so they are sent with their whole topic and without an alias. The paho
+            # client has no API for its queue, see get_out_messages.
+            out_messages = get_out_messages(client)
+            if out_messages is None:
+                print('Warning: the paho-mqtt message queue is not accessible, topic aliases are disabled')
+                self.topic_alias_maximum = 0
+                self.alias_maximum = 0
+                return
+
+            for message in out_messages.values():
+                if message.properties is not None and hasattr(message.properties, 'TopicAlias'):
+                    message.topic = self.alias_topics[message.properties.TopicAlias - 1]
+                    message.properties = self.properties[bool(message.retain)]
+
+            self.aliases.clear()
+            self.alias_topics.clear()
+            self.alias_properties.clear()
+            self.established.clear()
+            self.alias_maximum = min(self.topic_alias_maximum, getattr(properties, 'TopicAliasMaximum', 0))
+
+
+def get_out_messages(client: mqtt.Client) -> Optional[dict[int, mqtt.MQTTMessage]]:
+    # The queue of messages that were not sent or acknowledged yet, by message id. A private attribute of paho-mqtt
+    # (checked against 2.1), None when a paho-mqtt version doesn't have it.
+    out_messages = getattr(client, '_out_messages', None)
+    return out_messages if isinstance(out_messages, dict) else None
@@ -0,0 +1,101 @@
+import math
+from array import array
+
+import numpy as np
+
+from bridge.aggregation_windows import AggregationWindow, WindowAggregate, format_window, DEFAULT_AGGREGATION_BUFFER_SIZE
+from smart_meter.packet_layout import FIELD_INDEX
+
+# A power sample holds for at most this many sample intervals (the median interval of the buffered samples) in the
+# energy integration. Longer gaps, eg. while the meter was offline, are left out rather than filled with a stale sample.
+MAX_HOLD_INTERVALS = 3.0
+
+
+class PacketAggregator:
+    # Keeps the last buffer_size samples of the aggregated fields in a fixed-size ring buffer, and summarizes them per
+    # window when it ends: mean, min, max and 95th percentile, and for power fields the energy in kWh integrated over
+    # the window (see integrate_energy and MAX_HOLD_INTERVALS). Windows are aligned to multiples of their length in
+    # unix time, so 900 s windows coincide with the quarter-hours that capacity tariffs are billed by.
+
+    def __init__(self, fields: list[str], windows: list[float], buffer_size: int = DEFAULT_AGGREGATION_BUFFER_SIZE):
+        for name in fields:
+            if name not in FIELD_INDEX:
+                raise Exception(f'Invalid aggregation field "{name}" (must be one of {", ".join(FIELD_INDEX)})')
+
+        self.fields = fields
+        self.field_indices = [FIELD_INDEX[name] for name in fields]
+        self.power_fields = [name.endswith('power') for name in fields]
+        self.windows = [AggregationWindow(length=length, label=format_window(length)) for length in sorted(windows)]
+
+        self.timestamps = np.full(buffer_size, np.nan)
+        self.values = np.full((buffer_size, len(fields)), np.nan)
+        self.position = 0
+        self.size = 0
+
+    def add(self, timestamp: float, values: array) -> list[WindowAggregate]:
+        # Adds a sample, and returns the aggregates of the windows that ended before it.
+        aggregates = []
+        for window in self.windows:
+            if window.end is not None and timestamp >= window.end:
+                aggregates.append(self.aggregate(window.label, window.end - window.length, window.end))
+            if window.end is None or timestamp >= window.end:
+                window.end = (math.floor(timestamp / window.length) + 1) * window.length
+
+        self.timestamps[self.position] = timestamp
+        self.values[self.position] = [values[index] for index in self.field_indices]
+        self.position = (self.position + 1) % len(self.timestamps)
+        self.size = min(self.size + 1, len(self.timestamps))
+
+        return aggregates
+
+    def aggregate(self, label: str, start: float, end: float) -> WindowAggregate:
+        if self.size == len(self.timestamps) and self.timestamps[self.position] > start:
+            # The oldest sample in the full buffer is newer than the window start, so samples were overwritten.
+            print(f'Aggregation buffer too small for the {label} window, only the last {self.size} samples were '
+                  f'aggregated. Consider increasing AGGREGATION_BUFFER_SIZE.')
+
+        # The samples of the window in order, preceded by the last sample before the window for the energy integration.
+        in_window = (self.timestamps >= start) & (self.timestamps < end)
+        before = np.where(self.timestamps < start)[0]
+        if len(before) > 0:
+            in_window[before[np.argmax(self.timestamps[before])]] = True
+        order = np.argsort(self.timestamps[in_window])
+        timestamps = self.timestamps[in_window][order]
+        values = self.values[in_window][order]
+        first = int(np.searchsorted(timestamps, start))
+        max_hold = self.get_max_hold()
+
+        aggregate = WindowAggregate(label=label, start=start, end=end, samples=len(timestamps) - first)
+        for column, name in enumerate(self.fields):
+            valid = ~np.isnan(values[:, column])
+            column_values = values[first:, column][valid[first:]]
+            if len(column_values) == 0:
+                continue
+
+            statistics = {
+                'mean': float(column_values.mean()),
+                'min': float(column_values.min()),
+                'max': float(column_values.max()),
+                'p95': float(np.percentile(column_values, 95)),
+            }
+            if self.power_fields[column]:
+                statistics['energy'] = integrate_energy(timestamps[valid], values[valid, column], start, end, max_hold)
+            aggregate.fields[name] = statistics
+
+        return aggregate
+
+    def get_max_hold(self) -> float:
+        # The buffer is filled from the start, so its first size slots hold samples.
+        intervals = np.diff(np.sort(self.timestamps[:self.size]))
+        if len(intervals) == 0:
+            return math.inf
+        return float(np.median(intervals)) * MAX_HOLD_INTERVALS
+
+
+def integrate_energy(timestamps: np.ndarray, power: np.ndarray, start: float, end: float,
+                     max_hold: float = math.inf) -> float:
+    # Every power sample (kW) holds until the next sample, the energy (kWh) is the part of that within the window.
+    # Samples more than max_hold seconds before the next sample (or the window end, for the last one) are left out.
+    holds = np.diff(np.append(timestamps, end)) <= max_hold
+    durations = np.diff(np.append(np.maximum(timestamps, start), end))
+    return float(np.dot(power[holds], durations[holds])) / 3600.0
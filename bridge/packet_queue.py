@@ -0,0 +1,49 @@
+import asyncio
+from collections import deque
+from typing import Literal, Generic, TypeVar
+
+T = TypeVar('T')
+
+OverflowPolicy = Literal['drop-oldest', 'coalesce']
+
+
+class PacketQueue(Generic[T]):
+    # Bounded hand-off between acquisition and publishing. Putting never blocks, so the acquisition cadence never
+    # depends on how fast the publisher drains the queue. When the queue is full, the overflow policy decides what
+    # gets lost:
+    # - 'drop-oldest': the oldest queued item is dropped to make room for the new one.
+    # - 'coalesce': the whole backlog is dropped and only the new (latest) item is kept.
+
+    def __init__(self, max_size: int, overflow_policy: OverflowPolicy = 'drop-oldest'):
+        if max_size < 1:
+            raise Exception(f'Invalid queue size {max_size} (must be at least 1)')
+        if overflow_policy not in ('drop-oldest', 'coalesce'):
+            raise Exception(f'Invalid overflow policy \'{overflow_policy}\' (must be "drop-oldest" or "coalesce")')
+
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.items: deque[T] = deque()
+        self.not_empty = asyncio.Event()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put_nowait(self, item: T):
+        if len(self.items) >= self.max_size:
+            if self.overflow_policy == 'drop-oldest':
+                self.items.popleft()
+                self.dropped += 1
+            else:
+                self.dropped += len(self.items)
+                self.items.clear()
+
+        self.items.append(item)
+        self.not_empty.set()
+
+    async def get(self) -> T:
+        while not self.items:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+
+        return self.items.popleft()
@@ -0,0 +1,305 @@
+import http.client
+import os
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from bridge.line_protocol import LineProtocolEncoder
+from smart_meter.metrics import metrics
+
+# Datagrams stay below the usual Ethernet MTU, so they are never fragmented.
+UDP_MAX_DATAGRAM = 1400  # bytes
+HTTP_TIMEOUT = 10.0  # s
+MAX_RETRY_DELAY = 60.0  # s
+# Client errors that may succeed when retried, any other 4xx response rejects the batch.
+RETRYABLE_HTTP_STATUSES = (408, 429)
+
+
+class PacketSink(ABC):
+    # Receives the samples of every meter next to MQTT publishing, eg. to write them to a time-series database
+    # directly. write is called from the publishing threads and must return quickly.
+
+    @abstractmethod
+    def write(self, meter_id: str, timestamp: float, values: array):
+        pass
+
+    def close(self):
+        pass
+
+
+class SinkRejected(Exception):
+    # The batch can never be delivered, eg. a field type conflict or a bad token, so retrying it is pointless.
+    pass
+
+
+class SinkTransport(ABC):
+    # Delivers a batch of encoded lines, raising when the batch was not delivered (SinkRejected when it never will be).
+    name: str
+
+    @abstractmethod
+    def send(self, data: bytes):
+        pass
+
+    def close(self):
+        pass
+
+
+@dataclass
+class PendingSample:
+    meter_id: str
+    timestamp: float  # unix time (s)
+    values: array
+
+
+class LineProtocolSink(PacketSink):
+    # Writes every sample as a line of InfluxDB line protocol (see LineProtocolEncoder) through a transport, in batches
+    # of at most batch_size lines, flushed at least every flush_interval seconds.
+    #
+    # Samples wait in a buffer of max_pending samples, and are encoded and sent from the sink's own thread, so a slow
+    # database never stalls acquisition. When the buffer is full, write waits up to max_block seconds for the sink to
+    # catch up, which slows down publishing (the packet queues then drop samples, see PACKET_QUEUE_OVERFLOW_POLICY),
+    # after which the oldest waiting sample is dropped. While the transport is failing, write doesn't wait, and the
+    # failed batch is retried, backing off up to MAX_RETRY_DELAY seconds. Rejected batches are dropped instead.
+
+    def __init__(self, transport: SinkTransport, measurement: str = 'smart_meter', batch_size: int = 5000,
+                 flush_interval: float = 1.0, max_pending: int = 100000, max_block: float = 1.0):
+        if batch_size < 1 or max_pending < batch_size:
+            raise Exception(f'Invalid sink batch size {batch_size} or max pending {max_pending} (must be at least 1, '
+                            f'and max pending at least the batch size)')
+
+        self.transport = transport
+        self.measurement = measurement
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_block = max_block
+        self.encoders: dict[str, LineProtocolEncoder] = {}
+        self.metrics_labels = (('sink', transport.name),)
+
+        self.pending: deque[PendingSample] = deque()
+        self.condition = threading.Condition()
+        self.oldest_pending = 0.0  # monotonic time at which the oldest pending sample was written
+        self.failing = False
+        self.closed = False
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self.run, name=f'{transport.name}-sink', daemon=True)
+        self.thread.start()
+
+    def write(self, meter_id: str, timestamp: float, values: array):
+        with self.condition:
+            if len(self.pending) >= self.max_pending and not self.failing:
+                self.condition.wait_for(lambda: len(self.pending) < self.max_pending or self.failing, self.max_block)
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 10000 == 0:
+                    print(f'The {self.transport.name} sink fell behind, dropped {self.dropped} sample(s) in total')
+
+            if len(self.pending) == 0:
+                self.oldest_pending = time.monotonic()
+            self.pending.append(PendingSample(meter_id, timestamp, values))
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                # The first sample starts the flush interval.
+                self.condition.notify_all()
+
+    def run(self):
+        retry_delay = 1.0
+        while True:
+            with self.condition:
+                while not self.is_batch_due():
+                    self.condition.wait(self.time_until_flush() if len(self.pending) > 0 else None)
+                if self.closed and len(self.pending) == 0:
+                    return
+
+                # Samples left behind are newer than the oldest one of the batch, so keeping its time only flushes
+                # them sooner.
+                batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                self.condition.notify_all()
+
+            data = self.encode(batch)
+            while not self.send(data, len(batch)):
+                with self.condition:
+                    self.failing = True
+                    self.condition.notify_all()
+                    if self.condition.wait_for(lambda: self.closed, retry_delay):
+                        return
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+            if self.failing:
+                print(f'The {self.transport.name} sink recovered')
+                self.failing = False
+            retry_delay = 1.0
+
+    def is_batch_due(self) -> bool:
+        return len(self.pending) >= self.batch_size or self.closed or \
+            (len(self.pending) > 0 and self.time_until_flush() <= 0.0)
+
+    def time_until_flush(self) -> float:
+        return self.oldest_pending + self.flush_interval - time.monotonic()
+
+    def encode(self, batch: list[PendingSample]) -> bytes:
+        lines = []
+        for sample in batch:
+            encoder = self.encoders.get(sample.meter_id)
+            if encoder is None:
+                encoder = self.encoders[sample.meter_id] = LineProtocolEncoder(self.measurement,
+                                                                               {'meter': sample.meter_id})
+            line = encoder.encode(sample.timestamp, sample.values)
+            if line is not None:
+                lines.append(line)
+        return ''.join(lines).encode()
+
+    def send(self, data: bytes, samples: int) -> bool:
+        # Whether the batch is done with: delivered, or rejected and dropped.
+        if len(data) == 0:
+            return True
+
+        start = time.perf_counter()
+        try:
+            self.transport.send(data)
+        except SinkRejected as ex:
+            print(f'The {self.transport.name} sink rejected a batch, dropped {samples} sample(s): {ex}')
+            with self.condition:
+                self.dropped += samples
+            if metrics.enabled:
+                metrics.increment('bridge_sink_errors_total', self.metrics_labels)
+                metrics.set('bridge_sink_dropped_total', self.metrics_labels, self.dropped, 'counter')
+            return True
+        except Exception as ex:
+            if not self.failing:
+                print(f'An error occurred while writing to the {self.transport.name} sink: {ex}')
+            if metrics.enabled:
+                metrics.increment('bridge_sink_errors_total', self.metrics_labels)
+            return False
+
+        if metrics.enabled:
+            metrics.observe('bridge_sink_write_seconds', self.metrics_labels, time.perf_counter() - start)
+            metrics.increment('bridge_sink_samples_total', self.metrics_labels, samples)
+            metrics.increment('bridge_sink_bytes_total', self.metrics_labels, len(data))
+            metrics.set('bridge_sink_pending', self.metrics_labels, len(self.pending))
+            metrics.set('bridge_sink_dropped_total', self.metrics_labels, self.dropped, 'counter')
+        return True
+
+    def close(self):
+        # Flushes the pending samples, unless the transport is failing.
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(HTTP_TIMEOUT)
+        self.transport.close()
+
+
+class HttpTransport(SinkTransport):
+    # POSTs batches over a persistent connection, eg. to InfluxDB 2's /api/v2/write?org=home&bucket=energy&precision=ns
+    # (with a token), or InfluxDB 1's /write?db=energy&precision=ns.
+    name = 'http'
+
+    def __init__(self, url: str, token: str | None = None):
+        self.url = urlsplit(url)
+        self.path = self.url.path + (f'?{self.url.query}' if self.url.query else '')
+        self.headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if token:
+            self.headers['Authorization'] = f'Token {token}'
+        self.connection: http.client.HTTPConnection | None = None
+
+    def send(self, data: bytes):
+        if self.connection is None:
+            connection_type = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            self.connection = connection_type(self.url.hostname, self.url.port, timeout=HTTP_TIMEOUT)
+
+        try:
+            self.connection.request('POST', self.path, body=data, headers=self.headers)
+            response = self.connection.getresponse()
+            body = response.read()
+        except Exception:
+            self.close()
+            raise
+
+        if response.status >= 300:
+            message = f'HTTP {response.status} {response.reason}: {body[:200].decode(errors="replace")}'
+            if 400 <= response.status < 500 and response.status not in RETRYABLE_HTTP_STATUSES:
+                raise SinkRejected(message)
+            raise Exception(message)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class UdpTransport(SinkTransport):
+    # Sends batches as datagrams of whole lines, eg. to InfluxDB 1's UDP service or Telegraf's socket_listener. UDP
+    # never reports lost datagrams.
+    name = 'udp'
+
+    def __init__(self, url: str):
+        url = urlsplit(url)
+        if url.hostname is None or url.port is None:
+            raise Exception(f'Invalid UDP sink "{url.geturl()}" (must be eg. "udp://localhost:8089")')
+        self.address = (url.hostname, url.port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, data: bytes):
+        start = 0
+        while start < len(data):
+            end = len(data)
+            if end - start > UDP_MAX_DATAGRAM:
+                # Up to and including the last newline that fits, or a whole (oversized) line.
+                end = data.rfind(b'\n', start, start + UDP_MAX_DATAGRAM) + 1
+                if end <= start:
+                    end = data.find(b'\n', start) + 1 or len(data)
+            self.socket.sendto(data[start:end], self.address)
+            start = end
+
+    def close(self):
+        self.socket.close()
+
+
+class RotatingFileTransport(SinkTransport):
+    # Appends batches to a local file. Once the file would exceed max_size bytes, it is renamed to {path}.1 (and
+    # {path}.1 to {path}.2, and so on, keeping backups files) and a new file is started.
+    name = 'file'
+
+    def __init__(self, path: str, max_size: int, backups: int):
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'ab')
+
+    def send(self, data: bytes):
+        if self.file.tell() > 0 and self.file.tell() + len(data) > self.max_size:
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{index}'):
+                os.replace(f'{self.path}.{index}', f'{self.path}.{index + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        self.file = open(self.path, 'wb')
+
+    def close(self):
+        self.file.close()
+
+
+def build_sink_transport(url: str, token: str | None, file_max_size: int, file_backups: int) -> SinkTransport:
+    scheme = urlsplit(url).scheme
+    if scheme in ('http', 'https'):
+        return HttpTransport(url, token)
+    if scheme == 'udp':
+        return UdpTransport(url)
+    if scheme == 'file':
+        return RotatingFileTransport(urlsplit(url).path, file_max_size, file_backups)
+    raise Exception(f'Invalid sink "{url}" (must be a http://, https://, udp:// or file:// URL)')
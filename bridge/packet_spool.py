@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class SpooledMessage:
+    id: int
+    timestamp: float  # unix time (s) at which the message was spooled
+    topic: str
+    payload: bytes
+
+
+class PacketSpool:
+    # Bounded on-disk first-in-first-out store for messages that could not be published while the MQTT broker was
+    # unreachable. When the spool exceeds max_size bytes of payload, or messages get older than max_age seconds, the
+    # oldest messages are dropped. Safe to use from multiple threads.
+
+    def __init__(self, path: str, max_size: int, max_age: float):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS messages ('
+                                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                'timestamp REAL NOT NULL, '
+                                'topic TEXT NOT NULL, '
+                                'payload BLOB NOT NULL)')
+
+        self.count, self.size = self.connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM messages').fetchone()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, topic: str, payload: bytes):
+        with self.lock:
+            self.connection.execute('INSERT INTO messages (timestamp, topic, payload) VALUES (?, ?, ?)',
+                                    (time.time(), topic, payload))
+            self.count += 1
+            self.size += len(payload)
+            self.enforce_limits()
+
+    def peek(self, limit: int) -> list[SpooledMessage]:
+        with self.lock:
+            rows = self.connection.execute('SELECT id, timestamp, topic, payload FROM messages ORDER BY id LIMIT ?',
+                                           (limit,)).fetchall()
+        return [SpooledMessage(id=row[0], timestamp=row[1], topic=row[2], payload=row[3]) for row in rows]
+
+    def remove(self, messages: list[SpooledMessage]):
+        # Removes the given messages after they were published. They are always the oldest ones, see peek.
+        if len(messages) == 0:
+            return
+
+        with self.lock:
+            cursor = self.connection.execute('DELETE FROM messages WHERE id <= ?', (messages[-1].id,))
+            if cursor.rowcount == len(messages):
+                self.count -= len(messages)
+                self.size -= sum(len(message.payload) for message in messages)
+            else:
+                self.recount()
+
+    def enforce_limits(self):
+        dropped = 0
+
+        oldest = self.connection.execute('SELECT timestamp FROM messages ORDER BY id LIMIT 1').fetchone()
+        if oldest is not None and oldest[0] < time.time() - self.max_age:
+            cursor = self.connection.execute('DELETE FROM messages WHERE timestamp < ?', (time.time() - self.max_age,))
+            dropped += max(0, cursor.rowcount)
+
+        if self.size > self.max_size:
+            # Drop the oldest 10% at once, so a full spool doesn't delete on every append.
+            cursor = self.connection.execute(
+                'DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)',
+                (max(1, self.count // 10),))
+            dropped += max(0, cursor.rowcount)
+
+        if dropped > 0:
+            self.dropped += dropped
+            self.recount()
+            print(f'Spool {self.path} reached its limits, dropped {dropped} oldest message(s) ({self.dropped} in total)')
+
+    def recount(self):
+        self.count, self.size = self.connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM messages').fetchone()
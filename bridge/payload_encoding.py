@@ -0,0 +1,63 @@
+import json
+from typing import Any, Callable, Literal
+
+from bridge.bridge_meter import BridgeMeter
+from smart_meter.burst_trigger import BurstCapture
+from smart_meter.packet_layout import PACKET_FIELDS, FIELD_INDEX, FIELD_DECIMALS, DEFAULT_DECIMALS, packet_to_array
+from smart_meter.smart_meter_packet import SmartMeterPacket
+
+PayloadFormat = Literal['json', 'msgpack', 'cbor']
+
+
+def build_payload_encoder(payload_format: PayloadFormat) -> Callable[[dict[str, Any]], bytes]:
+    # MessagePack and CBOR are optional dependencies, only imported when selected.
+    if payload_format == 'json':
+        return lambda data: json.dumps(data, separators=(',', ':')).encode()
+    elif payload_format == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            raise Exception('The msgpack payload format requires the msgpack package (pip install msgpack)')
+        return msgpack.packb
+    elif payload_format == 'cbor':
+        try:
+            import cbor2
+        except ImportError:
+            raise Exception('The cbor payload format requires the cbor2 package (pip install cbor2)')
+        return cbor2.dumps
+    else:
+        raise Exception(f'Invalid payload format \'{payload_format}\' (must be "json", "msgpack" or "cbor")')
+
+
+def sample_to_dict(meter: BridgeMeter, packet: SmartMeterPacket, timestamp: float) -> dict[str, Any]:
+    return {
+        'meter': meter.id,
+        'timestamp': round(timestamp, 3),
+        **packet.to_dict(),
+    }
+
+
+def burst_to_dict(meter: BridgeMeter, capture: BurstCapture) -> dict[str, Any]:
+    # A burst as columns of the fields read during the burst, preceded by the pre-trigger samples (of which only
+    # those fields are kept). Missing values are None.
+    rows = [meter.packet_transform.apply(packet_to_array(packet)) for _, packet in capture.samples]
+    fields = [(index, name) for index, name in enumerate(PACKET_FIELDS)
+              if any(row[index] == row[index] for row in rows[capture.pre_trigger:])]
+    trigger = capture.trigger
+
+    return {
+        'meter': meter.id,
+        'trigger': {
+            'field': trigger.field,
+            'kind': trigger.kind,
+            'change': round(trigger.change * meter.packet_transform.factors[FIELD_INDEX[trigger.field]], 3),
+            'threshold': trigger.threshold,
+        },
+        'interval': capture.interval,
+        'pre_trigger': capture.pre_trigger,
+        'timestamps': [round(timestamp, 3) for timestamp, _ in capture.samples],
+        'fields': {name: [None if row[index] != row[index]
+                          else round(row[index], FIELD_DECIMALS.get(name.rsplit('/', 1)[-1], DEFAULT_DECIMALS))
+                          for row in rows]
+                   for index, name in fields},
+    }
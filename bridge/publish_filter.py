@@ -0,0 +1,96 @@
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# How often the publish filter counters are logged.
+PUBLISH_FILTER_LOG_INTERVAL = 300.0  # s
+
+
+@dataclass
+class Deadband:
+    absolute: float = 0.0
+    relative: float = 0.0  # fraction of the last published value
+
+    def exceeded(self, last_value: float, value: float) -> bool:
+        difference = abs(value - last_value)
+        if self.relative > 0.0:
+            return difference > abs(last_value) * self.relative
+        if self.absolute > 0.0:
+            return difference > self.absolute
+        return value != last_value
+
+
+class PublishFilter:
+    # Only lets a topic through when its value changed by more than the topic's deadband since it was last published,
+    # or when it hasn't been published for max_silence seconds (a heartbeat, so consumers still see the bridge is alive).
+    # A max_silence of 0 disables the heartbeat.
+    # Deadbands are looked up by the topic relative to the meter's topic prefix (eg. 'l1/power'), then by the last
+    # topic segment (eg. 'power').
+
+    def __init__(self, topic_prefix: str, deadbands: dict[str, Deadband], max_silence: float):
+        self.topic_prefix = topic_prefix
+        self.deadbands = deadbands
+        self.max_silence = max_silence
+
+        self.last_published: dict[str, tuple[float, float]] = {}  # topic -> (value, monotonic time)
+        self.topic_deadbands: dict[str, Deadband] = {}
+
+        self.published = 0
+        self.suppressed = 0
+        self.last_log = time.monotonic()
+
+    def filter(self, topics: dict[str, float]) -> dict[str, float]:
+        now = time.monotonic()
+
+        result = {}
+        for topic, value in topics.items():
+            last = self.last_published.get(topic)
+            if last is not None and (self.max_silence <= 0.0 or now - last[1] < self.max_silence) \
+                    and not self.get_deadband(topic).exceeded(last[0], value):
+                continue
+
+            result[topic] = value
+            self.last_published[topic] = (value, now)
+
+        self.published += len(result)
+        self.suppressed += len(topics) - len(result)
+
+        if now - self.last_log >= PUBLISH_FILTER_LOG_INTERVAL:
+            total = self.published + self.suppressed
+            print(f'Publish filter for {self.topic_prefix}: published {self.published}, suppressed {self.suppressed} '
+                  f'({self.suppressed / max(1, total) * 100:.0f}%) values')
+            self.last_log = now
+
+        return result
+
+    def get_deadband(self, topic: str) -> Deadband:
+        deadband = self.topic_deadbands.get(topic)
+        if deadband is None:
+            relative_topic = topic.removeprefix(f'{self.topic_prefix}/')
+            deadband = self.deadbands.get(relative_topic) \
+                or self.deadbands.get(relative_topic.rsplit('/', 1)[-1]) \
+                or Deadband()
+            self.topic_deadbands[topic] = deadband
+
+        return deadband
+
+
+def parse_deadbands(value: Optional[str]) -> dict[str, Deadband]:
+    # Parses eg. 'power=0.005,voltage=0.5,l1/amperage=2%' into deadbands. Values ending in % are relative.
+    deadbands = {}
+    if not value:
+        return deadbands
+
+    for entry in value.split(','):
+        if entry.strip() == '':
+            continue
+        if '=' not in entry:
+            raise Exception(f'Invalid deadband "{entry}" (must be formatted as field=value or field=value%)')
+
+        field, deadband = (part.strip() for part in entry.split('=', 1))
+        if deadband.endswith('%'):
+            deadbands[field] = Deadband(relative=float(deadband[:-1]) / 100.0)
+        else:
+            deadbands[field] = Deadband(absolute=float(deadband))
+
+    return deadbands
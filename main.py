@@ -1,11 +1,30 @@
+import asyncio
 import os
-from typing import Optional
+import time
+from array import array
+from typing import Optional, TYPE_CHECKING
 
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 
-from smart_meter.smart_meter_factory import build_smart_meter
-from smart_meter.smart_meter_packet import SmartMeterPacket
+from bridge.aggregation_windows import WindowAggregate, DEFAULT_AGGREGATION_FIELDS, DEFAULT_AGGREGATION_BUFFER_SIZE
+from bridge.bridge_config import load_bridge_meters, build_bridge_meter, load_meter_configs, MeterConfig
+from bridge.bridge_meter import BridgeMeter, MeterSample, BridgeMeterDefaults
+from bridge.metrics_server import start_metrics_server
+from bridge.mqtt_publisher import MqttPublisher
+from bridge.packet_queue import PacketQueue
+from bridge.payload_encoding import build_payload_encoder, sample_to_dict, burst_to_dict
+from smart_meter.metrics import metrics
+from smart_meter.burst_trigger import BurstCapture
+from smart_meter.packet_layout import packet_to_array, array_to_packet
+from smart_meter.polling_smart_meter import PollingSmartMeter
+from smart_meter.smart_meter_factory import build_smart_meter, SMART_METER_TYPE
+
+if TYPE_CHECKING:
+    from bridge.history_store import HistoryStore
+    from bridge.meter_workers import MeterWorkerPool
+    from bridge.packet_sink import PacketSink
+    from bridge.packet_spool import PacketSpool
 
 load_dotenv()
 
@@ -15,32 +34,322 @@ MQTT_BROKER_PORT = int(os.getenv('MQTT_BROKER_PORT', '1883'))
 MQTT_TOPIC_PREFIX = os.getenv('MQTT_TOPIC_PREFIX', 'smart-meter')
 MQTT_QOS = int(os.getenv('MQTT_QOS', '0'))
 MQTT_RETAIN = os.getenv('MQTT_RETAIN', 'true') == 'true'
+MQTT_PAYLOAD_MODE = os.getenv('MQTT_PAYLOAD_MODE', 'topics')
+MQTT_PAYLOAD_FORMAT = os.getenv('MQTT_PAYLOAD_FORMAT', 'json')
+MQTT_PACKET_TOPIC = os.getenv('MQTT_PACKET_TOPIC', 'packet')
+MQTT_BURST_TOPIC = os.getenv('MQTT_BURST_TOPIC', 'burst')
+MQTT_PROTOCOL = os.getenv('MQTT_PROTOCOL', '3.1.1')
+MQTT_MAX_INFLIGHT = int(os.getenv('MQTT_MAX_INFLIGHT', '20'))
+MQTT_MAX_QUEUED = int(os.getenv('MQTT_MAX_QUEUED', '0'))
+MQTT_MESSAGE_EXPIRY = float(os.getenv('MQTT_MESSAGE_EXPIRY', '0'))
+MQTT_TOPIC_ALIAS_MAXIMUM = int(os.getenv('MQTT_TOPIC_ALIAS_MAXIMUM', '65535'))
 
 REVERSE_POWER = os.getenv('REVERSE_POWER', 'false') == 'true'
 REVERSE_ENERGY = os.getenv('REVERSE_ENERGY', 'false') == 'true'
 
+PUBLISH_ON_CHANGE = os.getenv('PUBLISH_ON_CHANGE', 'false') == 'true'
+PUBLISH_DEADBANDS = os.getenv('PUBLISH_DEADBANDS', '')
+PUBLISH_MAX_SILENCE = float(os.getenv('PUBLISH_MAX_SILENCE', '60.0'))
+
+AGGREGATION_WINDOWS = os.getenv('AGGREGATION_WINDOWS', '')
+AGGREGATION_FIELDS = os.getenv('AGGREGATION_FIELDS', DEFAULT_AGGREGATION_FIELDS)
+AGGREGATION_BUFFER_SIZE = int(os.getenv('AGGREGATION_BUFFER_SIZE', str(DEFAULT_AGGREGATION_BUFFER_SIZE)))
+
+SMART_METER_CONFIG = os.getenv('SMART_METER_CONFIG')
+
+SPOOL_PATH = os.getenv('SPOOL_PATH')
+SPOOL_MAX_SIZE = int(os.getenv('SPOOL_MAX_SIZE', str(64 * 1024 * 1024)))
+SPOOL_MAX_AGE = float(os.getenv('SPOOL_MAX_AGE', str(7 * 24 * 60 * 60)))
+SPOOL_REPLAY_RATE = float(os.getenv('SPOOL_REPLAY_RATE', '50'))
+
+HISTORY_PATH = os.getenv('HISTORY_PATH')
+HISTORY_TIERS = os.getenv('HISTORY_TIERS', 'raw=3600,60=10080,900=35040')
+HISTORY_PORT = os.getenv('HISTORY_PORT')
+
+SINK_URLS = os.getenv('SINK_URLS', '')
+SINK_TOKEN = os.getenv('SINK_TOKEN')
+SINK_MEASUREMENT = os.getenv('SINK_MEASUREMENT', 'smart_meter')
+SINK_BATCH_SIZE = int(os.getenv('SINK_BATCH_SIZE', '5000'))
+SINK_FLUSH_INTERVAL = float(os.getenv('SINK_FLUSH_INTERVAL', '1.0'))
+SINK_MAX_PENDING = int(os.getenv('SINK_MAX_PENDING', '100000'))
+SINK_MAX_BLOCK = float(os.getenv('SINK_MAX_BLOCK', '1.0'))
+SINK_FILE_MAX_SIZE = int(os.getenv('SINK_FILE_MAX_SIZE', str(64 * 1024 * 1024)))
+SINK_FILE_BACKUPS = int(os.getenv('SINK_FILE_BACKUPS', '5'))
+
+PACKET_QUEUE_SIZE = int(os.getenv('PACKET_QUEUE_SIZE', '16'))
+PACKET_QUEUE_OVERFLOW_POLICY = os.getenv('PACKET_QUEUE_OVERFLOW_POLICY', 'drop-oldest')
+
+WORKER_PROCESSES = os.getenv('WORKER_PROCESSES', 'false') == 'true'
+WORKER_RING_SIZE = int(os.getenv('WORKER_RING_SIZE', '64'))
+WORKER_TIMEOUT = float(os.getenv('WORKER_TIMEOUT', '60.0'))
+
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_MQTT_INTERVAL = float(os.getenv('METRICS_MQTT_INTERVAL', '0'))
+
+
+publisher: Optional[MqttPublisher] = None
+spool: Optional['PacketSpool'] = None
+history: Optional['HistoryStore'] = None
+worker_pool: Optional['MeterWorkerPool'] = None
+sinks: list['PacketSink'] = []
+encode_payload = build_payload_encoder(MQTT_PAYLOAD_FORMAT)
+
+
+def packet_callback(sample: MeterSample):
+    meter = sample.meter
+    start = time.perf_counter()
+    values = meter.packet_transform.apply(packet_to_array(sample.packet))
+
+    if history is not None:
+        history.add(meter.id, sample.timestamp, values)
+
+    for sink in sinks:
+        sink.write(meter.id, sample.timestamp, values)
+
+    if MQTT_PAYLOAD_MODE == 'none':
+        return
+
+    aggregates = []
+    if meter.aggregator is not None:
+        aggregates = meter.aggregator.add(sample.timestamp, values)
 
-mqttc: Optional[mqtt.Client] = None
+    if spool is not None and not publisher.is_connected():
+        # Spooled packets are replayed later as timestamped packet messages, as replaying the per-topic values would
+        # present stale values as current ones. Aggregates of windows that ended meanwhile are spooled as they are
+        # published, as they are only computed once.
+        payload = encode_payload(sample_to_dict(meter, array_to_packet(values), sample.timestamp))
+        spool.append(get_packet_topic(meter), payload)
+        for aggregate in aggregates:
+            for topic, value in build_aggregate_topics(meter, aggregate).items():
+                spool.append(topic, str(value).encode())
+        return
 
+    topics = {}
+    if MQTT_PAYLOAD_MODE in ('topics', 'both'):
+        topics = build_topics(meter, values)
+    payload = None
+    if MQTT_PAYLOAD_MODE in ('packet', 'both'):
+        # The whole packet in a single message, for consumers that want one message per sample.
+        payload = encode_payload(sample_to_dict(meter, array_to_packet(values), sample.timestamp))
+    built = time.perf_counter()
 
-def packet_callback(packet: SmartMeterPacket):
-    packet = post_process_smart_meter_packet(packet)
-    topics = packet.to_topics(topic_prefix=MQTT_TOPIC_PREFIX)
     for topic, value in topics.items():
-        mqttc.publish(topic=topic, payload=value, qos=MQTT_QOS, retain=MQTT_RETAIN)
+        publish(topic, value)
+    if payload is not None:
+        publish(get_packet_topic(meter), payload)
+    for aggregate in aggregates:
+        publish_aggregate(meter, aggregate)
+
+    if metrics.enabled:
+        metrics.observe('bridge_stage_seconds', (*meter.metrics_labels, ('stage', 'build')), built - start)
+        metrics.observe('bridge_stage_seconds', (*meter.metrics_labels, ('stage', 'publish')), time.perf_counter() - built)
+        metrics.observe('bridge_sample_latency_seconds', meter.metrics_labels, time.time() - sample.timestamp)
+
+
+def burst_callback(meter: BridgeMeter, capture: BurstCapture):
+    # Sinks get the burst samples as regular samples, the pre-trigger samples were written as the regular packets
+    # they are.
+    for timestamp, packet in capture.samples[capture.pre_trigger:]:
+        values = meter.packet_transform.apply(packet_to_array(packet))
+        for sink in sinks:
+            sink.write(meter.id, timestamp, values)
+
+    if MQTT_PAYLOAD_MODE == 'none':
+        return
+
+    # Eg. {prefix}/burst, a whole burst in a single message, see burst_to_dict.
+    payload = encode_payload(burst_to_dict(meter, capture))
+    topic = f'{meter.topic_prefix}/{MQTT_BURST_TOPIC}'
+    if spool is not None and not publisher.is_connected():
+        spool.append(topic, payload)
+        return
+    publish(topic, payload)
+
+
+def build_topics(meter: BridgeMeter, values: array) -> dict[str, float]:
+    topics = meter.packet_topics.to_topics(values)
+    if meter.publish_filter is not None:
+        topics = meter.publish_filter.filter(topics)
+    return topics
+
+
+def publish_aggregate(meter: BridgeMeter, aggregate: WindowAggregate):
+    for topic, value in build_aggregate_topics(meter, aggregate).items():
+        publish(topic, value)
+
+
+def build_aggregate_topics(meter: BridgeMeter, aggregate: WindowAggregate) -> dict[str, float]:
+    # Eg. {prefix}/l1/power/15m/mean, see PacketAggregator for the published statistics.
+    return {f'{meter.topic_prefix}/{field}/{aggregate.label}/{statistic}': round(value, 3)
+            for field, statistics in aggregate.fields.items() for statistic, value in statistics.items()}
+
+
+def publish(topic: str, payload: float | bytes):
+    info = publisher.publish(topic=topic, payload=payload, qos=MQTT_QOS, retain=MQTT_RETAIN)
+    if metrics.enabled:
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            metrics.increment('bridge_mqtt_messages_total')
+        else:
+            metrics.increment('bridge_mqtt_publish_errors_total')
+
+
+def get_packet_topic(meter: BridgeMeter) -> str:
+    return f'{meter.topic_prefix}/{MQTT_PACKET_TOPIC}'
+
 
+def build_bridge_meters() -> list[BridgeMeter]:
+    defaults = BridgeMeterDefaults(
+        topic_prefix=MQTT_TOPIC_PREFIX,
+        reverse_power=REVERSE_POWER,
+        reverse_energy=REVERSE_ENERGY,
+        publish_on_change=PUBLISH_ON_CHANGE,
+        publish_deadbands=PUBLISH_DEADBANDS,
+        publish_max_silence=PUBLISH_MAX_SILENCE,
+        aggregation_windows=AGGREGATION_WINDOWS,
+        aggregation_fields=AGGREGATION_FIELDS,
+        aggregation_buffer_size=AGGREGATION_BUFFER_SIZE,
+    )
 
-def post_process_smart_meter_packet(packet: SmartMeterPacket) -> SmartMeterPacket:
-    if REVERSE_POWER:
-        packet = packet.reverse_power_direction()
-    if REVERSE_ENERGY:
-        packet = packet.reverse_energy_direction()
+    if WORKER_PROCESSES:
+        return build_worker_meters(defaults)
 
-    return packet
+    if SMART_METER_CONFIG is not None:
+        return load_bridge_meters(SMART_METER_CONFIG, defaults)
+
+    meter_id = os.getenv(SMART_METER_TYPE, 'smart-meter')
+    return [build_bridge_meter(meter_id, build_smart_meter(asynchronous=True), {}, defaults)]
+
+
+def build_worker_meters(defaults: BridgeMeterDefaults) -> list[BridgeMeter]:
+    # The smart meters themselves are built and measured by the worker processes, from their settings.
+    global worker_pool
+    from bridge.meter_workers import MeterWorkerPool
+
+    if SMART_METER_CONFIG is not None:
+        meter_configs = load_meter_configs(SMART_METER_CONFIG, defaults)
+    else:
+        settings = {key: value for key, value in os.environ.items() if key.startswith('SMART_METER_')}
+        meter_configs = [MeterConfig(os.getenv(SMART_METER_TYPE, 'smart-meter'), settings, {})]
+
+    worker_pool = MeterWorkerPool(meter_configs, WORKER_RING_SIZE, WORKER_TIMEOUT)
+    return [build_bridge_meter(meter.id, worker_pool.smart_meters[meter.id], meter.config, defaults)
+            for meter in meter_configs]
+
+
+async def run_bridge():
+    # Meters are built from within the event loop, as the asyncio Modbus clients require a running loop.
+    meters = build_bridge_meters()
+    for meter in meters:
+        print(f'Loaded smart meter {meter.id} ({meter.smart_meter.__class__.__name__}) publishing to {meter.topic_prefix}.')
+    print('Starting measurements.')
+
+    tasks = [run_meter(meter) for meter in meters]
+    if worker_pool is not None:
+        tasks.append(worker_pool.run())
+    if spool is not None:
+        tasks.append(replay_spool())
+    if METRICS_MQTT_INTERVAL > 0:
+        tasks.append(publish_metrics())
+    await asyncio.gather(*tasks)
+
+
+async def run_meter(meter: BridgeMeter):
+    # Every meter gets its own queue and publisher, so one meter falling behind never drops samples of another.
+    queue = PacketQueue(PACKET_QUEUE_SIZE, PACKET_QUEUE_OVERFLOW_POLICY)
+    if worker_pool is not None:
+        measuring = meter.smart_meter.receive_samples(
+            lambda packet, timestamp: queue.put_nowait(MeterSample(meter, packet, timestamp)))
+    else:
+        measuring = meter.smart_meter.start_measuring_async(
+            lambda packet: queue.put_nowait(MeterSample(meter, packet, time.time())))
+    tasks = [measuring, publish_samples(meter, queue)]
+
+    if isinstance(meter.smart_meter, PollingSmartMeter) and meter.smart_meter.burst_trigger is not None:
+        # Bursts are rare (see SMART_METER_BURST_HOLDOFF), so their queue is unbounded.
+        bursts: asyncio.Queue[BurstCapture] = asyncio.Queue()
+        meter.smart_meter.burst_callback = bursts.put_nowait
+        tasks.append(publish_bursts(meter, bursts))
+
+    await asyncio.gather(*tasks)
+
+
+async def publish_samples(meter: BridgeMeter, queue: PacketQueue[MeterSample]):
+    reported_dropped = 0
+    while True:
+        sample = await queue.get()
+
+        if queue.dropped != reported_dropped:
+            print(f'Publishing fell behind for {meter.id}, dropped {queue.dropped - reported_dropped} packet(s) '
+                  f'({queue.dropped} in total)')
+            reported_dropped = queue.dropped
+
+        if metrics.enabled:
+            record_backlog(meter, queue)
+
+        # Publishing runs on a worker thread, so a slow broker never stalls the acquisition running on the event loop.
+        try:
+            await asyncio.to_thread(packet_callback, sample)
+        except Exception as ex:
+            print(f'An error occurred while processing smart meter packet: {ex}')
+
+
+async def publish_bursts(meter: BridgeMeter, queue: asyncio.Queue[BurstCapture]):
+    while True:
+        capture = await queue.get()
+        try:
+            await asyncio.to_thread(burst_callback, meter, capture)
+        except Exception as ex:
+            print(f'An error occurred while publishing smart meter burst: {ex}')
+
+
+def record_backlog(meter: BridgeMeter, queue: PacketQueue[MeterSample]):
+    metrics.set('bridge_queue_depth', meter.metrics_labels, len(queue))
+    metrics.set('bridge_queue_dropped_total', meter.metrics_labels, queue.dropped, 'counter')
+    if spool is not None:
+        metrics.set('bridge_spool_messages', (), len(spool))
+        metrics.set('bridge_spool_dropped_total', (), spool.dropped, 'counter')
+
+
+async def publish_metrics():
+    # Publishes the metrics as $SYS-style topics, eg. {MQTT_TOPIC_PREFIX}/$SYS/smart_meter_poll_seconds/main/p95.
+    topic_prefix = f'{MQTT_TOPIC_PREFIX}/$SYS'
+    while True:
+        await asyncio.sleep(METRICS_MQTT_INTERVAL)
+        if not publisher.is_connected():
+            continue
+
+        for topic, value in metrics.to_topics(topic_prefix).items():
+            publisher.publish(topic=topic, payload=value, qos=0, retain=False)
+
+
+async def replay_spool():
+    # Replays spooled messages in order once the broker is reachable again, rate-limited so a long outage doesn't
+    # flood the broker on reconnect. Replayed messages are never retained.
+    batch_size = max(1, int(SPOOL_REPLAY_RATE))
+    while True:
+        await asyncio.sleep(1.0)
+        if not publisher.is_connected() or len(spool) == 0:
+            continue
+
+        print(f'Replaying {len(spool)} spooled message(s)')
+        while publisher.is_connected() and len(spool) > 0:
+            messages = await asyncio.to_thread(spool.peek, batch_size)
+
+            published = []
+            for message in messages:
+                if publisher.publish(topic=message.topic, payload=message.payload, qos=MQTT_QOS).rc != mqtt.MQTT_ERR_SUCCESS:
+                    break
+                published.append(message)
+                await asyncio.sleep(1.0 / SPOOL_REPLAY_RATE)
+
+            await asyncio.to_thread(spool.remove, published)
 
 
 def main():
-    global mqttc
+    global publisher, spool, history
+
+    if MQTT_PAYLOAD_MODE not in ('topics', 'packet', 'both', 'none'):
+        raise Exception(f'Invalid environment variable MQTT_PAYLOAD_MODE "{MQTT_PAYLOAD_MODE}" (must be "topics", "packet", "both" or "none")')
 
     print(f'smart-meter-mqtt-bridge version {os.getenv("IMAGE_VERSION")}')
 
@@ -49,17 +358,92 @@ def main():
     print(f'{MQTT_TOPIC_PREFIX=}')
     print(f'{MQTT_QOS=}')
     print(f'{MQTT_RETAIN=}')
+    print(f'{MQTT_PAYLOAD_MODE=}')
+    print(f'{MQTT_PAYLOAD_FORMAT=}')
+    print(f'{MQTT_PACKET_TOPIC=}')
+    print(f'{MQTT_BURST_TOPIC=}')
+    print(f'{MQTT_PROTOCOL=}')
+    print(f'{MQTT_MAX_INFLIGHT=}')
+    print(f'{MQTT_MAX_QUEUED=}')
+    print(f'{MQTT_MESSAGE_EXPIRY=}')
+    print(f'{MQTT_TOPIC_ALIAS_MAXIMUM=}')
     print(f'{REVERSE_POWER=}')
     print(f'{REVERSE_ENERGY=}')
+    print(f'{PUBLISH_ON_CHANGE=}')
+    print(f'{PUBLISH_DEADBANDS=}')
+    print(f'{PUBLISH_MAX_SILENCE=}')
+    print(f'{AGGREGATION_WINDOWS=}')
+    print(f'{AGGREGATION_FIELDS=}')
+    print(f'{AGGREGATION_BUFFER_SIZE=}')
+    print(f'{SMART_METER_CONFIG=}')
+    print(f'{SPOOL_PATH=}')
+    print(f'{SPOOL_MAX_SIZE=}')
+    print(f'{SPOOL_MAX_AGE=}')
+    print(f'{SPOOL_REPLAY_RATE=}')
+    print(f'{HISTORY_PATH=}')
+    print(f'{HISTORY_TIERS=}')
+    print(f'{HISTORY_PORT=}')
+    print(f'{SINK_URLS=}')
+    print(f'{SINK_MEASUREMENT=}')
+    print(f'{SINK_BATCH_SIZE=}')
+    print(f'{SINK_FLUSH_INTERVAL=}')
+    print(f'{SINK_MAX_PENDING=}')
+    print(f'{SINK_MAX_BLOCK=}')
+    print(f'{SINK_FILE_MAX_SIZE=}')
+    print(f'{SINK_FILE_BACKUPS=}')
+    print(f'{PACKET_QUEUE_SIZE=}')
+    print(f'{PACKET_QUEUE_OVERFLOW_POLICY=}')
+    print(f'{WORKER_PROCESSES=}')
+    print(f'{WORKER_RING_SIZE=}')
+    print(f'{WORKER_TIMEOUT=}')
+    print(f'{METRICS_PORT=}')
+    print(f'{METRICS_MQTT_INTERVAL=}')
+
+    metrics.enabled = METRICS_PORT is not None or METRICS_MQTT_INTERVAL > 0
+    if METRICS_PORT is not None:
+        start_metrics_server(int(METRICS_PORT))
+        print(f'Serving metrics on port {METRICS_PORT} (/metrics)')
+
+    if SPOOL_PATH is not None:
+        from bridge.packet_spool import PacketSpool
+        spool = PacketSpool(SPOOL_PATH, SPOOL_MAX_SIZE, SPOOL_MAX_AGE)
+        print(f'Opened spool {SPOOL_PATH} with {len(spool)} message(s)')
+
+    if HISTORY_PATH is not None:
+        # numpy is only imported when keeping history.
+        from bridge.history_server import start_history_server
+        from bridge.history_store import HistoryStore, parse_history_tiers
+        history = HistoryStore(HISTORY_PATH, parse_history_tiers(HISTORY_TIERS))
+        print(f'Keeping history in {HISTORY_PATH}')
+        if HISTORY_PORT is not None:
+            start_history_server(history, int(HISTORY_PORT))
+            print(f'Serving history on port {HISTORY_PORT} (/history)')
 
-    mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-    mqttc.connect(MQTT_BROKER_ADDRESS, MQTT_BROKER_PORT, 60)
-    mqttc.loop_start()
+    for url in SINK_URLS.split(','):
+        if url.strip() == '':
+            continue
+        from bridge.packet_sink import LineProtocolSink, build_sink_transport
+        sinks.append(LineProtocolSink(
+            transport=build_sink_transport(url.strip(), SINK_TOKEN, SINK_FILE_MAX_SIZE, SINK_FILE_BACKUPS),
+            measurement=SINK_MEASUREMENT,
+            batch_size=SINK_BATCH_SIZE,
+            flush_interval=SINK_FLUSH_INTERVAL,
+            max_pending=SINK_MAX_PENDING,
+            max_block=SINK_MAX_BLOCK,
+        ))
+        print(f'Writing samples to {url.strip()}')
 
-    smart_meter = build_smart_meter()
-    print(f'Loaded smart meter {smart_meter.__class__.__name__}. Starting measurements.')
+    publisher = MqttPublisher(
+        protocol=MQTT_PROTOCOL,
+        max_inflight=MQTT_MAX_INFLIGHT,
+        max_queued=MQTT_MAX_QUEUED,
+        message_expiry=MQTT_MESSAGE_EXPIRY,
+        topic_alias_maximum=MQTT_TOPIC_ALIAS_MAXIMUM,
+    )
+    # With a spool, start measuring (and spooling) even when the broker is unreachable at startup.
+    publisher.connect(MQTT_BROKER_ADDRESS, MQTT_BROKER_PORT, 60, blocking=spool is None)
 
-    smart_meter.start_measuring(packet_callback)
+    asyncio.run(run_bridge())
 
 
 if __name__ == '__main__':
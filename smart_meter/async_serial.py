@@ -0,0 +1,25 @@
+import asyncio
+
+import serial
+
+
+async def open_serial_stream(serial_device: serial.Serial) -> asyncio.StreamReader:
+    # Feeds everything the serial port receives into an asyncio.StreamReader, without blocking the event loop or
+    # occupying a thread. Relies on the event loop being able to watch the serial file descriptor (POSIX only).
+    loop = asyncio.get_running_loop()
+    stream = asyncio.StreamReader(loop=loop)
+    fd = serial_device.fileno()
+
+    def on_readable():
+        try:
+            data = serial_device.read(max(1, serial_device.in_waiting))
+        except Exception as ex:
+            loop.remove_reader(fd)
+            stream.set_exception(ex)
+            return
+
+        if data:
+            stream.feed_data(data)
+
+    loop.add_reader(fd, on_readable)
+    return stream
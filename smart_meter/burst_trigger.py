@@ -0,0 +1,116 @@
+import time
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Literal, Optional
+
+from smart_meter.packet_layout import PACKET_FIELDS, packet_to_array
+from smart_meter.smart_meter_packet import SmartMeterPacket
+
+
+@dataclass
+class BurstTriggerEvent:
+    field: str  # packet field that fired, eg. 'l1/power'
+    kind: Literal['step', 'slope']
+    change: float  # the step since the previous packet, or the slope per second
+    threshold: float
+
+
+@dataclass
+class BurstCapture:
+    trigger: BurstTriggerEvent
+    interval: float  # s between burst samples
+    pre_trigger: int  # number of leading samples from before the trigger, polled at the regular interval
+    samples: list[tuple[float, SmartMeterPacket]] = field(default_factory=list)  # (unix time in s, packet)
+    failures: int = 0  # burst samples that failed to be read
+
+
+class BurstTrigger:
+    # Watches the packets of a polled meter for load steps: a field that changed by at least its step threshold since
+    # the previous packet, or at least as fast as its slope threshold (per second). Thresholds are looked up by field
+    # relative to the topic prefix (eg. 'l1/power'), then by the last segment (eg. 'power'), like publish deadbands.
+    #
+    # A fired trigger starts a capture of duration seconds, sampled every interval seconds, which starts with the last
+    # pre_trigger packets (including the one that fired). Once a capture completes, the trigger is held off for holdoff
+    # seconds, which bounds the bus time spent on bursts.
+
+    def __init__(self, steps: dict[str, float], slopes: dict[str, float], interval: float, duration: float,
+                 pre_trigger: int, holdoff: float):
+        for name, thresholds in (('step', steps), ('slope', slopes)):
+            for key, threshold in thresholds.items():
+                if key not in PACKET_FIELDS and not any(packet_field.rsplit('/', 1)[-1] == key
+                                                           for packet_field in PACKET_FIELDS):
+                    raise Exception(f'Invalid burst {name} threshold "{key}" (must be a field, eg. "l1/power", or the '
+                                    f'last segment of one, eg. "power")')
+                if threshold <= 0.0:
+                    raise Exception(f'Invalid burst {name} threshold for "{key}" (must be positive)')
+        if interval <= 0.0 or duration <= 0.0:
+            raise Exception(f'Invalid burst interval {interval:g} s or duration {duration:g} s (must be positive)')
+
+        self.interval = interval
+        self.duration = duration
+        self.pre_trigger = max(1, pre_trigger)
+        self.holdoff = holdoff
+
+        # (index, field, step threshold, slope threshold) of every field with a threshold
+        self.fields: list[tuple[int, str, Optional[float], Optional[float]]] = []
+        for index, name in enumerate(PACKET_FIELDS):
+            segment = name.rsplit('/', 1)[-1]
+            step = steps.get(name, steps.get(segment))
+            slope = slopes.get(name, slopes.get(segment))
+            if step is not None or slope is not None:
+                self.fields.append((index, name, step, slope))
+
+        self.recent: deque[tuple[float, SmartMeterPacket]] = deque(maxlen=self.pre_trigger)
+        self.last: Optional[tuple[float, array]] = None  # (unix time, values) of the previous packet
+        self.holdoff_until = 0.0  # monotonic time
+
+    def update(self, timestamp: float, packet: SmartMeterPacket) -> Optional[BurstTriggerEvent]:
+        # Adds a regular packet, returns the event when it fired the trigger.
+        values = packet_to_array(packet)
+        self.recent.append((timestamp, packet))
+        last = self.last
+        self.last = (timestamp, values)
+        if last is None or time.monotonic() < self.holdoff_until:
+            return None
+
+        elapsed = timestamp - last[0]
+        for index, name, step, slope in self.fields:
+            change = values[index] - last[1][index]
+            if change != change:
+                continue
+            if step is not None and abs(change) >= step:
+                return BurstTriggerEvent(field=name, kind='step', change=change, threshold=step)
+            if slope is not None and elapsed > 0.0 and abs(change) / elapsed >= slope:
+                return BurstTriggerEvent(field=name, kind='slope', change=change / elapsed, threshold=slope)
+
+        return None
+
+    def start(self, event: BurstTriggerEvent) -> BurstCapture:
+        capture = BurstCapture(trigger=event, interval=self.interval, pre_trigger=len(self.recent),
+                               samples=list(self.recent))
+        self.recent.clear()
+        return capture
+
+    def complete(self):
+        # The next packet after a capture only sets the baseline, so a step that lasted never fires twice.
+        self.last = None
+        self.holdoff_until = time.monotonic() + self.holdoff
+
+
+def parse_burst_thresholds(value: Optional[str]) -> dict[str, float]:
+    # Parses eg. 'power=0.5,amperage=2' into thresholds by field.
+    thresholds = {}
+    if not value:
+        return thresholds
+
+    for entry in value.split(','):
+        if entry.strip() == '':
+            continue
+        if '=' not in entry:
+            raise Exception(f'Invalid burst threshold "{entry}" (must be formatted as field=threshold)')
+
+        key, threshold = (part.strip() for part in entry.split('=', 1))
+        thresholds[key] = float(threshold)
+
+    return thresholds
@@ -0,0 +1,95 @@
+from typing import Optional
+
+# M-Bus device types as reported by the 0-n:24.1.0 object of a DSMR telegram.
+MBUS_DEVICE_TYPE_GAS = 3
+MBUS_DEVICE_TYPE_WATER = 7
+
+
+class DsmrTelegram:
+    def __init__(self, header: str, objects: dict[str, list[str]]):
+        self.header = header
+        self.objects = objects  # full OBIS reference (eg. '1-0:32.7.0') -> raw values between the parentheses
+
+    def get_value(self, obis_reference: str, value_index: int = 0) -> Optional[float]:
+        values = self.objects.get(obis_reference)
+        if values is None or len(values) <= value_index:
+            return None
+
+        value = values[value_index].split('*', 1)[0]
+        if value == '':
+            return None
+
+        return float(value)
+
+    def find_mbus_channel(self, device_type: int) -> Optional[int]:
+        for channel in range(1, 5):
+            values = self.objects.get(f'0-{channel}:24.1.0')
+            if values and values[0].isdigit() and int(values[0]) == device_type:
+                return channel
+
+        return None
+
+    def find_mbus_value_channel(self) -> Optional[int]:
+        # The first channel that reports a value without reporting its device type.
+        for channel in range(1, 5):
+            if f'0-{channel}:24.2.1' in self.objects and f'0-{channel}:24.1.0' not in self.objects:
+                return channel
+
+        return None
+
+    def get_mbus_value(self, device_type: int) -> Optional[float]:
+        channel = self.find_mbus_channel(device_type)
+        if channel is None:
+            return None
+
+        # 0-n:24.2.1(timestamp)(value*unit)
+        return self.get_value(f'0-{channel}:24.2.1', 1)
+
+
+class DsmrTelegramParser:
+    # Builds a DsmrTelegram line by line as it comes in from the serial byte stream, splitting every line only once.
+
+    def __init__(self):
+        self.header: Optional[str] = None
+        self.objects: dict[str, list[str]] = {}
+
+    def reset(self):
+        self.header = None
+        self.objects = {}
+
+    def feed_line(self, line: bytes) -> Optional[DsmrTelegram]:
+        text = line.decode('ascii', errors='replace').strip()
+
+        if text.startswith('/'):
+            self.reset()
+            self.header = text[1:]
+        elif text.startswith('!'):
+            telegram = DsmrTelegram(self.header, self.objects)
+            self.reset()
+            return telegram
+        elif self.header is not None:
+            self.parse_object(text)
+
+        return None
+
+    def parse_object(self, text: str):
+        value_start = text.find('(')
+        if value_start <= 0 or not text.endswith(')'):
+            return
+
+        self.objects[text[:value_start]] = parse_object_values(text[value_start + 1:-1])
+
+
+def parse_object_values(values: str) -> list[str]:
+    # Splits the values of a COSEM object, without the outer parentheses, eg. '101209113020W)(01234.567*m3'.
+    return values.split(')(')
+
+
+def parse_telegram(data: bytes) -> Optional[DsmrTelegram]:
+    parser = DsmrTelegramParser()
+    for line in data.splitlines():
+        telegram = parser.feed_line(line)
+        if telegram is not None:
+            return telegram
+
+    return None
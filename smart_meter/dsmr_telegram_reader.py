@@ -0,0 +1,154 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import serial
+
+from smart_meter.dsmr_telegram import DsmrTelegram, DsmrTelegramParser
+
+# Telegrams are a few kB at most; anything larger means we lost the '!' trailer somewhere.
+DSMR_MAX_TELEGRAM_SIZE = 16 * 1024
+
+
+def build_crc16_table() -> list[int]:
+    # CRC16/ARC: polynomial x^16 + x^15 + x^2 + 1 (0x8005, reflected 0xA001), initial value 0.
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = build_crc16_table()
+
+
+def crc16(data: bytes, crc: int = 0) -> int:
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+@dataclass
+class DsmrFrameStatistics:
+    good_frames: int = 0
+    bad_frames: int = 0  # CRC mismatch, malformed trailer or oversized frame
+    unchecked_frames: int = 0  # DSMR < 4 telegrams do not carry a CRC
+    discarded_bytes: int = 0  # bytes skipped while resynchronizing on '/'
+
+
+class DsmrTelegramReader:
+    # Frames telegrams from the raw serial byte stream one line at a time. The CRC is calculated while the lines come in,
+    # and only frames that passed the CRC check are decoded.
+
+    def __init__(self, serial_device: serial.Serial, max_telegram_size: int = DSMR_MAX_TELEGRAM_SIZE,
+                 decimation: int = 1):
+        self.serial_device = serial_device
+        self.max_telegram_size = max_telegram_size
+        self.decimation = max(1, decimation)  # only every Nth telegram is decoded
+        self.statistics = DsmrFrameStatistics()
+        self.telegram_count = 0
+
+        self.partial_line = b''
+        self.frame: Optional[list[bytes]] = None
+        self.frame_size = 0
+        self.frame_crc = 0
+        self.frame_start = 0.0  # monotonic time (s) at which the current or last frame started
+
+    def read_telegram(self) -> DsmrTelegram:
+        while True:
+            telegram = self.feed_line(self.serial_device.readline())
+            if telegram is not None:
+                return telegram
+
+    async def read_telegram_async(self, stream: asyncio.StreamReader) -> DsmrTelegram:
+        while True:
+            line = await stream.readline()
+            if line == b'':
+                raise Exception('Serial stream closed')
+
+            telegram = self.feed_line(line)
+            if telegram is not None:
+                return telegram
+
+    def feed_line(self, data: bytes) -> Optional[DsmrTelegram]:
+        # Serial.readline returns a partial line on timeout; keep it until the rest of the line comes in.
+        line = self.partial_line + data
+        if not line.endswith(b'\n') and len(line) <= self.max_telegram_size:
+            self.partial_line = line
+            return None
+        self.partial_line = b''
+
+        frame = self.feed_frame_line(line)
+        if frame is None:
+            return None
+
+        self.telegram_count += 1
+        if self.telegram_count % self.decimation != 0:
+            return None
+
+        parser = DsmrTelegramParser()
+        for frame_line in frame:
+            telegram = parser.feed_line(frame_line)
+            if telegram is not None:
+                return telegram
+
+        return None
+
+    def feed_frame_line(self, line: bytes) -> Optional[list[bytes]]:
+        if line.startswith(b'/'):
+            if self.frame is not None:
+                # A new telegram started before the previous one was terminated.
+                self.statistics.discarded_bytes += self.frame_size
+            self.frame = [line]
+            self.frame_start = time.monotonic()
+            self.frame_size = len(line)
+            self.frame_crc = crc16(line)
+            return None
+
+        if self.frame is None:
+            self.statistics.discarded_bytes += len(line)
+            return None
+
+        self.frame_size += len(line)
+        if self.frame_size > self.max_telegram_size:
+            self.reject_frame(f'exceeds {self.max_telegram_size} bytes')
+            return None
+
+        end = line.find(b'!')
+        if end < 0:
+            self.frame_crc = crc16(line, self.frame_crc)
+            self.frame.append(line)
+            return None
+
+        frame = self.frame
+        frame.append(line[:end + 1])
+        crc = crc16(line[:end + 1], self.frame_crc)
+        self.frame = None
+
+        trailer = line[end + 1:].strip()
+        if trailer == b'':
+            self.statistics.unchecked_frames += 1
+            return frame
+
+        try:
+            expected_crc = int(trailer, 16)
+        except ValueError:
+            self.reject_frame(f'malformed CRC trailer {trailer!r}')
+            return None
+
+        if expected_crc != crc:
+            self.reject_frame(f'CRC mismatch (expected {expected_crc:04X}, calculated {crc:04X})')
+            return None
+
+        self.statistics.good_frames += 1
+        return frame
+
+    def reject_frame(self, reason: str):
+        self.frame = None
+        self.statistics.bad_frames += 1
+        stats = self.statistics
+        print(f'Rejected DSMR telegram: {reason} ({stats.good_frames} good, {stats.bad_frames} bad frames)')
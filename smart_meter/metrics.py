@@ -0,0 +1,139 @@
+import bisect
+import threading
+from typing import Literal
+
+# Histogram buckets for durations, from 100 us to 10 s.
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0)
+
+# Label names and values of a single series, eg. (('meter', 'p1'),).
+Labels = tuple[tuple[str, str], ...]
+MetricType = Literal['counter', 'gauge', 'histogram']
+
+TOPIC_LEVEL_TRANSLATION = str.maketrans({'/': '_', '+': '_', '#': '_'})
+
+
+class Histogram:
+
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last count is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Estimated by linear interpolation within the bucket the quantile falls in, like Prometheus' histogram_quantile.
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return 0.0
+
+
+class Metrics:
+    # Counters, gauges and histograms of the bridge, exported in the Prometheus text format or as MQTT topics.
+    # Recording is skipped entirely while disabled: callers check `metrics.enabled` before building labels or taking
+    # timestamps, so instrumented hot paths cost a single attribute lookup when metrics are off. Recording takes the
+    # lock, as metrics are recorded from the event loop, the publishing worker threads and the sink threads at once.
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.types: dict[str, MetricType] = {}
+        self.values: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+
+    def increment(self, name: str, labels: Labels = (), amount: float = 1.0):
+        key = (name, labels)
+        with self.lock:
+            if key not in self.values:
+                self.register(name, 'counter')
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def set(self, name: str, labels: Labels, value: float, metric_type: MetricType = 'gauge'):
+        # Also used for counters that are kept elsewhere, eg. the frame statistics of the DSMR telegram reader.
+        key = (name, labels)
+        with self.lock:
+            if key not in self.values:
+                self.register(name, metric_type)
+            self.values[key] = value
+
+    def observe(self, name: str, labels: Labels, value: float):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                self.register(name, 'histogram')
+                histogram = self.histograms[(name, labels)] = Histogram()
+            histogram.observe(value)
+
+    def register(self, name: str, metric_type: MetricType):
+        registered_type = self.types.setdefault(name, metric_type)
+        if registered_type != metric_type:
+            raise Exception(f'Metric {name} is a {registered_type}, not a {metric_type}')
+
+    def to_prometheus(self) -> str:
+        # Built under the lock, so a histogram is never read halfway through an update.
+        lines = []
+        with self.lock:
+            last_name = None
+            for (name, labels), value in sorted(self.values.items()):
+                if name != last_name:
+                    lines.append(f'# TYPE {name} {self.types[name]}')
+                    last_name = name
+                lines.append(f'{name}{format_labels(labels)} {value:g}')
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name != last_name:
+                    lines.append(f'# TYPE {name} histogram')
+                    last_name = name
+                cumulative = 0
+                for bucket, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels((*labels, ("le", str(bucket))))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum:g}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def to_topics(self, topic_prefix: str) -> dict[str, float]:
+        # One topic per series, eg. {topic_prefix}/smart_meter_poll_errors_total/p1. Histograms are summarized by their
+        # count, mean and estimated 50th, 95th and 99th percentile. Built under the lock, like to_prometheus.
+        topics = {}
+        with self.lock:
+            for (name, labels), value in self.values.items():
+                topics[build_topic(topic_prefix, name, labels)] = round(value, 6)
+
+            for (name, labels), histogram in self.histograms.items():
+                topic = build_topic(topic_prefix, name, labels)
+                topics[f'{topic}/count'] = histogram.count
+                topics[f'{topic}/mean'] = round(histogram.sum / max(1, histogram.count), 6)
+                for q in (0.5, 0.95, 0.99):
+                    topics[f'{topic}/p{q * 100:g}'] = round(histogram.quantile(q), 6)
+
+        return topics
+
+
+def format_labels(labels: Labels) -> str:
+    if len(labels) == 0:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def build_topic(topic_prefix: str, name: str, labels: Labels) -> str:
+    # Label values become topic levels, so they can't contain level separators or wildcards.
+    return '/'.join((topic_prefix, name, *(value.translate(TOPIC_LEVEL_TRANSLATION) for _, value in labels)))
+
+
+# The metrics of this process. Disabled until the bridge enables it, see METRICS_PORT and METRICS_MQTT_INTERVAL.
+metrics = Metrics()
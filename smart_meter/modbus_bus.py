@@ -0,0 +1,275 @@
+import asyncio
+import threading
+import time
+
+from typing import Optional
+
+from pymodbus.client import ModbusSerialClient
+from pymodbus.client.base import ModbusBaseSyncClient, ModbusBaseClient
+from pymodbus.exceptions import ModbusIOException, ConnectionException, ModbusException
+
+from smart_meter.metrics import metrics
+from smart_meter.modbus_register_map import ModbusRegisterType
+from smart_meter.modbus_tcp_client import PipelinedModbusTcpClient
+from smart_meter.modbus_timing import ModbusSlaveTiming
+
+# How often the bus utilization is checked for over-subscription.
+BUS_UTILIZATION_WINDOW = 60.0  # s
+BUS_UTILIZATION_WARNING = 0.9
+
+# Polls of meters sharing a bus are staggered by this delay, so they don't all queue up for the bus at the same moment.
+# On buses with multiple transactions in flight, as many meters poll at the same moment.
+BUS_STAGGER_DELAY = 0.25  # s
+
+# Failed connection attempts are retried after this delay, doubling on every consecutive failure up to the maximum.
+RECONNECT_DELAY = 1.0  # s
+MAX_RECONNECT_DELAY = 60.0  # s
+
+
+class ModbusBus:
+    # A single Modbus connection (eg. one RS-485 bus or one TCP connection) shared by every smart meter on it. Only one
+    # transaction is on the bus at any time, so meters with different slave IDs never talk over each other. Pipelined
+    # Modbus TCP connections allow up to max_in_flight transactions at the same time instead, so meters behind a
+    # gateway are polled concurrently.
+    #
+    # The bus (re)connects on demand: transactions connect first when the connection was never made or was lost, and
+    # failed connection attempts back off exponentially. Retrying transactions is up to the meters, the clients are
+    # built without retries of their own.
+    #
+    # Every transaction times out after the timeout of its slave's ModbusSlaveTiming, at most the client's timeout.
+
+    def __init__(self, modbus_client: ModbusBaseSyncClient | ModbusBaseClient | PipelinedModbusTcpClient,
+                 name: str = 'modbus', max_in_flight: int = 1):
+        if max_in_flight > 1 and not isinstance(modbus_client, PipelinedModbusTcpClient):
+            raise Exception(f'Modbus bus {name} can only have multiple transactions in flight over Modbus TCP')
+
+        self.modbus_client = modbus_client
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.meter_count = 0
+
+        self.lock = asyncio.Semaphore(self.max_in_flight)
+        self.connect_lock = asyncio.Lock()
+        self.thread_lock = threading.Lock()
+
+        self.busy_time = 0.0
+        self.window_start = time.monotonic()
+
+        self.connect_failures = 0
+        self.next_connect_attempt = 0.0  # monotonic time (s)
+        self.connects = 0
+
+        self.max_timeout = get_client_timeout(modbus_client)
+        self.slave_timings: dict[int, ModbusSlaveTiming] = {}
+        self.client_timeout = self.max_timeout
+
+    @property
+    def is_async(self) -> bool:
+        return isinstance(self.modbus_client, (ModbusBaseClient, PipelinedModbusTcpClient))
+
+    def attach_meter(self) -> float:
+        # Returns the delay by which the attached meter should stagger its polls.
+        self.meter_count += 1
+        return (self.meter_count - 1) // self.max_in_flight * BUS_STAGGER_DELAY
+
+    def get_slave_timing(self, slave_id: int) -> ModbusSlaveTiming:
+        if slave_id not in self.slave_timings:
+            self.slave_timings[slave_id] = ModbusSlaveTiming(max_timeout=self.max_timeout)
+        return self.slave_timings[slave_id]
+
+    def apply_timeout(self, timeout: float):
+        # Pipelined clients take the timeout of every request, pymodbus clients only one timeout for all requests, which
+        # is only changed when it differs noticeably (changing the timeout of a serial port reconfigures the port).
+        if isinstance(self.modbus_client, PipelinedModbusTcpClient) or abs(timeout - self.client_timeout) < 0.005:
+            return
+        self.client_timeout = timeout
+        self.modbus_client.comm_params.timeout_connect = timeout
+        if isinstance(self.modbus_client, ModbusSerialClient) and self.modbus_client.socket is not None:
+            self.modbus_client.socket.timeout = timeout
+
+    @property
+    def is_connected(self) -> bool:
+        if self.is_async:
+            return self.modbus_client.connected
+        # The connected property of synchronous serial clients (re)connects, so check the socket instead.
+        return self.modbus_client.socket is not None
+
+    @property
+    def is_reconnect_pending(self) -> bool:
+        # Whether the last connection attempt failed, and transactions fail until the next attempt.
+        return time.monotonic() < self.next_connect_attempt
+
+    def connect(self):
+        with self.thread_lock:
+            try:
+                self.ensure_connected()
+            except Exception as ex:
+                print(ex)
+
+    def ensure_connected(self):
+        # Connects if the connection was never made or was lost, unless the last attempt failed too recently.
+        if self.is_connected:
+            return
+        self.check_reconnect_delay()
+        self.complete_connect(self.modbus_client.connect())
+
+    async def ensure_connected_async(self):
+        if self.is_connected:
+            return
+        async with self.connect_lock:
+            if self.is_connected:
+                return
+            self.check_reconnect_delay()
+            # Asynchronous pymodbus clients drop the connection after a timeout. Let the closed connection finish
+            # closing first, or its connection_lost callback closes the new one.
+            await asyncio.sleep(0)
+            self.complete_connect(await self.modbus_client.connect())
+
+    def check_reconnect_delay(self):
+        remaining = self.next_connect_attempt - time.monotonic()
+        if remaining > 0.0:
+            raise ConnectionException(f'Modbus bus {self.name} is disconnected, reconnecting in {remaining:.1f} s')
+
+    def complete_connect(self, connected: bool):
+        if connected:
+            if self.connect_failures > 0:
+                print(f'Modbus bus {self.name} reconnected after {self.connect_failures} failed attempt(s)')
+            self.connect_failures = 0
+            self.connects += 1
+            if metrics.enabled:
+                metrics.increment('smart_meter_modbus_connects_total', (('bus', self.name),))
+            return
+
+        self.connect_failures += 1
+        if metrics.enabled:
+            metrics.increment('smart_meter_modbus_connect_failures_total', (('bus', self.name),))
+        delay = min(MAX_RECONNECT_DELAY, RECONNECT_DELAY * 2 ** (self.connect_failures - 1))
+        self.next_connect_attempt = time.monotonic() + delay
+        raise ConnectionException(f'Failed to connect modbus bus {self.name}, retrying in {delay:g} s')
+
+    def handle_error(self, ex: Exception):
+        # After a lost connection, the next transaction reconnects. Timeouts and error responses keep the connection:
+        # on a serial bus they only mean a single frame was lost or refused.
+        if isinstance(ex, ConnectionException) and self.is_connected:
+            self.modbus_client.close()
+
+    def read_registers(self, register_type: ModbusRegisterType, address: int, count: int, slave_id: int) -> list[int]:
+        with self.thread_lock:
+            self.ensure_connected()
+            timing = self.get_slave_timing(slave_id)
+            timeout = timing.get_transaction_timeout()
+            self.apply_timeout(timeout)
+            start = time.monotonic()
+            responded = False
+            try:
+                response = request_registers(self.modbus_client, register_type, address, count, slave_id, timeout)
+                registers = get_registers(response, address, count, slave_id)
+                responded = True
+            except Exception as ex:
+                responded = get_error_kind(ex) not in ('timeout', 'connection')
+                self.handle_error(ex)
+                self.record_error(ex, slave_id)
+                raise
+            finally:
+                self.record_transaction(timing, time.monotonic() - start, responded, slave_id)
+
+        self.record_request(start, address, count, slave_id)
+        return registers
+
+    async def read_registers_async(self, register_type: ModbusRegisterType, address: int, count: int, slave_id: int) -> list[int]:
+        async with self.lock:
+            await self.ensure_connected_async()
+            timing = self.get_slave_timing(slave_id)
+            timeout = timing.get_transaction_timeout()
+            self.apply_timeout(timeout)
+            start = time.monotonic()
+            responded = False
+            try:
+                response = await request_registers(self.modbus_client, register_type, address, count, slave_id,
+                                                   timeout)
+                registers = get_registers(response, address, count, slave_id)
+                responded = True
+            except Exception as ex:
+                responded = get_error_kind(ex) not in ('timeout', 'connection')
+                self.handle_error(ex)
+                self.record_error(ex, slave_id)
+                raise
+            finally:
+                self.record_transaction(timing, time.monotonic() - start, responded, slave_id)
+
+        self.record_request(start, address, count, slave_id)
+        return registers
+
+    def record_transaction(self, timing: ModbusSlaveTiming, duration: float, responded: bool, slave_id: int):
+        timing.record_transaction(duration, responded)
+        self.record_busy_time(duration)
+        if metrics.enabled:
+            metrics.set('smart_meter_modbus_timeout_seconds', (('bus', self.name), ('slave', str(slave_id))),
+                        timing.timeout)
+
+    def record_request(self, start: float, address: int, count: int, slave_id: int):
+        if metrics.enabled:
+            metrics.observe('smart_meter_modbus_request_seconds',
+                            (('bus', self.name), ('slave', str(slave_id)), ('registers', f'0x{address:04X}+{count}')),
+                            time.monotonic() - start)
+
+    def record_error(self, ex: Exception, slave_id: int):
+        if metrics.enabled:
+            kind = get_error_kind(ex)
+            metrics.increment('smart_meter_modbus_errors_total', (('bus', self.name), ('slave', str(slave_id)), ('kind', kind)))
+
+    def record_busy_time(self, duration: float):
+        self.busy_time += duration
+
+        elapsed = time.monotonic() - self.window_start
+        if elapsed < BUS_UTILIZATION_WINDOW:
+            return
+
+        utilization = self.busy_time / (elapsed * self.max_in_flight)
+        if utilization > BUS_UTILIZATION_WARNING:
+            print(f'Modbus bus {self.name} is over-subscribed ({utilization * 100:.0f}% busy with {self.meter_count} '
+                  f'meter(s)). Consider increasing the measurement interval of the meters on this bus.')
+
+        self.busy_time = 0.0
+        self.window_start = time.monotonic()
+
+
+def request_registers(modbus_client: ModbusBaseSyncClient | ModbusBaseClient | PipelinedModbusTcpClient,
+                      register_type: ModbusRegisterType, address: int, count: int, slave_id: int,
+                      timeout: Optional[float] = None):
+    # Returns the response for synchronous clients, or an awaitable resolving to the response for asynchronous ones.
+    # Only pipelined clients take a timeout per request, see ModbusBus.apply_timeout for the others.
+    options = {'timeout': timeout} if isinstance(modbus_client, PipelinedModbusTcpClient) else {}
+    if register_type == 'holding':
+        return modbus_client.read_holding_registers(address, count, slave=slave_id, **options)
+    elif register_type == 'input':
+        return modbus_client.read_input_registers(address, count, slave=slave_id, **options)
+    else:
+        raise Exception(f'Invalid modbus_register_type \'{register_type}\'')
+
+
+def get_client_timeout(modbus_client: ModbusBaseSyncClient | ModbusBaseClient | PipelinedModbusTcpClient) -> float:
+    if isinstance(modbus_client, PipelinedModbusTcpClient):
+        return modbus_client.timeout
+    return modbus_client.comm_params.timeout_connect or 1.0
+
+
+def get_registers(response, address: int, count: int, slave_id: int) -> list[int]:
+    # Synchronous clients return errors (eg. a ModbusIOException when no response was received) instead of raising them.
+    if isinstance(response, Exception):
+        raise response
+    if response.isError():
+        raise ModbusException(f'Slave {slave_id} refused to read registers 0x{address:04X}+{count}: {response}')
+    if len(response.registers) < count:
+        raise ModbusException(f'Slave {slave_id} returned {len(response.registers)} of {count} registers')
+    return response.registers
+
+
+def get_error_kind(ex: Exception) -> str:
+    if isinstance(ex, (ModbusIOException, TimeoutError)):
+        return 'timeout'
+    if isinstance(ex, ConnectionException):
+        return 'connection'
+    if isinstance(ex, ModbusException):
+        return 'exception_response'
+    return 'error'
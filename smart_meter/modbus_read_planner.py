@@ -0,0 +1,42 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+# A single read_holding_registers/read_input_registers request can return at most 125 registers.
+MODBUS_MAX_READ_REGISTERS = 125
+
+
+@dataclass
+class ModbusReadBlock:
+    address: int
+    count: int
+    fields: dict[str, int] = field(default_factory=dict)  # field name -> register offset within this block
+
+
+def plan_modbus_reads(field_addresses: dict[str, int], field_register_count: int = 2, max_gap: int = 0,
+                      max_block_size: int = MODBUS_MAX_READ_REGISTERS,
+                      field_register_counts: Optional[dict[str, int]] = None) -> list[ModbusReadBlock]:
+    # Groups neighbouring field addresses into the fewest contiguous block reads. Two fields end up in the same block
+    # when at most max_gap unused registers lie between them, and the block does not exceed max_block_size registers.
+    # Fields span field_register_count registers, unless field_register_counts gives them a count of their own.
+    field_register_counts = field_register_counts or {}
+    register_count = max([field_register_count, *field_register_counts.values()])
+    if register_count > max_block_size:
+        raise Exception(f'Field register count {register_count} exceeds max block size {max_block_size}')
+
+    blocks: list[ModbusReadBlock] = []
+    current: ModbusReadBlock | None = None
+
+    for name, address in sorted(field_addresses.items(), key=lambda item: item[1]):
+        count = field_register_counts.get(name, field_register_count)
+        end = address + count
+        if current is not None:
+            gap = address - (current.address + current.count)
+            if gap <= max_gap and end - current.address <= max_block_size:
+                current.count = max(current.count, end - current.address)
+                current.fields[name] = address - current.address
+                continue
+
+        current = ModbusReadBlock(address=address, count=count, fields={name: 0})
+        blocks.append(current)
+
+    return blocks
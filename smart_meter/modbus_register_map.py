@@ -0,0 +1,200 @@
+import json
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Literal, Optional, get_args
+
+from smart_meter.modbus_read_planner import ModbusReadBlock
+
+# Built-in register maps, one per smart meter type, eg. register_maps/dts353f.json for SMART_METER_TYPE=dts353f.
+REGISTER_MAP_DIRECTORY = os.path.join(os.path.dirname(__file__), 'register_maps')
+REGISTER_MAP_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+# Fields a register map can define, see build_smart_meter_packet in modbus_smart_meter.
+MODBUS_FIELDS = (
+    'l1_voltage', 'l1_amperage', 'l1_power', 'l1_delivery', 'l1_redelivery',
+    'l2_voltage', 'l2_amperage', 'l2_power', 'l2_delivery', 'l2_redelivery',
+    'l3_voltage', 'l3_amperage', 'l3_power', 'l3_delivery', 'l3_redelivery',
+    'total_power', 'total_delivery', 'total_redelivery',
+    'frequency', 'gas', 'water',
+)
+# Fields are scaled to these units: voltage V, amperage A, power kW, energy kWh, frequency Hz, gas and water m^3.
+MODBUS_QUANTITIES = ('voltage', 'amperage', 'power', 'energy', 'frequency', 'gas', 'water')
+
+# Data type -> (struct format character, number of registers).
+MODBUS_DATA_TYPES = {
+    'int16': ('h', 1),
+    'uint16': ('H', 1),
+    'int32': ('i', 2),
+    'uint32': ('I', 2),
+    'float32': ('f', 2),
+    'int64': ('q', 4),
+    'uint64': ('Q', 4),
+    'float64': ('d', 4),
+}
+
+FIELD_KEYS = {'address', 'type', 'word_order', 'scale', 'register_type'}
+REGISTER_MAP_KEYS = {'documentation', 'type', 'word_order', 'scale', 'register_type', 'fields', 'defaults'}
+
+ModbusRegisterType = Literal['holding', 'input']
+
+# Registers are always big-endian, the word order tells whether values spanning multiple registers start with their
+# most ('big') or least ('little') significant register.
+ModbusWordOrder = Literal['big', 'little']
+
+
+@dataclass
+class ModbusRegisterField:
+    name: str
+    address: int
+    data_type: str = 'float32'
+    word_order: ModbusWordOrder = 'big'
+    scale: float = 1.0  # multiplied with the raw value
+    register_type: ModbusRegisterType = 'holding'
+
+    @property
+    def register_count(self) -> int:
+        return MODBUS_DATA_TYPES[self.data_type][1]
+
+
+@dataclass
+class ModbusRegisterMap:
+    name: str
+    fields: dict[str, ModbusRegisterField]
+    # Default smart meter settings of this meter, as keys of the TOML meter config, eg. {'serial_parity': 'E'}.
+    defaults: dict[str, Any] = field(default_factory=dict)
+
+
+class ModbusBlockDecoder:
+    # Decodes every field of a block read with a single struct unpack. The block's registers are packed into bytes
+    # (reordering the words of little word order fields), and unpacked by a format precompiled from the fields' data
+    # types, with pad bytes for the unused registers in between.
+
+    def __init__(self, block: ModbusReadBlock, fields: dict[str, ModbusRegisterField]):
+        self.registers_format = struct.Struct(f'>{block.count}H')
+        self.names = []
+        self.scales = []
+        self.register_order: Optional[list[int]] = None
+
+        value_format = '>'
+        register_order = []
+        position = 0
+        for name, offset in sorted(block.fields.items(), key=lambda item: item[1]):
+            register_field = fields[name]
+            if offset < position:
+                raise Exception(f'Modbus field {name} overlaps the previous field at register 0x{block.address + offset:04X}')
+
+            count = register_field.register_count
+            value_format += 'x' * (2 * (offset - position)) + MODBUS_DATA_TYPES[register_field.data_type][0]
+            register_order += range(position, offset)
+            words = range(offset, offset + count)
+            register_order += reversed(words) if register_field.word_order == 'little' else words
+            position = offset + count
+
+            self.names.append(name)
+            self.scales.append(register_field.scale)
+
+        self.values_format = struct.Struct(value_format + 'x' * (2 * (block.count - position)))
+        register_order += range(position, block.count)
+        if register_order != list(range(block.count)):
+            self.register_order = register_order
+
+    def decode(self, registers: list[int], values: dict[str, float]):
+        if self.register_order is not None:
+            registers = [registers[index] for index in self.register_order]
+        raw_values = self.values_format.unpack(self.registers_format.pack(*registers))
+        for name, scale, value in zip(self.names, self.scales, raw_values):
+            values[name] = value * scale
+
+
+def find_register_map(smart_meter_type: str) -> Optional[str]:
+    # Returns the path of the built-in register map of a smart meter type, if there is one.
+    for extension in REGISTER_MAP_EXTENSIONS:
+        path = os.path.join(REGISTER_MAP_DIRECTORY, smart_meter_type + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def list_register_maps() -> list[str]:
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(REGISTER_MAP_DIRECTORY)
+                  if name.endswith(REGISTER_MAP_EXTENSIONS))
+
+
+def load_register_map(path: str) -> ModbusRegisterMap:
+    # Loads a register map from a JSON or YAML file, eg:
+    #
+    #   {
+    #     "register_type": "input",
+    #     "type": "float32",
+    #     "fields": {
+    #       "total_power": {"address": "0x0034", "scale": 0.001},
+    #       "total_delivery": {"address": "0x0048", "type": "uint32", "word_order": "little"}
+    #     },
+    #     "defaults": {"serial_parity": "N", "measurement_interval": 4.0}
+    #   }
+    #
+    # Top-level type, word_order, scale and register_type are the defaults of every field.
+    with open(path, 'rb') as file:
+        if path.endswith(('.yaml', '.yml')):
+            # PyYAML is an optional dependency, only imported for YAML register maps.
+            try:
+                import yaml
+            except ImportError:
+                raise Exception(f'YAML register maps require PyYAML (pip install pyyaml) to load {path}')
+            data = yaml.safe_load(file)
+        else:
+            data = json.load(file)
+
+    return compile_register_map(os.path.splitext(os.path.basename(path))[0], data)
+
+
+def compile_register_map(name: str, data: dict[str, Any]) -> ModbusRegisterMap:
+    for key in data:
+        if key not in REGISTER_MAP_KEYS:
+            raise Exception(f'Invalid key "{key}" in register map {name} (must be one of {", ".join(sorted(REGISTER_MAP_KEYS))})')
+
+    field_defaults = {key: data[key] for key in ('type', 'word_order', 'scale', 'register_type') if key in data}
+    fields = {}
+    for field_name, field_data in data.get('fields', {}).items():
+        fields[field_name] = compile_register_field(name, field_name, {**field_defaults, **field_data})
+
+    if len(fields) == 0:
+        raise Exception(f'Register map {name} defines no fields')
+
+    return ModbusRegisterMap(name=name, fields=fields, defaults=data.get('defaults', {}))
+
+
+def compile_register_field(map_name: str, name: str, data: dict[str, Any]) -> ModbusRegisterField:
+    if name not in MODBUS_FIELDS:
+        raise Exception(f'Invalid field "{name}" in register map {map_name} (must be one of {", ".join(MODBUS_FIELDS)})')
+    for key in data:
+        if key not in FIELD_KEYS:
+            raise Exception(f'Invalid key "{key}" of field {name} in register map {map_name} '
+                            f'(must be one of {", ".join(sorted(FIELD_KEYS))})')
+    if 'address' not in data:
+        raise Exception(f'Field {name} in register map {map_name} has no address')
+
+    address = data['address']
+    register_field = ModbusRegisterField(
+        name=name,
+        address=int(address, 0) if isinstance(address, str) else int(address),
+        data_type=data.get('type', 'float32'),
+        word_order=data.get('word_order', 'big'),
+        scale=float(data.get('scale', 1.0)),
+        register_type=data.get('register_type', 'holding'),
+    )
+
+    if register_field.data_type not in MODBUS_DATA_TYPES:
+        raise Exception(f'Invalid type "{register_field.data_type}" of field {name} in register map {map_name} '
+                        f'(must be one of {", ".join(MODBUS_DATA_TYPES)})')
+    if register_field.word_order not in get_args(ModbusWordOrder):
+        raise Exception(f'Invalid word_order "{register_field.word_order}" of field {name} in register map {map_name} '
+                        f'(must be "big" or "little")')
+    if register_field.register_type not in get_args(ModbusRegisterType):
+        raise Exception(f'Invalid register_type "{register_field.register_type}" of field {name} in register map '
+                        f'{map_name} (must be "holding" or "input")')
+    if not 0 <= register_field.address <= 0xFFFF - register_field.register_count + 1:
+        raise Exception(f'Invalid address {register_field.address} of field {name} in register map {map_name}')
+
+    return register_field
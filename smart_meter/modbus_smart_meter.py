@@ -1,115 +1,460 @@
-import struct
+import asyncio
+import time
 from dataclasses import dataclass
-from typing import Optional, Literal
+from typing import Optional
 
-from pymodbus.client.base import ModbusBaseSyncClient
+from pymodbus.client.base import ModbusBaseSyncClient, ModbusBaseClient
 
+from smart_meter.burst_trigger import BurstTrigger
+from smart_meter.metrics import metrics
+from smart_meter.modbus_bus import ModbusBus
+from smart_meter.modbus_read_planner import plan_modbus_reads, ModbusReadBlock
+from smart_meter.modbus_register_map import ModbusRegisterMap, ModbusRegisterField, ModbusRegisterType, \
+    ModbusBlockDecoder, MODBUS_FIELDS, MODBUS_QUANTITIES
+from smart_meter.modbus_timing import ModbusBudgetSpent
 from smart_meter.polling_smart_meter import PollingSmartMeter
 from smart_meter.smart_meter_packet import SmartMeterPacket, PhaseData, EnergyData
 
 
-@dataclass
-class ModbusAddresses:
-    l1_voltage: Optional[int] = None
-    l1_amperage: Optional[int] = None
-    l1_power: Optional[int] = None
-    l1_delivery: Optional[int] = None
-    l1_redelivery: Optional[int] = None
+# Weight of the last transaction attempt in the link quality, so it reflects roughly the last 50 attempts.
+LINK_QUALITY_SMOOTHING = 0.02
 
-    l2_voltage: Optional[int] = None
-    l2_amperage: Optional[int] = None
-    l2_power: Optional[int] = None
-    l2_delivery: Optional[int] = None
-    l2_redelivery: Optional[int] = None
+# Fields read during bursts, unless configured otherwise: those that follow load steps.
+DEFAULT_BURST_FIELDS = ['power', 'amperage']
 
-    l3_voltage: Optional[int] = None
-    l3_amperage: Optional[int] = None
-    l3_power: Optional[int] = None
-    l3_delivery: Optional[int] = None
-    l3_redelivery: Optional[int] = None
 
-    total_power: Optional[int] = None
-    total_delivery: Optional[int] = None
-    total_redelivery: Optional[int] = None
+@dataclass
+class ModbusPollStatistics:
+    fields: int
+    transactions: int
+    retries: int
+    failed_transactions: int
+    duration: float  # s
 
-    frequency: Optional[int] = None
 
-    gas: Optional[int] = None
+@dataclass
+class ModbusLinkQuality:
+    attempts: int = 0
+    failed_attempts: int = 0
+    retries: int = 0
+    failed_transactions: int = 0  # transactions that still failed after their retries
+    missing_fields: int = 0  # fields left out of packets because their transaction failed
+    success_rate: float = 1.0  # exponentially weighted fraction of successful attempts
 
-    water: Optional[int] = None
+    def record_attempt(self, success: bool, retry: bool):
+        self.attempts += 1
+        if not success:
+            self.failed_attempts += 1
+        if retry:
+            self.retries += 1
+        self.success_rate += LINK_QUALITY_SMOOTHING * ((1.0 if success else 0.0) - self.success_rate)
 
 
 @dataclass
-class ModbusUnitConversion:
-    # Modbus values are multiplied by the factors defined below, and should result in the commented unit.
-    voltage: Optional[float] = None  # -> V
-    amperage: Optional[float] = None  # -> A
-    power: Optional[float] = None  # -> kW
-    energy: Optional[float] = None  # -> kWh
-    frequency: Optional[float] = None  # -> Hz
-    gas: Optional[float] = None  # -> m^3
-    water: Optional[float] = None  # -> m^3
+class ModbusReadGroup:
+    # Fields sharing a poll period and register type, read every `every` polls.
+    every: int
+    register_type: ModbusRegisterType
+    fields: list[str]
+    blocks: list[ModbusReadBlock]
+    decoders: list[ModbusBlockDecoder]  # of every block
+    last_poll: Optional[int] = None  # number of the poll that last read the group successfully
 
 
 class ModbusSmartMeter(PollingSmartMeter):
+    # Reads the fields of a register map, see smart_meter.modbus_register_map. The read plan and block decoders are
+    # compiled once, so decoding a poll takes a single struct unpack per transaction whatever the fields' encodings.
+    #
+    # Fields are polled every measurement_interval, unless poll_periods gives them a period of their own (by field name,
+    # eg. 'l1_power', or by quantity, eg. 'power' or 'energy'). The meter then polls at the shortest period, and reads
+    # every field group only when it is due. Fields that were not due keep their last read value.
+    #
+    # Failed transactions are retried up to max_retries times, as long as the poll hasn't spent its poll_budget (which
+    # defaults to the poll interval). Fields of transactions that still failed are missing (None) from the packet,
+    # rather than failing the whole poll, and their group stays due. Only a poll of which every transaction failed
+    # fails.
+    #
+    # Transaction timeouts adapt to the slave's response time, see ModbusSlaveTiming, and every poll may hold the bus
+    # for bus_budget seconds at most (which defaults to an equal share of the poll interval among the meters on the
+    # bus), so a slave that stopped responding doesn't starve the other meters on its bus. After quarantine_after
+    # consecutive failed polls, the slave is quarantined: polls only send a single probe transaction, which backs off
+    # like failed polls do (see PollingScheduler), until the slave responds again.
+    #
+    # With a burst trigger, bursts read only the burst_fields (by field name or quantity, like poll_periods), in a
+    # single attempt per transaction. Burst values update the last read values of regular packets as well. Burst
+    # transactions are charged to the bus budget of the last poll, so a burst can't starve the other meters on its
+    # bus either: burst samples past the budget fail until the next poll.
+
+    def __init__(self, modbus_bus: ModbusBus, register_map: ModbusRegisterMap, measurement_interval: float, slave_id: int = 1, max_read_gap: int = 0, align_to_wall_clock: bool = False, max_backoff: float = 60.0, log_statistics: bool = False, poll_periods: Optional[dict[str, float]] = None, max_retries: int = 2, poll_budget: Optional[float] = None, burst_trigger: Optional[BurstTrigger] = None, burst_fields: Optional[list[str]] = None, bus_budget: Optional[float] = None, min_timeout: float = 0.1, adaptive_timeout: bool = True, quarantine_after: int = 3):
+        field_periods = get_field_poll_periods(list(register_map.fields), poll_periods or {}, measurement_interval)
+        poll_interval = min(field_periods.values())
+
+        super().__init__(poll_interval, align_to_wall_clock, max_backoff, log_statistics, burst_trigger)
+
+        self.modbus_bus = modbus_bus
+        self.register_map = register_map
+        self.slave_id = slave_id
+        self.max_retries = max_retries
+        self.poll_budget = poll_budget if poll_budget is not None else poll_interval
+        self.bus_budget = bus_budget
+        self.quarantine_after = quarantine_after
+        self.failed_polls = 0  # consecutive polls of which every transaction failed
+        self.quarantined = False
+
+        self.timing = modbus_bus.get_slave_timing(slave_id)
+        self.timing.min_timeout = min_timeout
+        self.timing.adaptive = adaptive_timeout
+
+        self.read_groups = plan_read_groups(register_map.fields, field_periods, poll_interval, max_read_gap)
+        self.read_plan = [block for group in self.read_groups for block in group.blocks]
+        self.last_poll_statistics: Optional[ModbusPollStatistics] = None
+        self.poll_count = 0
+        self.cached_values: dict[str, float] = {}
+        self.link_quality = ModbusLinkQuality()
+        self.poll_start_retries = 0
 
-    def __init__(self, modbus_client: ModbusBaseSyncClient, modbus_addresses: ModbusAddresses, unit_conversion: ModbusUnitConversion, modbus_register_type: Literal['holding', 'input'], measurement_interval: float):
-        super().__init__(measurement_interval)
+        self.burst_groups: list[ModbusReadGroup] = []
+        if burst_trigger is not None:
+            burst_periods = {name: burst_trigger.interval
+                             for name in get_burst_fields(list(register_map.fields), burst_fields or DEFAULT_BURST_FIELDS)}
+            self.burst_groups = plan_read_groups(register_map.fields, burst_periods, burst_trigger.interval, max_read_gap)
 
-        self.modbus_client = modbus_client
-        self.modbus_addresses = modbus_addresses
-        self.unit_conversion = unit_conversion
-        self.modbus_register_type = modbus_register_type
+        for group in self.read_groups:
+            print(f'Modbus read plan for {register_map.name} slave {slave_id} on {modbus_bus.name} every '
+                  f'{group.every * poll_interval:g} s: {len(group.fields)} {group.register_type} register fields in '
+                  f'{len(group.blocks)} transactions '
+                  f'({", ".join(f"0x{block.address:04X}+{block.count}" for block in group.blocks)})')
+        for group in self.burst_groups:
+            print(f'Modbus burst read plan for {register_map.name} slave {slave_id} on {modbus_bus.name} every '
+                  f'{burst_trigger.interval:g} s: {len(group.fields)} {group.register_type} register fields in '
+                  f'{len(group.blocks)} transactions')
 
-        self.modbus_client.connect()
+        self.start_delay = modbus_bus.attach_meter() % poll_interval
+
+        # Asynchronous clients can only connect from within the event loop, so they connect on their first read.
+        if not modbus_bus.is_async:
+            modbus_bus.connect()
+
+    @property
+    def modbus_client(self) -> ModbusBaseSyncClient | ModbusBaseClient:
+        return self.modbus_bus.modbus_client
 
     def fetch_smart_meter_packet(self) -> SmartMeterPacket:
-        addresses = self.modbus_addresses
-        return SmartMeterPacket(
-            phase_l1=self.fetch_phase_data(addresses.l1_voltage, addresses.l1_amperage, addresses.l1_power,
-                                           addresses.l1_delivery, addresses.l1_redelivery),
-            phase_l2=self.fetch_phase_data(addresses.l2_voltage, addresses.l2_amperage, addresses.l2_power,
-                                           addresses.l2_delivery, addresses.l2_redelivery),
-            phase_l3=self.fetch_phase_data(addresses.l3_voltage, addresses.l3_amperage, addresses.l3_power,
-                                           addresses.l3_delivery, addresses.l3_redelivery),
-            power=self.read_register(addresses.total_power, self.unit_conversion.power),
-            energy=self.fetch_energy_data(addresses.total_delivery, addresses.total_redelivery),
-            frequency=self.read_register(addresses.frequency, self.unit_conversion.frequency),
-            gas=self.read_register(addresses.gas, self.unit_conversion.gas),
-            water=self.read_register(addresses.water, self.unit_conversion.water),
-        )
+        start = time.monotonic()
+        if self.quarantined:
+            try:
+                self.read_probe()
+            except Exception as ex:
+                raise self.build_probe_error(ex)
+            self.leave_quarantine()
+        groups = self.start_poll()
 
-    def fetch_phase_data(self, voltage_register: Optional[int], amperage_register: Optional[int],
-                         power_register: Optional[int], delivery_register: Optional[int],
-                         redelivery_register: Optional[int]) -> PhaseData:
-        return PhaseData(
-            voltage=self.read_register(voltage_register, self.unit_conversion.voltage),
-            amperage=self.read_register(amperage_register, self.unit_conversion.amperage),
-            power=self.read_register(power_register, self.unit_conversion.power),
-            energy=self.fetch_energy_data(delivery_register, redelivery_register),
-        )
+        values = {}
+        failures = []
+        for group in groups:
+            for block, decoder in zip(group.blocks, group.decoders):
+                try:
+                    decoder.decode(self.read_block(group.register_type, block, start), values)
+                except Exception as ex:
+                    failures.append((block, ex))
+
+        return self.complete_poll(groups, values, failures, start)
+
+    async def fetch_smart_meter_packet_async(self) -> SmartMeterPacket:
+        if not self.modbus_bus.is_async:
+            return await super().fetch_smart_meter_packet_async()
+
+        start = time.monotonic()
+        if self.quarantined:
+            try:
+                await self.read_probe_async()
+            except Exception as ex:
+                raise self.build_probe_error(ex)
+            self.leave_quarantine()
+        groups = self.start_poll()
+
+        # All transactions are queued at once, so they are in flight at the same time on buses that allow it.
+        reads = [(group.register_type, block, decoder)
+                 for group in groups for block, decoder in zip(group.blocks, group.decoders)]
+        results = await asyncio.gather(*(self.read_block_async(register_type, block, start)
+                                         for register_type, block, _ in reads), return_exceptions=True)
+
+        values = {}
+        failures = []
+        for (_, block, decoder), result in zip(reads, results):
+            if isinstance(result, Exception):
+                failures.append((block, result))
+            else:
+                decoder.decode(result, values)
+
+        return self.complete_poll(groups, values, failures, start)
+
+    def fetch_burst_packet(self) -> SmartMeterPacket:
+        # Continues the bus time budget of the last poll, see start_poll.
+        values = {}
+        for group in self.burst_groups:
+            for block, decoder in zip(group.blocks, group.decoders):
+                decoder.decode(self.read_registers(group.register_type, block.address, block.count), values)
+
+        self.cached_values.update(values)
+        return build_smart_meter_packet(values)
+
+    async def fetch_burst_packet_async(self) -> SmartMeterPacket:
+        if not self.modbus_bus.is_async:
+            return await super().fetch_burst_packet_async()
+
+        reads = [(group.register_type, block, decoder)
+                 for group in self.burst_groups for block, decoder in zip(group.blocks, group.decoders)]
+        results = await asyncio.gather(*(self.read_registers_async(register_type, block.address, block.count)
+                                         for register_type, block, _ in reads))
+
+        values = {}
+        for (_, _, decoder), result in zip(reads, results):
+            decoder.decode(result, values)
+
+        self.cached_values.update(values)
+        return build_smart_meter_packet(values)
+
+    def read_probe(self):
+        # A probe is a single attempt at the first transaction of the poll, which waits for the client's timeout.
+        group = self.read_groups[0]
+        self.timing.start_cycle(None, probing=True)
+        self.read_registers(group.register_type, group.blocks[0].address, group.blocks[0].count)
+
+    async def read_probe_async(self):
+        group = self.read_groups[0]
+        self.timing.start_cycle(None, probing=True)
+        await self.read_registers_async(group.register_type, group.blocks[0].address, group.blocks[0].count)
+
+    def build_probe_error(self, ex: Exception) -> Exception:
+        return Exception(f'Slave {self.slave_id} on {self.modbus_bus.name} is quarantined, probe failed: {ex}')
+
+    def leave_quarantine(self):
+        print(f'Slave {self.slave_id} on {self.modbus_bus.name} responded to a probe, leaving quarantine')
+        self.quarantined = False
+        self.failed_polls = 0
+        if metrics.enabled:
+            metrics.set('smart_meter_modbus_quarantined', self.metrics_labels, 0)
+
+    def record_failed_poll(self):
+        self.failed_polls += 1
+        if self.quarantine_after <= 0 or self.failed_polls < self.quarantine_after or self.quarantined:
+            return
+
+        print(f'Slave {self.slave_id} on {self.modbus_bus.name} failed {self.failed_polls} polls in a row, '
+              f'quarantined until it responds to a probe')
+        self.quarantined = True
+        if metrics.enabled:
+            metrics.set('smart_meter_modbus_quarantined', self.metrics_labels, 1)
 
-    def fetch_energy_data(self, delivery_register: Optional[int], redelivery_register: Optional[int]) -> Optional[EnergyData]:
-        return EnergyData(
-            delivery=self.read_register(delivery_register, self.unit_conversion.energy),
-            redelivery=self.read_register(redelivery_register, self.unit_conversion.energy),
+    def get_bus_budget(self) -> float:
+        if self.bus_budget is not None:
+            return self.bus_budget
+        return self.measurement_interval * self.modbus_bus.max_in_flight / max(1, self.modbus_bus.meter_count)
+
+    def start_poll(self) -> list[ModbusReadGroup]:
+        # Returns the groups that are due. A group that failed to be read stays due until it was read successfully.
+        self.poll_count += 1
+        self.poll_start_retries = self.link_quality.retries
+        self.timing.start_cycle(self.get_bus_budget())
+        return [group for group in self.read_groups
+                if group.last_poll is None or self.poll_count - group.last_poll >= group.every]
+
+    def read_block(self, register_type: ModbusRegisterType, block: ModbusReadBlock, poll_start: float) -> list[int]:
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if time.monotonic() - poll_start >= self.poll_budget:
+                break
+            if attempt > 0 and self.modbus_bus.is_reconnect_pending:
+                break
+            try:
+                registers = self.read_registers(register_type, block.address, block.count)
+            except ModbusBudgetSpent as ex:
+                error = ex
+                break
+            except Exception as ex:
+                error = ex
+                self.link_quality.record_attempt(False, attempt > 0)
+                continue
+            self.link_quality.record_attempt(True, attempt > 0)
+            return registers
+
+        raise error or Exception(f'skipped, the poll budget of {self.poll_budget:g} s was spent')
+
+    async def read_block_async(self, register_type: ModbusRegisterType, block: ModbusReadBlock, poll_start: float) -> list[int]:
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if time.monotonic() - poll_start >= self.poll_budget:
+                break
+            if attempt > 0 and self.modbus_bus.is_reconnect_pending:
+                break
+            try:
+                registers = await self.read_registers_async(register_type, block.address, block.count)
+            except ModbusBudgetSpent as ex:
+                error = ex
+                break
+            except Exception as ex:
+                error = ex
+                self.link_quality.record_attempt(False, attempt > 0)
+                continue
+            self.link_quality.record_attempt(True, attempt > 0)
+            return registers
+
+        raise error or Exception(f'skipped, the poll budget of {self.poll_budget:g} s was spent')
+
+    def complete_poll(self, groups: list[ModbusReadGroup], values: dict[str, float],
+                      failures: list[tuple[ModbusReadBlock, Exception]], start: float) -> SmartMeterPacket:
+        failed_blocks = [block for block, _ in failures]
+        for group in groups:
+            if not any(block in failed_blocks for block in group.blocks):
+                group.last_poll = self.poll_count
+
+        self.cached_values.update(values)
+        missing_fields = [name for block in failed_blocks for name in block.fields]
+        for name in missing_fields:
+            self.cached_values.pop(name, None)
+
+        self.link_quality.failed_transactions += len(failures)
+        self.link_quality.missing_fields += len(missing_fields)
+        self.last_poll_statistics = ModbusPollStatistics(
+            fields=len(values),
+            transactions=sum(len(group.blocks) for group in groups),
+            retries=self.link_quality.retries - self.poll_start_retries,
+            failed_transactions=len(failures),
+            duration=time.monotonic() - start,
         )
+        stats = self.last_poll_statistics
+        self.record_link_quality(stats, len(missing_fields))
+
+        if len(failures) < stats.transactions:
+            self.failed_polls = 0
+        if len(failures) > 0:
+            error = failures[-1][1]
+            if len(failures) == stats.transactions:
+                self.record_failed_poll()
+                raise Exception(f'Failed to read any registers from slave {self.slave_id} on {self.modbus_bus.name}: '
+                                f'{error}')
+            print(f'Failed to read {len(failures)} of {stats.transactions} transactions from slave {self.slave_id} on '
+                  f'{self.modbus_bus.name}, missing {", ".join(missing_fields)}: {error}')
+
+        if self.log_statistics:
+            print(f'Polled {stats.fields} fields from slave {self.slave_id} in {stats.transactions} transactions '
+                  f'with {stats.retries} retries ({stats.duration:.3f} s, link quality '
+                  f'{self.link_quality.success_rate * 100:.1f}%)')
+
+        return build_smart_meter_packet(self.cached_values)
+
+    def record_link_quality(self, stats: ModbusPollStatistics, missing_fields: int):
+        if not metrics.enabled:
+            return
+        metrics.set('smart_meter_modbus_link_quality', self.metrics_labels, self.link_quality.success_rate)
+        if stats.retries > 0:
+            metrics.increment('smart_meter_modbus_retries_total', self.metrics_labels, stats.retries)
+        if missing_fields > 0:
+            metrics.increment('smart_meter_missing_fields_total', self.metrics_labels, missing_fields)
+
+    def read_registers(self, register_type: ModbusRegisterType, address: int, count: int) -> list[int]:
+        return self.modbus_bus.read_registers(register_type, address, count, self.slave_id)
+
+    async def read_registers_async(self, register_type: ModbusRegisterType, address: int, count: int) -> list[int]:
+        return await self.modbus_bus.read_registers_async(register_type, address, count, self.slave_id)
+
+
+def get_field_quantity(field_name: str) -> str:
+    quantity = field_name.rsplit('_', 1)[-1]
+    if quantity in ('delivery', 'redelivery'):
+        return 'energy'
+    return quantity
+
+
+def get_field_poll_periods(field_names: list[str], poll_periods: dict[str, float],
+                           default_period: float) -> dict[str, float]:
+    known_keys = {*MODBUS_FIELDS, *MODBUS_QUANTITIES}
+    for key, period in poll_periods.items():
+        if key not in known_keys:
+            raise Exception(f'Invalid poll period "{key}" (must be a field, eg. "l1_power", or a quantity, eg. "power")')
+        if period <= 0.0:
+            raise Exception(f'Invalid poll period for "{key}" (must be positive)')
+
+    return {name: poll_periods.get(name, poll_periods.get(get_field_quantity(name), default_period))
+            for name in field_names}
+
+
+def get_burst_fields(field_names: list[str], burst_fields: list[str]) -> list[str]:
+    known_keys = {*MODBUS_FIELDS, *MODBUS_QUANTITIES}
+    for key in burst_fields:
+        if key not in known_keys:
+            raise Exception(f'Invalid burst field "{key}" (must be a field, eg. "l1_power", or a quantity, eg. "power")')
+
+    names = [name for name in field_names if name in burst_fields or get_field_quantity(name) in burst_fields]
+    if len(names) == 0:
+        raise Exception(f'None of the burst fields {", ".join(burst_fields)} are in the register map')
+    return names
+
+
+def plan_read_groups(register_fields: dict[str, ModbusRegisterField], field_periods: dict[str, float],
+                     poll_interval: float, max_read_gap: int) -> list[ModbusReadGroup]:
+    group_fields: dict[tuple[int, ModbusRegisterType], list[str]] = {}
+    for name, period in field_periods.items():
+        key = (max(1, round(period / poll_interval)), register_fields[name].register_type)
+        group_fields.setdefault(key, []).append(name)
+
+    groups = []
+    for (every, register_type), names in sorted(group_fields.items()):
+        blocks = plan_modbus_reads({name: register_fields[name].address for name in names}, max_gap=max_read_gap,
+                                   field_register_counts={name: register_fields[name].register_count for name in names})
+        groups.append(ModbusReadGroup(
+            every=every,
+            register_type=register_type,
+            fields=names,
+            blocks=blocks,
+            decoders=[ModbusBlockDecoder(block, register_fields) for block in blocks],
+        ))
+
+    return groups
+
+
+def parse_poll_periods(value: Optional[str]) -> dict[str, float]:
+    # Parses eg. 'power=0.25,amperage=0.25,energy=30' into poll periods in seconds.
+    poll_periods = {}
+    if not value:
+        return poll_periods
+
+    for entry in value.split(','):
+        if entry.strip() == '':
+            continue
+        if '=' not in entry:
+            raise Exception(f'Invalid poll period "{entry}" (must be formatted as field=seconds)')
+
+        key, period = (part.strip() for part in entry.split('=', 1))
+        poll_periods[key] = float(period)
 
-    def read_register(self, address: Optional[int], unit_correction_factor: Optional[float]) -> Optional[float]:
-        if address is None:
-            return None
+    return poll_periods
 
-        if self.modbus_register_type == 'holding':
-            registers = self.modbus_client.read_holding_registers(address, 2, slave=1).registers
-        elif self.modbus_register_type == 'input':
-            registers = self.modbus_client.read_input_registers(address, 2, slave=1).registers
-        else:
-            raise Exception(f'Invalid modbus_register_type \'{self.modbus_register_type}\'')
 
-        combined_registers = (registers[0] << 16) | registers[1]
-        float_value = struct.unpack('>f', struct.pack('>I', combined_registers))[0]
+def build_smart_meter_packet(values: dict[str, float]) -> SmartMeterPacket:
+    return SmartMeterPacket(
+        phase_l1=build_phase_data(values, 'l1'),
+        phase_l2=build_phase_data(values, 'l2'),
+        phase_l3=build_phase_data(values, 'l3'),
+        power=values.get('total_power'),
+        energy=EnergyData(
+            delivery=values.get('total_delivery'),
+            redelivery=values.get('total_redelivery'),
+        ),
+        frequency=values.get('frequency'),
+        gas=values.get('gas'),
+        water=values.get('water'),
+    )
 
-        if unit_correction_factor is not None:
-            float_value = float_value * unit_correction_factor
 
-        return float_value
+def build_phase_data(values: dict[str, float], phase: str) -> PhaseData:
+    return PhaseData(
+        voltage=values.get(f'{phase}_voltage'),
+        amperage=values.get(f'{phase}_amperage'),
+        power=values.get(f'{phase}_power'),
+        energy=EnergyData(
+            delivery=values.get(f'{phase}_delivery'),
+            redelivery=values.get(f'{phase}_redelivery'),
+        ),
+    )
@@ -0,0 +1,152 @@
+from typing import Mapping, Optional, Callable
+
+from pymodbus.client import ModbusSerialClient, ModbusTcpClient, AsyncModbusSerialClient, AsyncModbusTcpClient
+from pymodbus.client.base import ModbusBaseSyncClient, ModbusBaseClient
+
+from smart_meter.burst_trigger import BurstTrigger, parse_burst_thresholds
+from smart_meter.modbus_bus import ModbusBus
+from smart_meter.modbus_register_map import find_register_map, load_register_map
+from smart_meter.modbus_smart_meter import ModbusSmartMeter, parse_poll_periods
+from smart_meter.modbus_tcp_client import PipelinedModbusTcpClient
+from smart_meter.smart_meter_factory import SMART_METER_REGISTER_MAP, SMART_METER_CONNECTION_TYPE, \
+    SMART_METER_SERIAL_PORT, SMART_METER_SERIAL_BAUDRATE, SMART_METER_SERIAL_BYTESIZE, SMART_METER_SERIAL_PARITY, \
+    SMART_METER_SERIAL_STOPBITS, SMART_METER_SERIAL_TIMEOUT, SMART_METER_TCP_ADDRESS, SMART_METER_TCP_PORT, \
+    SMART_METER_TCP_TIMEOUT, SMART_METER_TCP_MAX_IN_FLIGHT, SMART_METER_MEASUREMENT_INTERVAL, \
+    SMART_METER_MODBUS_MAX_READ_GAP, SMART_METER_MODBUS_SLAVE_ID, SMART_METER_MODBUS_BUS, \
+    SMART_METER_MODBUS_POLL_PERIODS, SMART_METER_MODBUS_RETRIES, SMART_METER_MODBUS_POLL_BUDGET, \
+    SMART_METER_MODBUS_BUS_BUDGET, SMART_METER_MODBUS_ADAPTIVE_TIMEOUT, SMART_METER_MODBUS_MIN_TIMEOUT, \
+    SMART_METER_MODBUS_QUARANTINE_AFTER, SMART_METER_MODBUS_BURST_FIELDS, SMART_METER_BURST_STEP, \
+    SMART_METER_BURST_SLOPE, SMART_METER_BURST_INTERVAL, SMART_METER_BURST_DURATION, SMART_METER_BURST_PRE_TRIGGER, \
+    SMART_METER_BURST_HOLDOFF, SMART_METER_ALIGN_TO_WALL_CLOCK, SMART_METER_MAX_BACKOFF, SMART_METER_LOG_STATISTICS, \
+    format_setting, parse_optional_float
+
+# Smart meter driver of Modbus meters, see SMART_METER_DRIVERS.
+
+
+def build_smart_meter(sm_type: str, asynchronous: bool, settings: Mapping[str, str],
+                      modbus_buses: Optional[dict[str, ModbusBus]]) -> ModbusSmartMeter:
+    # Modbus smart meters are defined by a register map: the built-in one of their type, or SMART_METER_REGISTER_MAP
+    # for type "modbus". Settings default to the defaults of the register map.
+    path = settings.get(SMART_METER_REGISTER_MAP) if sm_type == 'modbus' else find_register_map(sm_type)
+    if path is None:
+        raise Exception(f'Environment variable not defined but required: {SMART_METER_REGISTER_MAP}')
+
+    register_map = load_register_map(path)
+    settings = {**{f'SMART_METER_{key.upper()}': format_setting(value) for key, value in register_map.defaults.items()},
+                **settings}
+
+    return ModbusSmartMeter(
+        modbus_bus=get_modbus_bus(settings, modbus_buses, lambda: build_modbus_device(
+            def_baudrate=9600,
+            def_bytesize=8,
+            def_parity='N',
+            def_stopbits=1,
+            def_timeout=0.5,
+            asynchronous=asynchronous,
+            settings=settings,
+        )),
+        register_map=register_map,
+        measurement_interval=float(settings.get(SMART_METER_MEASUREMENT_INTERVAL, '2.0')),
+        slave_id=int(settings.get(SMART_METER_MODBUS_SLAVE_ID, '1')),
+        max_read_gap=int(settings.get(SMART_METER_MODBUS_MAX_READ_GAP, '0')),
+        align_to_wall_clock=settings.get(SMART_METER_ALIGN_TO_WALL_CLOCK, 'false') == 'true',
+        max_backoff=float(settings.get(SMART_METER_MAX_BACKOFF, '60.0')),
+        log_statistics=settings.get(SMART_METER_LOG_STATISTICS, 'false') == 'true',
+        poll_periods=parse_poll_periods(settings.get(SMART_METER_MODBUS_POLL_PERIODS)),
+        max_retries=int(settings.get(SMART_METER_MODBUS_RETRIES, '2')),
+        poll_budget=parse_optional_float(settings.get(SMART_METER_MODBUS_POLL_BUDGET)),
+        bus_budget=parse_optional_float(settings.get(SMART_METER_MODBUS_BUS_BUDGET)),
+        adaptive_timeout=settings.get(SMART_METER_MODBUS_ADAPTIVE_TIMEOUT, 'true') == 'true',
+        min_timeout=float(settings.get(SMART_METER_MODBUS_MIN_TIMEOUT, '0.1')),
+        quarantine_after=int(settings.get(SMART_METER_MODBUS_QUARANTINE_AFTER, '3')),
+        burst_trigger=build_burst_trigger(settings),
+        burst_fields=[key.strip() for key in settings.get(SMART_METER_MODBUS_BURST_FIELDS, '').split(',')
+                      if key.strip() != ''],
+    )
+
+
+def build_burst_trigger(settings: Mapping[str, str]) -> Optional[BurstTrigger]:
+    # Burst sampling is enabled by a step or slope threshold.
+    steps = parse_burst_thresholds(settings.get(SMART_METER_BURST_STEP))
+    slopes = parse_burst_thresholds(settings.get(SMART_METER_BURST_SLOPE))
+    if len(steps) == 0 and len(slopes) == 0:
+        return None
+
+    return BurstTrigger(
+        steps=steps,
+        slopes=slopes,
+        interval=float(settings.get(SMART_METER_BURST_INTERVAL, '0.2')),
+        duration=float(settings.get(SMART_METER_BURST_DURATION, '10.0')),
+        pre_trigger=int(settings.get(SMART_METER_BURST_PRE_TRIGGER, '5')),
+        holdoff=float(settings.get(SMART_METER_BURST_HOLDOFF, '60.0')),
+    )
+
+
+def get_modbus_bus(settings: Mapping[str, str], modbus_buses: Optional[dict[str, ModbusBus]],
+                   build_client: Callable[[], ModbusBaseSyncClient | ModbusBaseClient | PipelinedModbusTcpClient]) \
+        -> ModbusBus:
+    bus_name = settings.get(SMART_METER_MODBUS_BUS)
+    bus_key = bus_name
+    if settings.get(SMART_METER_CONNECTION_TYPE) == 'tcp':
+        # One pooled connection per gateway, whichever bus its meters are configured on.
+        bus_key = f'{settings.get(SMART_METER_TCP_ADDRESS)}:{settings.get(SMART_METER_TCP_PORT, "502")}'
+
+    if bus_key is None or modbus_buses is None:
+        return build_modbus_bus(build_client(), bus_name or 'modbus', settings)
+
+    if bus_key not in modbus_buses:
+        modbus_buses[bus_key] = build_modbus_bus(build_client(), bus_name or bus_key, settings)
+
+    return modbus_buses[bus_key]
+
+
+def build_modbus_bus(modbus_client: ModbusBaseSyncClient | ModbusBaseClient | PipelinedModbusTcpClient, name: str,
+                     settings: Mapping[str, str]) -> ModbusBus:
+    max_in_flight = 1
+    if isinstance(modbus_client, PipelinedModbusTcpClient):
+        max_in_flight = get_tcp_max_in_flight(settings)
+    return ModbusBus(modbus_client, name=name, max_in_flight=max_in_flight)
+
+
+def build_modbus_device(def_baudrate: int, def_bytesize: int, def_parity: str, def_stopbits: int, def_timeout: float,
+                        asynchronous: bool, settings: Mapping[str, str]):
+    connection_type = settings.get(SMART_METER_CONNECTION_TYPE)
+    if connection_type == 'serial':
+        port = settings.get(SMART_METER_SERIAL_PORT)
+        if port is None:
+            raise Exception(f'Environment variable not defined but required: {SMART_METER_SERIAL_PORT}')
+        client_class = AsyncModbusSerialClient if asynchronous else ModbusSerialClient
+        return client_class(
+            port=port,
+            baudrate=int(settings.get(SMART_METER_SERIAL_BAUDRATE, def_baudrate)),
+            bytesize=int(settings.get(SMART_METER_SERIAL_BYTESIZE, def_bytesize)),
+            parity=settings.get(SMART_METER_SERIAL_PARITY, def_parity),
+            stopbits=int(settings.get(SMART_METER_SERIAL_STOPBITS, def_stopbits)),
+            timeout=float(settings.get(SMART_METER_SERIAL_TIMEOUT, def_timeout)),
+            **get_modbus_client_options(asynchronous),
+        )
+    elif connection_type == 'tcp':
+        host = settings.get(SMART_METER_TCP_ADDRESS)
+        port = int(settings.get(SMART_METER_TCP_PORT, '502'))
+        if host is None:
+            raise Exception(f'Environment variable not defined but required: {SMART_METER_TCP_ADDRESS}')
+        timeout = float(settings.get(SMART_METER_TCP_TIMEOUT, '1.0'))
+        if asynchronous and get_tcp_max_in_flight(settings) > 1:
+            # Only pipelined when the gateway queues concurrent requests, pymodbus' own client otherwise.
+            return PipelinedModbusTcpClient(host=host, port=port, timeout=timeout)
+        client_class = AsyncModbusTcpClient if asynchronous else ModbusTcpClient
+        return client_class(host=host, port=port, timeout=timeout, **get_modbus_client_options(asynchronous))
+    else:
+        raise Exception(
+            f'Invalid environment variable {SMART_METER_CONNECTION_TYPE} "{connection_type}" (must be "serial" or "tcp")')
+
+
+def get_tcp_max_in_flight(settings: Mapping[str, str]) -> int:
+    return int(settings.get(SMART_METER_TCP_MAX_IN_FLIGHT, '1'))
+
+
+def get_modbus_client_options(asynchronous: bool) -> dict:
+    # Retries and reconnects are handled by the smart meters and the ModbusBus, within the poll budget.
+    if asynchronous:
+        return {'retries': 0, 'reconnect_delay': 0}
+    return {'retries': 0}
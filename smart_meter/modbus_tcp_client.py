@@ -0,0 +1,145 @@
+import asyncio
+import struct
+from typing import Optional
+
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.register_read_message import ReadHoldingRegistersResponse, ReadInputRegistersResponse
+
+# Modbus application protocol header: transaction ID, protocol ID (always 0), length of the rest of the frame, unit ID.
+MBAP_HEADER = struct.Struct('>HHHB')
+READ_REQUEST = struct.Struct('>BHH')  # function code, address, count
+
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+EXCEPTION_FLAG = 0x80
+
+
+class ModbusTcpConnection(asyncio.Protocol):
+    # A single connection of a PipelinedModbusTcpClient. Responses are matched to their requests by transaction ID,
+    # and must come from the unit the request was sent to, so a gateway mixing up its slaves never hands one meter
+    # the registers of another.
+
+    def __init__(self):
+        self.transport: Optional[asyncio.Transport] = None
+        self.buffer = bytearray()
+        self.pending: dict[int, tuple[asyncio.Future, int]] = {}  # transaction ID -> (future, unit ID)
+
+    @property
+    def connected(self) -> bool:
+        return self.transport is not None and not self.transport.is_closing()
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def connection_lost(self, ex: Optional[Exception]):
+        self.transport = None
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionException(f'Connection lost: {ex or "closed"}'))
+        self.pending.clear()
+
+    def data_received(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= MBAP_HEADER.size:
+            transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack_from(self.buffer)
+            if protocol_id != 0 or length < 2:
+                # Not a Modbus TCP frame, so the stream can't be resynchronized.
+                self.transport.close()
+                return
+
+            end = 6 + length
+            if len(self.buffer) < end:
+                return
+
+            pdu = bytes(self.buffer[MBAP_HEADER.size:end])
+            del self.buffer[:end]
+
+            # Responses to requests that already timed out are dropped.
+            future, request_unit_id = self.pending.pop(transaction_id, (None, None))
+            if future is None or future.done():
+                continue
+            if unit_id != request_unit_id:
+                future.set_exception(ModbusIOException(f'Response from unit {unit_id} to a request to unit '
+                                                       f'{request_unit_id}'))
+            else:
+                future.set_result(pdu)
+
+    def send(self, transaction_id: int, slave_id: int, pdu: bytes) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending[transaction_id] = (future, slave_id)
+        self.transport.write(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, slave_id) + pdu)
+        return future
+
+
+class PipelinedModbusTcpClient:
+    # Asynchronous Modbus TCP client for register reads that pipelines requests: any number of requests can be
+    # outstanding on its single connection, and responses may arrive in any order. The asynchronous pymodbus clients
+    # wait for each response before sending the next request. Callers limit the requests in flight, see ModbusBus.
+    #
+    # Implements the subset of the pymodbus client interface used by ModbusBus, and returns pymodbus responses.
+
+    def __init__(self, host: str, port: int = 502, timeout: float = 1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self.connection: Optional[ModbusTcpConnection] = None
+        self.transaction_id = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.connection is not None and self.connection.connected
+
+    async def connect(self) -> bool:
+        try:
+            _, self.connection = await asyncio.wait_for(
+                asyncio.get_running_loop().create_connection(ModbusTcpConnection, self.host, self.port),
+                timeout=self.timeout,
+            )
+        except (OSError, asyncio.TimeoutError) as ex:
+            print(f'Failed to connect to Modbus TCP gateway {self.host}:{self.port}: {ex or "timeout"}')
+            return False
+        return True
+
+    def close(self):
+        if self.connected:
+            self.connection.transport.close()
+
+    async def read_holding_registers(self, address: int, count: int, slave: int = 1, timeout: Optional[float] = None):
+        return await self.read_registers(READ_HOLDING_REGISTERS, address, count, slave, timeout)
+
+    async def read_input_registers(self, address: int, count: int, slave: int = 1, timeout: Optional[float] = None):
+        return await self.read_registers(READ_INPUT_REGISTERS, address, count, slave, timeout)
+
+    async def read_registers(self, function_code: int, address: int, count: int, slave_id: int,
+                             timeout: Optional[float] = None):
+        # The timeout defaults to the client's timeout.
+        timeout = timeout if timeout is not None else self.timeout
+        connection = self.connection
+        if connection is None or not connection.connected:
+            raise ConnectionException(f'Not connected to {self.host}:{self.port}')
+
+        self.transaction_id = (self.transaction_id + 1) & 0xFFFF
+        transaction_id = self.transaction_id
+        future = connection.send(transaction_id, slave_id, READ_REQUEST.pack(function_code, address, count))
+        try:
+            pdu = await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise ModbusIOException(f'No response from slave {slave_id} within {timeout:.3g} s')
+        finally:
+            connection.pending.pop(transaction_id, None)
+
+        return decode_read_response(function_code, pdu)
+
+
+def decode_read_response(function_code: int, pdu: bytes):
+    if pdu[0] == function_code | EXCEPTION_FLAG:
+        return ExceptionResponse(function_code, pdu[1] if len(pdu) > 1 else None)
+    if pdu[0] != function_code or len(pdu) < 2 or len(pdu) < 2 + pdu[1]:
+        raise ModbusIOException(f'Invalid response to function code {function_code}: {pdu.hex()}')
+
+    registers = list(struct.unpack(f'>{pdu[1] // 2}H', pdu[2:2 + pdu[1] // 2 * 2]))
+    if function_code == READ_HOLDING_REGISTERS:
+        return ReadHoldingRegistersResponse(registers)
+    return ReadInputRegistersResponse(registers)
@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+from typing import Optional
+
+# Weights of the last response time in the smoothed response time and its mean deviation, and the number of mean
+# deviations a transaction may take beyond the smoothed response time before it times out (like TCP retransmission
+# timeouts, RFC 6298).
+RESPONSE_TIME_SMOOTHING = 1 / 8
+RESPONSE_TIME_DEVIATION_SMOOTHING = 1 / 4
+RESPONSE_TIME_DEVIATIONS = 4
+
+
+class ModbusBudgetSpent(Exception):
+    pass
+
+
+@dataclass
+class ModbusSlaveTiming:
+    # Response time estimate and bus time budget of one slave on a bus. Transactions time out after the smoothed
+    # response time plus RESPONSE_TIME_DEVIATIONS mean deviations, between min_timeout and the client's max_timeout,
+    # so a slave that missed a request only holds the bus about as long as it takes to respond. Only responses update
+    # the estimate, so a slave that got slower than its timeout keeps timing out until a probe, which waits max_timeout.
+    #
+    # Every poll cycle, the slave may hold the bus for budget seconds at most. Transactions past the budget are not
+    # sent, and a transaction never waits longer than what is left of the budget.
+    max_timeout: float  # s
+    min_timeout: float = 0.1  # s
+    adaptive: bool = True
+
+    response_time: Optional[float] = None  # smoothed, s
+    response_time_deviation: float = 0.0  # s
+    budget: Optional[float] = None  # s of bus time per cycle, None for unlimited
+    cycle_bus_time: float = 0.0  # s
+    probing: bool = False
+
+    @property
+    def timeout(self) -> float:
+        if not self.adaptive or self.probing or self.response_time is None:
+            return self.max_timeout
+        timeout = self.response_time + RESPONSE_TIME_DEVIATIONS * self.response_time_deviation
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def start_cycle(self, budget: Optional[float], probing: bool = False):
+        self.budget = budget
+        self.cycle_bus_time = 0.0
+        self.probing = probing
+
+    def get_transaction_timeout(self) -> float:
+        # The timeout of the next transaction, which must be called while holding the bus.
+        if self.budget is None:
+            return self.timeout
+
+        remaining = self.budget - self.cycle_bus_time
+        if remaining <= 0.0:
+            raise ModbusBudgetSpent(f'skipped, the bus time budget of {self.budget:g} s was spent')
+        return min(self.timeout, remaining)
+
+    def record_transaction(self, duration: float, responded: bool):
+        self.cycle_bus_time += duration
+        if not responded:
+            return
+
+        if self.response_time is None:
+            self.response_time = duration
+            self.response_time_deviation = duration / 2
+        else:
+            self.response_time_deviation += RESPONSE_TIME_DEVIATION_SMOOTHING * \
+                (abs(duration - self.response_time) - self.response_time_deviation)
+            self.response_time += RESPONSE_TIME_SMOOTHING * (duration - self.response_time)
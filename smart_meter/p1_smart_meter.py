@@ -1,91 +1,170 @@
+import asyncio
+import time
 from typing import Callable, Optional
 
 import serial
 
+from smart_meter.async_serial import open_serial_stream
+from smart_meter.dsmr_bulk_reader import DsmrBulkTelegramReader
+from smart_meter.dsmr_telegram import DsmrTelegram, MBUS_DEVICE_TYPE_GAS, MBUS_DEVICE_TYPE_WATER
+from smart_meter.dsmr_telegram_reader import DsmrTelegramReader
+from smart_meter.metrics import metrics
 from smart_meter.smart_meter import SmartMeter
 from smart_meter.smart_meter_packet import SmartMeterPacket, PhaseData, EnergyData, EnergyTariff
 
 
+# The OBIS references build_smart_meter_packet reads, the only lines DsmrBulkTelegramReader decodes.
+P1_OBIS_REFERENCES = (
+    '1-0:32.7.0', '1-0:21.7.0', '1-0:22.7.0',
+    '1-0:52.7.0', '1-0:41.7.0', '1-0:42.7.0',
+    '1-0:72.7.0', '1-0:61.7.0', '1-0:62.7.0',
+    '1-0:1.7.0', '1-0:2.7.0',
+    '1-0:1.8.1', '1-0:1.8.2', '1-0:2.8.1', '1-0:2.8.2',
+    '0-0:96.14.0',
+    *(f'0-{channel}:24.1.0' for channel in range(1, 5)),
+    *(f'0-{channel}:24.2.1' for channel in range(1, 5)),
+)
+
+
 # https://github.com/jvhaarst/DSMR-P1-telegram-reader/blob/master/documentation/Dutch%20Smart%20Meter%20Requirements%20v5.0.2%20Final%20P1.pdf
 class P1SmartMeter(SmartMeter):
-    def __init__(self, serial_device: serial.Serial):
+    def __init__(self, serial_device: serial.Serial, fast_path: bool = False, decimation: int = 1):
+        # The fast path reads the serial port in bulk and only decodes the lines of P1_OBIS_REFERENCES. With a
+        # decimation of N, only every Nth telegram is decoded and published.
         self.serial_device = serial_device
+        if fast_path:
+            self.telegram_reader = DsmrBulkTelegramReader(serial_device, P1_OBIS_REFERENCES, decimation=decimation)
+        else:
+            self.telegram_reader = DsmrTelegramReader(serial_device, decimation=decimation)
 
     def start_measuring(self, packet_callback: Callable[[SmartMeterPacket], None]):
         while True:
-            measurement = self.fetch_measurement()
-            packet_callback(measurement)
+            try:
+                measurement = self.fetch_measurement()
+            except Exception as ex:
+                print(f'An error occurred while fetching smart meter packet: {ex}')
+                self.record_error()
+                self.report_activity(time.monotonic() + 1.0)
+                time.sleep(1.0)
+                continue
+
+            try:
+                packet_callback(measurement)
+            except Exception as ex:
+                print(f'An error occurred while processing smart meter packet: {ex}')
+
+    async def start_measuring_async(self, packet_callback: Callable[[SmartMeterPacket], None]):
+        stream = await open_serial_stream(self.serial_device)
+
+        while True:
+            try:
+                measurement = self.decode_telegram(await self.telegram_reader.read_telegram_async(stream))
+            except Exception as ex:
+                print(f'An error occurred while fetching smart meter packet: {ex}')
+                self.record_error()
+                self.report_activity(time.monotonic() + 1.0)
+                await asyncio.sleep(1.0)
+                continue
+
+            try:
+                packet_callback(measurement)
+            except Exception as ex:
+                print(f'An error occurred while processing smart meter packet: {ex}')
 
     def fetch_measurement(self) -> SmartMeterPacket:
-        packet = self.read_p1_packet()
-
-        l1_voltage = find_measurement(packet, '32.7.0')
-        l1_power = find_measurement(packet, '21.7.0') - find_measurement(packet, '22.7.0')
-        l1_amperage = (l1_power * 1000.0) / l1_voltage
-
-        l2_voltage = find_measurement(packet, '52.7.0')
-        l2_power = find_measurement(packet, '41.7.0') - find_measurement(packet, '42.7.0')
-        l2_amperage = (l2_power * 1000.0) / l2_voltage
-
-        l3_voltage = find_measurement(packet, '72.7.0')
-        l3_power = find_measurement(packet, '61.7.0') - find_measurement(packet, '62.7.0')
-        l3_amperage = (l3_power * 1000.0) / l3_voltage
-
-        return SmartMeterPacket(
-            phase_l1=PhaseData(
-                voltage=l1_voltage,
-                amperage=l1_amperage,
-                power=l1_power,
-            ),
-            phase_l2=PhaseData(
-                voltage=l2_voltage,
-                amperage=l2_amperage,
-                power=l2_power,
-            ),
-            phase_l3=PhaseData(
-                voltage=l3_voltage,
-                amperage=l3_amperage,
-                power=l3_power,
-            ),
-            power=find_measurement(packet, '1.7.0') - find_measurement(packet, '2.7.0'),
-            energy=EnergyData(
-                delivery=find_measurement(packet, '1.8.1') + find_measurement(packet, '1.8.2'),
-                redelivery=find_measurement(packet, '2.8.1') + find_measurement(packet, '2.8.2')
-            ),
-            tariff=EnergyTariff(int(find_measurement(packet, '96.14.0'))),
-
-            # I think this will break when you are only/also measuring water usage, as it uses the same OBIS reference.
-            # This might require looking at the equipment identifier.
-            gas=find_measurement(packet, '24.2.1', 1),
-            water=None,
-        )
-
-    def read_p1_packet(self) -> list[str]:
-        try:
-            packet = []
-            line = ''
-
-            while '!' not in line:
-                line = self.serial_device.readline().decode()
-                line = line.replace('\r', '')
-                line = line.replace('\n', '')
-                packet.append(line)
-
-            return packet
-        except:
-            return []
-
-
-def find_measurement(p1_packet: list[str], obis_reference: str, value_index: int = 0) -> Optional[float]:
-    lines = list(filter(lambda line: obis_reference in line, p1_packet))
-    if len(lines) == 0:
+        return self.decode_telegram(self.read_p1_telegram())
+
+    def read_p1_telegram(self) -> DsmrTelegram:
+        return self.telegram_reader.read_telegram()
+
+    def decode_telegram(self, telegram: DsmrTelegram) -> SmartMeterPacket:
+        if not metrics.enabled:
+            return build_smart_meter_packet(telegram)
+
+        start = time.monotonic()
+        packet = build_smart_meter_packet(telegram)
+        self.record_telegram(start)
+        return packet
+
+    def record_telegram(self, decode_start: float):
+        # The read time spans from the telegram header to its trailer, the decode time covers the OBIS lookups that
+        # build the packet.
+        labels = self.metrics_labels
+        metrics.observe('smart_meter_p1_telegram_read_seconds', labels,
+                        decode_start - self.telegram_reader.frame_start)
+        metrics.observe('smart_meter_p1_decode_seconds', labels, time.monotonic() - decode_start)
+
+        stats = self.telegram_reader.statistics
+        for status, frames in (('good', stats.good_frames), ('bad', stats.bad_frames),
+                               ('unchecked', stats.unchecked_frames)):
+            metrics.set('smart_meter_p1_frames_total', (*labels, ('status', status)), frames, 'counter')
+        metrics.set('smart_meter_p1_discarded_bytes_total', labels, stats.discarded_bytes, 'counter')
+
+    def record_error(self):
+        if metrics.enabled:
+            metrics.increment('smart_meter_poll_errors_total', self.metrics_labels)
+
+
+def build_smart_meter_packet(telegram: DsmrTelegram) -> SmartMeterPacket:
+    l1_voltage = telegram.get_value('1-0:32.7.0')
+    l1_power = subtract(telegram.get_value('1-0:21.7.0'), telegram.get_value('1-0:22.7.0'))
+
+    l2_voltage = telegram.get_value('1-0:52.7.0')
+    l2_power = subtract(telegram.get_value('1-0:41.7.0'), telegram.get_value('1-0:42.7.0'))
+
+    l3_voltage = telegram.get_value('1-0:72.7.0')
+    l3_power = subtract(telegram.get_value('1-0:61.7.0'), telegram.get_value('1-0:62.7.0'))
+
+    tariff = telegram.get_value('0-0:96.14.0')
+
+    gas = telegram.get_mbus_value(MBUS_DEVICE_TYPE_GAS)
+    if gas is None and telegram.find_mbus_channel(MBUS_DEVICE_TYPE_WATER) is None:
+        # Some meters do not report the M-Bus device type. Assume the first channel with a value is a gas meter in
+        # that case.
+        channel = telegram.find_mbus_value_channel()
+        if channel is not None:
+            gas = telegram.get_value(f'0-{channel}:24.2.1', 1)
+
+    return SmartMeterPacket(
+        phase_l1=PhaseData(
+            voltage=l1_voltage,
+            amperage=calculate_amperage(l1_power, l1_voltage),
+            power=l1_power,
+        ),
+        phase_l2=PhaseData(
+            voltage=l2_voltage,
+            amperage=calculate_amperage(l2_power, l2_voltage),
+            power=l2_power,
+        ),
+        phase_l3=PhaseData(
+            voltage=l3_voltage,
+            amperage=calculate_amperage(l3_power, l3_voltage),
+            power=l3_power,
+        ),
+        power=subtract(telegram.get_value('1-0:1.7.0'), telegram.get_value('1-0:2.7.0')),
+        energy=EnergyData(
+            delivery=add(telegram.get_value('1-0:1.8.1'), telegram.get_value('1-0:1.8.2')),
+            redelivery=add(telegram.get_value('1-0:2.8.1'), telegram.get_value('1-0:2.8.2')),
+        ),
+        tariff=None if tariff is None else EnergyTariff(int(tariff)),
+        gas=gas,
+        water=telegram.get_mbus_value(MBUS_DEVICE_TYPE_WATER),
+    )
+
+
+def add(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    if a is None or b is None:
         return None
+    return a + b
 
-    values = lines[0].split('(')[1:]
-    values = [d[0:-1] for d in values]
 
-    if len(values) <= value_index:
+def subtract(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    if a is None or b is None:
         return None
+    return a - b
+
 
-    value = values[value_index]
-    return float(value.split('*', 2)[0])
+def calculate_amperage(power: Optional[float], voltage: Optional[float]) -> Optional[float]:
+    if power is None or not voltage:
+        return None
+    return (power * 1000.0) / voltage
@@ -0,0 +1,41 @@
+from typing import Mapping, Optional
+
+from serial import Serial
+
+from smart_meter.p1_smart_meter import P1SmartMeter
+from smart_meter.smart_meter_factory import SMART_METER_SERIAL_PORT, SMART_METER_SERIAL_BAUDRATE, \
+    SMART_METER_SERIAL_BYTESIZE, SMART_METER_SERIAL_PARITY, SMART_METER_SERIAL_STOPBITS, SMART_METER_SERIAL_TIMEOUT, \
+    SMART_METER_P1_FAST_PATH, SMART_METER_P1_DECIMATION
+
+# Smart meter driver of P1 meters, see SMART_METER_DRIVERS.
+
+
+def build_smart_meter(sm_type: str, asynchronous: bool, settings: Mapping[str, str],
+                      modbus_buses: Optional[dict]) -> P1SmartMeter:
+    return P1SmartMeter(
+        serial_device=build_serial_device(
+            def_baudrate=115200,
+            def_bytesize=8,
+            def_parity='N',
+            def_stopbits=1,
+            def_timeout=0.5,
+            settings=settings,
+        ),
+        fast_path=settings.get(SMART_METER_P1_FAST_PATH, 'false') == 'true',
+        decimation=int(settings.get(SMART_METER_P1_DECIMATION, '1')),
+    )
+
+
+def build_serial_device(def_baudrate: int, def_bytesize: int, def_parity: str, def_stopbits: int, def_timeout: float,
+                        settings: Mapping[str, str]):
+    port = settings.get(SMART_METER_SERIAL_PORT)
+    if port is None:
+        raise Exception(f'Environment variable not defined but required: {SMART_METER_SERIAL_PORT}')
+    return Serial(
+        port=port,
+        baudrate=int(settings.get(SMART_METER_SERIAL_BAUDRATE, def_baudrate)),
+        bytesize=int(settings.get(SMART_METER_SERIAL_BYTESIZE, def_bytesize)),
+        parity=settings.get(SMART_METER_SERIAL_PARITY, def_parity),
+        stopbits=int(settings.get(SMART_METER_SERIAL_STOPBITS, def_stopbits)),
+        timeout=float(settings.get(SMART_METER_SERIAL_TIMEOUT, def_timeout)),
+    )
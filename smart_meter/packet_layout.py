@@ -0,0 +1,180 @@
+import math
+from array import array
+from typing import Optional
+
+from smart_meter.smart_meter_packet import SmartMeterPacket, PhaseData, EnergyData, EnergyTariff
+
+# Flat layout of a SmartMeterPacket: one float per field, NaN when the field is missing. Field names are the topics
+# relative to the topic prefix. The dataclasses in smart_meter_packet remain the API, packet_to_array and
+# array_to_packet convert between both representations.
+PHASES = ('l1', 'l2', 'l3')
+PACKET_FIELDS = (
+    *(f'{phase}/{quantity}' for phase in PHASES
+      for quantity in ('voltage', 'amperage', 'power', 'energy/delivery', 'energy/redelivery')),
+    'power',
+    'energy/delivery',
+    'energy/redelivery',
+    'frequency',
+    'tariff',
+    'gas',
+    'water',
+)
+FIELD_INDEX = {name: index for index, name in enumerate(PACKET_FIELDS)}
+FIELD_COUNT = len(PACKET_FIELDS)
+
+POWER_FIELDS = tuple(FIELD_INDEX[name] for name in ('l1/power', 'l2/power', 'l3/power', 'power'))
+ENERGY_FIELDS = tuple((FIELD_INDEX[f'{prefix}energy/delivery'], FIELD_INDEX[f'{prefix}energy/redelivery'])
+                      for prefix in ('l1/', 'l2/', 'l3/', ''))
+
+# Number of decimals of the published values, see SmartMeterPacket.to_topics.
+FIELD_DECIMALS = {'voltage': 1, 'amperage': 2}
+DEFAULT_DECIMALS = 3
+
+NAN = math.nan
+
+
+def packet_to_array(packet: SmartMeterPacket) -> array:
+    values = []
+    for phase in (packet.phase_l1, packet.phase_l2, packet.phase_l3):
+        if phase is None:
+            values += (NAN, NAN, NAN, NAN, NAN)
+            continue
+
+        energy = phase.energy
+        values += (
+            nan_if_none(phase.voltage),
+            nan_if_none(phase.amperage),
+            nan_if_none(phase.power),
+            NAN if energy is None else nan_if_none(energy.delivery),
+            NAN if energy is None else nan_if_none(energy.redelivery),
+        )
+
+    energy = packet.energy
+    values += (
+        nan_if_none(packet.power),
+        NAN if energy is None else nan_if_none(energy.delivery),
+        NAN if energy is None else nan_if_none(energy.redelivery),
+        nan_if_none(packet.frequency),
+        NAN if packet.tariff is None else float(packet.tariff.value),
+        nan_if_none(packet.gas),
+        nan_if_none(packet.water),
+    )
+    return array('d', values)
+
+
+def array_to_packet(values: array) -> SmartMeterPacket:
+    v = [None if value != value else value for value in values]
+
+    phases = []
+    for offset in (0, 5, 10):
+        voltage, amperage, power, delivery, redelivery = v[offset:offset + 5]
+        if voltage is None and amperage is None and power is None and delivery is None and redelivery is None:
+            phases.append(None)
+            continue
+
+        phases.append(PhaseData(
+            voltage=voltage,
+            amperage=amperage,
+            power=power,
+            energy=build_energy_data(delivery, redelivery),
+        ))
+
+    power, delivery, redelivery, frequency, tariff, gas, water = v[15:22]
+    return SmartMeterPacket(
+        phase_l1=phases[0],
+        phase_l2=phases[1],
+        phase_l3=phases[2],
+        power=power,
+        energy=build_energy_data(delivery, redelivery),
+        frequency=frequency,
+        tariff=None if tariff is None else EnergyTariff(int(tariff)),
+        gas=gas,
+        water=water,
+    )
+
+
+def build_energy_data(delivery: Optional[float], redelivery: Optional[float]) -> Optional[EnergyData]:
+    if delivery is None and redelivery is None:
+        return None
+    return EnergyData(delivery=delivery, redelivery=redelivery)
+
+
+def nan_if_none(value: Optional[float]) -> float:
+    return NAN if value is None else value
+
+
+class PacketTransform:
+    # Power and energy direction reversal, precomputed once as a per-field source index and sign.
+
+    def __init__(self, reverse_power: bool = False, reverse_energy: bool = False):
+        self.is_identity = not reverse_power and not reverse_energy
+
+        self.sources = list(range(FIELD_COUNT))
+        self.factors = [1.0] * FIELD_COUNT
+        if reverse_power:
+            for index in POWER_FIELDS:
+                self.factors[index] = -1.0
+        if reverse_energy:
+            for delivery, redelivery in ENERGY_FIELDS:
+                self.sources[delivery], self.sources[redelivery] = redelivery, delivery
+
+        self.fields = list(zip(self.sources, self.factors))
+
+    def apply(self, values: array) -> array:
+        if self.is_identity:
+            return values
+        return array('d', [values[source] * factor for source, factor in self.fields])
+
+
+class PacketTopics:
+    # The topics of a flat packet for one topic prefix. Topic names are built once, instead of for every packet.
+    # Produces the same topics as SmartMeterPacket.to_topics.
+
+    def __init__(self, topic_prefix: str):
+        self.topic_prefix = topic_prefix
+
+        # (index, topic, decimals) for plain values, (delivery index, redelivery index, total topic, delivery topic,
+        # redelivery topic) for energy
+        self.values: list[tuple[int, str, int]] = []
+        self.energies: list[tuple[int, int, str, str, str]] = []
+
+        for index, name in enumerate(PACKET_FIELDS):
+            if name.endswith('energy/redelivery'):
+                continue
+            if name.endswith('energy/delivery'):
+                topic = f'{topic_prefix}/{name.removesuffix("/delivery")}'
+                self.energies.append((index, index + 1, topic, f'{topic}/delivery', f'{topic}/redelivery'))
+            elif name != 'tariff':
+                self.values.append((index, f'{topic_prefix}/{name}',
+                                    FIELD_DECIMALS.get(name.rsplit('/', 1)[-1], DEFAULT_DECIMALS)))
+
+        self.tariff_index = FIELD_INDEX['tariff']
+        self.tariff_topic = f'{topic_prefix}/tariff'
+
+    def to_topics(self, values: array) -> dict[str, float]:
+        topics = {}
+
+        for index, topic, decimals in self.values:
+            value = values[index]
+            if value == value:
+                topics[topic] = round(value, decimals)
+
+        for delivery_index, redelivery_index, topic, delivery_topic, redelivery_topic in self.energies:
+            delivery = values[delivery_index]
+            redelivery = values[redelivery_index]
+            has_delivery = delivery == delivery
+            has_redelivery = redelivery == redelivery
+            if has_delivery and has_redelivery:
+                topics[topic] = round(delivery - redelivery, 3)
+                topics[delivery_topic] = round(delivery, 3)
+                topics[redelivery_topic] = round(redelivery, 3)
+            elif has_delivery:
+                topics[topic] = round(delivery, 3)
+            elif has_redelivery:
+                topics[topic] = round(-redelivery, 3)
+
+        tariff = values[self.tariff_index]
+        if tariff == tariff:
+            topics[self.tariff_topic] = int(tariff)
+
+        return topics
@@ -0,0 +1,73 @@
+import math
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class PollingSchedulerStatistics:
+    ticks: int = 0
+    overruns: int = 0  # polls that took longer than the interval
+    missed_ticks: int = 0  # ticks skipped because of overruns or failure backoff
+    failures: int = 0
+    total_jitter: float = 0.0  # s
+    max_jitter: float = 0.0  # s
+
+    @property
+    def mean_jitter(self) -> float:
+        return self.total_jitter / max(1, self.ticks)
+
+
+class PollingScheduler:
+    # Schedules polls on absolute tick boundaries of a monotonic clock, so the schedule neither drifts by the
+    # per-poll overhead nor jumps with wall-clock changes. Ticks that were missed are skipped instead of polled in a
+    # burst, and consecutive failures back off exponentially (staying on the tick grid) up to max_backoff.
+    #
+    # With align_to_wall_clock, ticks are aligned to multiples of the interval in wall-clock time (plus offset), so
+    # multiple meters with the same interval sample in phase.
+
+    def __init__(self, interval: float, offset: float = 0.0, align_to_wall_clock: bool = False, max_backoff: float = 60.0):
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.statistics = PollingSchedulerStatistics()
+        self.consecutive_failures = 0
+
+        now = time.monotonic()
+        if align_to_wall_clock:
+            self.next_tick = now + (offset - time.time()) % interval
+            if self.next_tick - now < interval / 2:
+                self.next_tick += interval
+        else:
+            self.next_tick = now + interval + offset
+
+    def time_until_next_tick(self) -> float:
+        return max(0.0, self.next_tick - time.monotonic())
+
+    def start_tick(self):
+        jitter = max(0.0, time.monotonic() - self.next_tick)
+        self.statistics.ticks += 1
+        self.statistics.total_jitter += jitter
+        self.statistics.max_jitter = max(self.statistics.max_jitter, jitter)
+
+    def complete_tick(self, success: bool):
+        now = time.monotonic()
+        target = self.next_tick + self.interval
+
+        if success:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            self.statistics.failures += 1
+            target = self.next_tick + min(self.max_backoff, self.interval * 2 ** (self.consecutive_failures - 1))
+
+        if now > self.next_tick + self.interval:
+            self.statistics.overruns += 1
+
+        # Continue at the first tick boundary at or after the target that is still in the future.
+        ticks = max(1, math.ceil((max(target, now) - self.next_tick) / self.interval - 1e-9))
+        self.statistics.missed_ticks += ticks - 1
+        self.next_tick += ticks * self.interval
+
+    def reset_statistics(self) -> PollingSchedulerStatistics:
+        statistics = self.statistics
+        self.statistics = PollingSchedulerStatistics()
+        return statistics
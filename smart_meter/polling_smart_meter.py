@@ -1,35 +1,213 @@
+import asyncio
 import time
 from abc import abstractmethod, ABC
-from typing import Callable
+from typing import Callable, Optional
 
+from smart_meter.burst_trigger import BurstTrigger, BurstCapture
+from smart_meter.metrics import metrics
+from smart_meter.polling_scheduler import PollingScheduler
 from smart_meter.smart_meter import SmartMeter
 from smart_meter.smart_meter_packet import SmartMeterPacket
 
+# How often the polling schedule statistics are logged (when enabled, or when polls overran).
+SCHEDULER_LOG_INTERVAL = 300.0  # s
+
 
 class PollingSmartMeter(SmartMeter, ABC):
-    def __init__(self, measurement_interval: float):
+    # With a burst trigger, a packet that fires the trigger starts a burst: the meter polls only its fast fields every
+    # burst interval (see fetch_burst_packet) for the burst duration, while the regular polls continue on their ticks.
+    # The captured burst is passed to burst_callback as a whole once it completes. Without a burst_callback, the
+    # trigger is never checked.
+
+    def __init__(self, measurement_interval: float, align_to_wall_clock: bool = False, max_backoff: float = 60.0,
+                 log_statistics: bool = False, burst_trigger: Optional[BurstTrigger] = None):
         self.measurement_interval = measurement_interval
+        self.align_to_wall_clock = align_to_wall_clock
+        self.max_backoff = max_backoff
+        self.log_statistics = log_statistics
+        self.start_delay = 0.0
+        self.burst_trigger = burst_trigger
+        self.burst_callback: Optional[Callable[[BurstCapture], None]] = None
+
+        self.scheduler: Optional[PollingScheduler] = None
+        self.last_scheduler_log = time.monotonic()
 
     def start_measuring(self, packet_callback: Callable[[SmartMeterPacket], None]):
-        time.sleep(self.measurement_interval)
+        scheduler = self.create_scheduler()
 
         while True:
-            start = time.time()
+            time.sleep(scheduler.time_until_next_tick())
+            packet = self.poll(scheduler, packet_callback)
+
+            capture = self.check_burst_trigger(packet)
+            if capture is not None:
+                self.capture_burst(scheduler, packet_callback, capture)
+
+    async def start_measuring_async(self, packet_callback: Callable[[SmartMeterPacket], None]):
+        scheduler = self.create_scheduler()
+
+        while True:
+            await asyncio.sleep(scheduler.time_until_next_tick())
+            packet = await self.poll_async(scheduler, packet_callback)
+
+            capture = self.check_burst_trigger(packet)
+            if capture is not None:
+                await self.capture_burst_async(scheduler, packet_callback, capture)
+
+    def poll(self, scheduler: PollingScheduler,
+             packet_callback: Callable[[SmartMeterPacket], None]) -> Optional[SmartMeterPacket]:
+        scheduler.start_tick()
+        start = time.perf_counter()
+
+        try:
+            packet = self.fetch_smart_meter_packet()
+        except Exception as ex:
+            print(f'An error occurred while fetching smart meter packet: {ex}')
+            self.record_poll(start, False)
+            self.complete_tick(scheduler, False)
+            return None
+
+        self.record_poll(start, True)
+        self.process_packet(packet, packet_callback)
+        self.complete_tick(scheduler, True)
+        return packet
+
+    async def poll_async(self, scheduler: PollingScheduler,
+                         packet_callback: Callable[[SmartMeterPacket], None]) -> Optional[SmartMeterPacket]:
+        scheduler.start_tick()
+        start = time.perf_counter()
+
+        try:
+            packet = await self.fetch_smart_meter_packet_async()
+        except Exception as ex:
+            print(f'An error occurred while fetching smart meter packet: {ex}')
+            self.record_poll(start, False)
+            self.complete_tick(scheduler, False)
+            return None
+
+        self.record_poll(start, True)
+        self.process_packet(packet, packet_callback)
+        self.complete_tick(scheduler, True)
+        return packet
+
+    def process_packet(self, packet: SmartMeterPacket, packet_callback: Callable[[SmartMeterPacket], None]):
+        try:
+            packet_callback(packet)
+        except Exception as ex:
+            print(f'An error occurred while processing smart meter packet: {ex}')
+
+    def check_burst_trigger(self, packet: Optional[SmartMeterPacket]) -> Optional[BurstCapture]:
+        if packet is None or self.burst_trigger is None or self.burst_callback is None:
+            return None
+
+        event = self.burst_trigger.update(time.time(), packet)
+        if event is None:
+            return None
+
+        print(f'{self.__class__.__name__} burst triggered by a {event.kind} of {event.change:g} in {event.field} '
+              f'(threshold {event.threshold:g})')
+        return self.burst_trigger.start(event)
+
+    def capture_burst(self, scheduler: PollingScheduler, packet_callback: Callable[[SmartMeterPacket], None],
+                      capture: BurstCapture):
+        end = time.monotonic() + self.burst_trigger.duration
+        next_sample = time.monotonic()
+        while next_sample < end:
+            if time.monotonic() >= scheduler.next_tick:
+                self.poll(scheduler, packet_callback)
+
             try:
-                packet = self.fetch_smart_meter_packet()
+                capture.samples.append((time.time(), self.fetch_burst_packet()))
             except Exception as ex:
-                print(f'An error occurred while fetching smart meter packet: {ex}')
-                continue
+                capture.failures += 1
+                if capture.failures == 1:
+                    print(f'An error occurred while fetching burst sample: {ex}')
+
+            next_sample = max(next_sample + capture.interval, time.monotonic())
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+
+        self.complete_burst(capture)
+
+    async def capture_burst_async(self, scheduler: PollingScheduler,
+                                  packet_callback: Callable[[SmartMeterPacket], None], capture: BurstCapture):
+        end = time.monotonic() + self.burst_trigger.duration
+        next_sample = time.monotonic()
+        while next_sample < end:
+            if time.monotonic() >= scheduler.next_tick:
+                await self.poll_async(scheduler, packet_callback)
 
             try:
-                packet_callback(packet)
+                capture.samples.append((time.time(), await self.fetch_burst_packet_async()))
             except Exception as ex:
-                print(f'An error occurred while processing smart meter packet: {ex}')
+                capture.failures += 1
+                if capture.failures == 1:
+                    print(f'An error occurred while fetching burst sample: {ex}')
+
+            next_sample = max(next_sample + capture.interval, time.monotonic())
+            await asyncio.sleep(max(0.0, next_sample - time.monotonic()))
+
+        self.complete_burst(capture)
 
-            elapsed = time.time() - start
-            time.sleep(max(0.0, self.measurement_interval - elapsed))
+    def complete_burst(self, capture: BurstCapture):
+        self.burst_trigger.complete()
+        samples = len(capture.samples) - capture.pre_trigger
+        if metrics.enabled:
+            metrics.increment('smart_meter_bursts_total', self.metrics_labels)
+            metrics.increment('smart_meter_burst_samples_total', self.metrics_labels, samples)
+        if capture.failures > 0:
+            print(f'{self.__class__.__name__} burst captured {samples} samples, {capture.failures} failed')
 
+        try:
+            self.burst_callback(capture)
+        except Exception as ex:
+            print(f'An error occurred while processing smart meter burst: {ex}')
+
+    def create_scheduler(self) -> PollingScheduler:
+        self.scheduler = PollingScheduler(
+            interval=self.measurement_interval,
+            offset=self.start_delay,
+            align_to_wall_clock=self.align_to_wall_clock,
+            max_backoff=self.max_backoff,
+        )
+        return self.scheduler
+
+    def record_poll(self, start: float, success: bool):
+        if not metrics.enabled:
+            return
+        if success:
+            metrics.observe('smart_meter_poll_seconds', self.metrics_labels, time.perf_counter() - start)
+        else:
+            metrics.increment('smart_meter_poll_errors_total', self.metrics_labels)
+
+    def complete_tick(self, scheduler: PollingScheduler, success: bool):
+        missed_ticks = scheduler.statistics.missed_ticks
+        scheduler.complete_tick(success)
+        # Also after a failed poll, so a meter that is offline and backing off isn't taken for a hung one.
+        self.report_activity(scheduler.next_tick)
+        if metrics.enabled and scheduler.statistics.missed_ticks != missed_ticks:
+            metrics.increment('smart_meter_missed_ticks_total', self.metrics_labels,
+                              scheduler.statistics.missed_ticks - missed_ticks)
+
+        if time.monotonic() - self.last_scheduler_log < SCHEDULER_LOG_INTERVAL:
+            return
+        self.last_scheduler_log = time.monotonic()
+
+        stats = scheduler.reset_statistics()
+        if self.log_statistics or stats.overruns > 0:
+            print(f'{self.__class__.__name__} polling: {stats.ticks} polls, {stats.overruns} overruns, '
+                  f'{stats.missed_ticks} missed ticks, {stats.failures} failures, '
+                  f'jitter mean {stats.mean_jitter * 1000:.1f} ms / max {stats.max_jitter * 1000:.1f} ms')
 
     @abstractmethod
     def fetch_smart_meter_packet(self) -> SmartMeterPacket:
         pass
+
+    async def fetch_smart_meter_packet_async(self) -> SmartMeterPacket:
+        return await asyncio.to_thread(self.fetch_smart_meter_packet)
+
+    def fetch_burst_packet(self) -> SmartMeterPacket:
+        # A packet of only the fields that are sampled during bursts.
+        raise Exception(f'{self.__class__.__name__} does not support burst sampling')
+
+    async def fetch_burst_packet_async(self) -> SmartMeterPacket:
+        return await asyncio.to_thread(self.fetch_burst_packet)
@@ -1,11 +1,28 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Callable
+from typing import Callable, Optional
 
+from smart_meter.metrics import Labels
 from smart_meter.smart_meter_packet import SmartMeterPacket
 
 
 class SmartMeter(ABC):
+    # Labels of the metrics recorded for this smart meter, see smart_meter.metrics.
+    metrics_labels: Labels = ()
+    # Called with the monotonic time (s) of the next read attempt after every poll, and after every read that failed,
+    # so a supervisor can tell a meter that is backing off from one that hangs. See report_activity.
+    activity_callback: Optional[Callable[[float], None]] = None
 
     @abstractmethod
     def start_measuring(self, packet_callback: Callable[[SmartMeterPacket], None]):
         pass
+
+    async def start_measuring_async(self, packet_callback: Callable[[SmartMeterPacket], None]):
+        # Smart meters without a native asyncio implementation run their blocking measuring loop on a worker thread.
+        # The packet callback is always invoked on the event loop.
+        loop = asyncio.get_running_loop()
+        await asyncio.to_thread(self.start_measuring, lambda packet: loop.call_soon_threadsafe(packet_callback, packet))
+
+    def report_activity(self, next_attempt: float):
+        if self.activity_callback is not None:
+            self.activity_callback(next_attempt)
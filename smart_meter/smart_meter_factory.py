@@ -1,14 +1,17 @@
+import importlib
 import os
+from types import ModuleType
+from typing import Mapping, Optional, TYPE_CHECKING
 
-from pymodbus.client import ModbusSerialClient, ModbusTcpClient
-from serial import Serial
+from smart_meter.modbus_register_map import find_register_map, list_register_maps
+from smart_meter.smart_meter import SmartMeter
 
-from smart_meter.dts353f_smart_meter import Dts353fSmartMeter
-from smart_meter.p1_smart_meter import P1SmartMeter
-from smart_meter.sdm72dm_smart_meter import Sdm72dmSmartMeter
+if TYPE_CHECKING:
+    from smart_meter.modbus_bus import ModbusBus
 
 # Factory environment variable keys
 SMART_METER_TYPE = 'SMART_METER_TYPE'
+SMART_METER_REGISTER_MAP = 'SMART_METER_REGISTER_MAP'
 SMART_METER_CONNECTION_TYPE = 'SMART_METER_CONNECTION_TYPE'
 SMART_METER_SERIAL_PORT = 'SMART_METER_SERIAL_PORT'
 SMART_METER_SERIAL_BAUDRATE = 'SMART_METER_SERIAL_BAUDRATE'
@@ -18,84 +21,75 @@ SMART_METER_SERIAL_STOPBITS = 'SMART_METER_SERIAL_STOPBITS'
 SMART_METER_SERIAL_TIMEOUT = 'SMART_METER_SERIAL_TIMEOUT'
 SMART_METER_TCP_ADDRESS = 'SMART_METER_TCP_ADDRESS'
 SMART_METER_TCP_PORT = 'SMART_METER_TCP_PORT'
+SMART_METER_TCP_TIMEOUT = 'SMART_METER_TCP_TIMEOUT'
+SMART_METER_TCP_MAX_IN_FLIGHT = 'SMART_METER_TCP_MAX_IN_FLIGHT'
 SMART_METER_MEASUREMENT_INTERVAL = 'SMART_METER_MEASUREMENT_INTERVAL'
+SMART_METER_MODBUS_MAX_READ_GAP = 'SMART_METER_MODBUS_MAX_READ_GAP'
+SMART_METER_MODBUS_SLAVE_ID = 'SMART_METER_MODBUS_SLAVE_ID'
+SMART_METER_MODBUS_BUS = 'SMART_METER_MODBUS_BUS'
+SMART_METER_MODBUS_POLL_PERIODS = 'SMART_METER_MODBUS_POLL_PERIODS'
+SMART_METER_MODBUS_RETRIES = 'SMART_METER_MODBUS_RETRIES'
+SMART_METER_MODBUS_POLL_BUDGET = 'SMART_METER_MODBUS_POLL_BUDGET'
+SMART_METER_MODBUS_BUS_BUDGET = 'SMART_METER_MODBUS_BUS_BUDGET'
+SMART_METER_MODBUS_ADAPTIVE_TIMEOUT = 'SMART_METER_MODBUS_ADAPTIVE_TIMEOUT'
+SMART_METER_MODBUS_MIN_TIMEOUT = 'SMART_METER_MODBUS_MIN_TIMEOUT'
+SMART_METER_MODBUS_QUARANTINE_AFTER = 'SMART_METER_MODBUS_QUARANTINE_AFTER'
+SMART_METER_MODBUS_BURST_FIELDS = 'SMART_METER_MODBUS_BURST_FIELDS'
+SMART_METER_BURST_STEP = 'SMART_METER_BURST_STEP'
+SMART_METER_BURST_SLOPE = 'SMART_METER_BURST_SLOPE'
+SMART_METER_BURST_INTERVAL = 'SMART_METER_BURST_INTERVAL'
+SMART_METER_BURST_DURATION = 'SMART_METER_BURST_DURATION'
+SMART_METER_BURST_PRE_TRIGGER = 'SMART_METER_BURST_PRE_TRIGGER'
+SMART_METER_BURST_HOLDOFF = 'SMART_METER_BURST_HOLDOFF'
+SMART_METER_ALIGN_TO_WALL_CLOCK = 'SMART_METER_ALIGN_TO_WALL_CLOCK'
+SMART_METER_MAX_BACKOFF = 'SMART_METER_MAX_BACKOFF'
+SMART_METER_LOG_STATISTICS = 'SMART_METER_LOG_STATISTICS'
+SMART_METER_P1_FAST_PATH = 'SMART_METER_P1_FAST_PATH'
+SMART_METER_P1_DECIMATION = 'SMART_METER_P1_DECIMATION'
 
 
-def build_smart_meter():
-    sm_type = os.getenv(SMART_METER_TYPE)
-    if sm_type == 'dts353f':
-        return Dts353fSmartMeter(
-            modbus_client=build_modbus_device(
-                def_baudrate=9600,
-                def_bytesize=8,
-                def_parity='E',
-                def_stopbits=1,
-                def_timeout=0.5,
-            ),
-            measurement_interval=float(os.getenv(SMART_METER_MEASUREMENT_INTERVAL, '2.0'))
-        )
-    elif sm_type == 'sdm72dm':
-        return Sdm72dmSmartMeter(
-            modbus_client=build_modbus_device(
-                def_baudrate=9600,
-                def_bytesize=8,
-                def_parity='N',
-                def_stopbits=1,
-                def_timeout=0.5,
-            ),
-            measurement_interval=float(os.getenv(SMART_METER_MEASUREMENT_INTERVAL, '4.0'))
-        )
-    elif sm_type == 'p1':
-        return P1SmartMeter(
-            serial_device=build_serial_device(
-                def_baudrate=115200,
-                def_bytesize=8,
-                def_parity='N',
-                def_stopbits=1,
-                def_timeout=0.5,
-            )
-        )
-    else:
-        raise Exception(f'Invalid environment variable {SMART_METER_TYPE} "{sm_type}" (must be "dts353f" or "p1")')
-
-
-def build_modbus_device(def_baudrate: int, def_bytesize: int, def_parity: str, def_stopbits: int, def_timeout: float):
-    connection_type = os.getenv(SMART_METER_CONNECTION_TYPE)
-    if connection_type == 'serial':
-        port = os.getenv(SMART_METER_SERIAL_PORT)
-        if port is None:
-            raise Exception(f'Environment variable not defined but required: {SMART_METER_SERIAL_PORT}')
-        return ModbusSerialClient(
-            port=port,
-            baudrate=int(os.getenv(SMART_METER_SERIAL_BAUDRATE, def_baudrate)),
-            bytesize=int(os.getenv(SMART_METER_SERIAL_BYTESIZE, def_bytesize)),
-            parity=os.getenv(SMART_METER_SERIAL_PARITY, def_parity),
-            stopbits=int(os.getenv(SMART_METER_SERIAL_STOPBITS, def_stopbits)),
-            timeout=float(os.getenv(SMART_METER_SERIAL_TIMEOUT, def_timeout)),
-        )
-    elif connection_type == 'tcp':
-        host = os.getenv(SMART_METER_TCP_ADDRESS)
-        port = int(os.getenv(SMART_METER_TCP_PORT, '502'))
-        if host is None:
-            raise Exception(f'Environment variable not defined but required: {SMART_METER_TCP_ADDRESS}')
-        return ModbusTcpClient(
-            host=host,
-            port=port,
-        )
-    else:
-        raise Exception(
-            f'Invalid environment variable {SMART_METER_CONNECTION_TYPE} "{connection_type}" (must be "serial" or "tcp")')
-
-
-def build_serial_device(def_baudrate: int, def_bytesize: int, def_parity: str, def_stopbits: int, def_timeout: float):
-    port = os.getenv(SMART_METER_SERIAL_PORT)
-    if port is None:
-        raise Exception(f'Environment variable not defined but required: {SMART_METER_SERIAL_PORT}')
-    return Serial(
-        port=port,
-        baudrate=int(os.getenv(SMART_METER_SERIAL_BAUDRATE, def_baudrate)),
-        bytesize=int(os.getenv(SMART_METER_SERIAL_BYTESIZE, def_bytesize)),
-        parity=os.getenv(SMART_METER_SERIAL_PARITY, def_parity),
-        stopbits=int(os.getenv(SMART_METER_SERIAL_STOPBITS, def_stopbits)),
-        timeout=float(os.getenv(SMART_METER_SERIAL_TIMEOUT, def_timeout)),
-    )
+# Smart meter drivers by type: the module that builds smart meters of that type, imported only when a smart meter of
+# that type is built, so eg. a P1-only bridge never imports pymodbus. Every type with a built-in register map is a
+# Modbus meter. Drivers define build_smart_meter(sm_type, asynchronous, settings, modbus_buses).
+SMART_METER_DRIVERS = {
+    'modbus': 'smart_meter.modbus_smart_meter_factory',
+    'p1': 'smart_meter.p1_smart_meter_factory',
+}
+
+
+def build_smart_meter(asynchronous: bool = False, settings: Mapping[str, str] = os.environ,
+                      modbus_buses: Optional[dict[str, 'ModbusBus']] = None) -> SmartMeter:
+    # With asynchronous=True, Modbus smart meters are built on asyncio clients for use with start_measuring_async.
+    # Settings default to the environment variables. Modbus meters naming the same SMART_METER_MODBUS_BUS, or behind
+    # the same Modbus TCP gateway (host and port), share a single ModbusBus from modbus_buses.
+    sm_type = settings.get(SMART_METER_TYPE)
+    return get_smart_meter_driver(sm_type).build_smart_meter(sm_type, asynchronous, settings, modbus_buses)
+
+
+def get_smart_meter_driver(sm_type: Optional[str]) -> ModuleType:
+    module_name = SMART_METER_DRIVERS.get(sm_type)
+    if module_name is None and sm_type is not None and find_register_map(sm_type) is not None:
+        module_name = SMART_METER_DRIVERS['modbus']
+    if module_name is None:
+        smart_meter_types = ', '.join(f'"{name}"' for name in get_smart_meter_types())
+        raise Exception(f'Invalid environment variable {SMART_METER_TYPE} "{sm_type}" (must be one of {smart_meter_types})')
+    return importlib.import_module(module_name)
+
+
+def get_smart_meter_types() -> list[str]:
+    return [*list_register_maps(), *SMART_METER_DRIVERS]
+
+
+def register_smart_meter_driver(sm_type: str, module_name: str):
+    # Adds a driver module for a smart meter type, imported when the first smart meter of that type is built.
+    SMART_METER_DRIVERS[sm_type] = module_name
+
+
+def format_setting(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def parse_optional_float(value: Optional[str]) -> Optional[float]:
+    return float(value) if value else None
@@ -1,17 +1,22 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional, Self, Literal, Union
+from typing import Optional, Self, Literal, Union, Any
 
 
 class MqttDataClass(ABC):
+    __slots__ = ()
 
     @abstractmethod
     def to_topics(self, topic_prefix: str = '') -> dict[str, float]:
         pass
 
+    @abstractmethod
+    def to_dict(self) -> dict[str, Any]:
+        pass
+
 
-@dataclass
+@dataclass(slots=True)
 class EnergyData(MqttDataClass):
     delivery: Optional[float] = None  # kWh
     redelivery: Optional[float] = None  # kWh
@@ -37,6 +42,15 @@ class EnergyData(MqttDataClass):
 
         return topics
 
+    def to_dict(self) -> dict[str, Any]:
+        data = {}
+        if self.delivery is not None:
+            data['delivery'] = round(self.delivery, 3)
+        if self.redelivery is not None:
+            data['redelivery'] = round(self.redelivery, 3)
+
+        return data
+
     def reverse_energy_direction(self) -> Self:
         return EnergyData(
             delivery=self.redelivery,
@@ -44,7 +58,7 @@ class EnergyData(MqttDataClass):
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class PhaseData(MqttDataClass):
     voltage: Optional[float] = None  # V
     amperage: Optional[float] = None  # A
@@ -64,6 +78,19 @@ class PhaseData(MqttDataClass):
 
         return topics
 
+    def to_dict(self) -> dict[str, Any]:
+        data = {}
+        if self.voltage is not None:
+            data['voltage'] = round(self.voltage, 1)
+        if self.amperage is not None:
+            data['amperage'] = round(self.amperage, 2)
+        if self.power is not None:
+            data['power'] = round(self.power, 3)
+        if self.energy is not None:
+            data['energy'] = self.energy.to_dict()
+
+        return data
+
     def reverse_power_direction(self) -> Self:
         if self.power is not None:
             return PhaseData(
@@ -92,7 +119,7 @@ class EnergyTariff(Enum):
     HIGH = 2
 
 
-@dataclass
+@dataclass(slots=True)
 class SmartMeterPacket(MqttDataClass):
     phase_l1: Optional[PhaseData] = None
     phase_l2: Optional[PhaseData] = None
@@ -127,6 +154,29 @@ class SmartMeterPacket(MqttDataClass):
 
         return topics
 
+    def to_dict(self) -> dict[str, Any]:
+        data = {}
+        if self.phase_l1 is not None:
+            data['l1'] = self.phase_l1.to_dict()
+        if self.phase_l2 is not None:
+            data['l2'] = self.phase_l2.to_dict()
+        if self.phase_l3 is not None:
+            data['l3'] = self.phase_l3.to_dict()
+        if self.power is not None:
+            data['power'] = round(self.power, 3)
+        if self.energy is not None:
+            data['energy'] = self.energy.to_dict()
+        if self.frequency is not None:
+            data['frequency'] = round(self.frequency, 3)
+        if self.tariff is not None:
+            data['tariff'] = self.tariff.value
+        if self.gas is not None:
+            data['gas'] = round(self.gas, 3)
+        if self.water is not None:
+            data['water'] = round(self.water, 3)
+
+        return data
+
     def reverse_power_direction(self) -> Self:
         return SmartMeterPacket(
             phase_l1=None if self.phase_l1 is None else self.phase_l1.reverse_power_direction(),
@@ -135,6 +185,7 @@ class SmartMeterPacket(MqttDataClass):
             power=None if self.power is None else self.power * -1,
             energy=self.energy,
             frequency=self.frequency,
+            tariff=self.tariff,
             gas=self.gas,
             water=self.water,
         )
@@ -147,6 +198,7 @@ class SmartMeterPacket(MqttDataClass):
             power=self.power,
             energy=None if self.energy is None else self.energy.reverse_energy_direction(),
             frequency=self.frequency,
+            tariff=self.tariff,
             gas=self.gas,
             water=self.water,
         )
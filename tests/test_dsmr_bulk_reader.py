@@ -0,0 +1,108 @@
+import os
+import unittest
+
+from smart_meter.dsmr_bulk_reader import DsmrBulkTelegramReader, crc16_words
+from smart_meter.dsmr_telegram_reader import crc16
+from tests.test_dsmr_telegram_reader import load_telegram, replace_crc
+
+OBIS_REFERENCES = ('1-0:1.7.0', '1-0:21.7.0', '1-0:32.7.0', '0-1:24.2.1')
+
+
+class BulkSerialStub:
+    # Stands in for serial.Serial, returning the data in chunks of at most chunk_size bytes. Raises once all data was
+    # read, instead of blocking.
+
+    def __init__(self, data: bytes, chunk_size: int):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    @property
+    def in_waiting(self) -> int:
+        return min(len(self.data), self.chunk_size)
+
+    def read(self, size: int) -> bytes:
+        if len(self.data) == 0:
+            raise Exception('No more data')
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def build_reader(data: bytes, chunk_size: int = 64, **kwargs) -> DsmrBulkTelegramReader:
+    return DsmrBulkTelegramReader(BulkSerialStub(data, chunk_size), OBIS_REFERENCES, **kwargs)
+
+
+class Crc16WordsTest(unittest.TestCase):
+
+    def test_matches_crc16(self):
+        data = os.urandom(1001)
+        for length in (0, 1, 2, 9, 1000, 1001):
+            self.assertEqual(crc16_words(memoryview(data[:length])), crc16(data[:length]), length)
+
+
+class DsmrBulkTelegramReaderTest(unittest.TestCase):
+
+    def test_reads_telegram(self):
+        for chunk_size in (1, 7, 4096):
+            reader = build_reader(load_telegram('dsmr5.txt'), chunk_size)
+            telegram = reader.read_telegram()
+
+            self.assertEqual(telegram.header, 'ISk5\\2MT382-1000')
+            self.assertEqual(telegram.get_value('1-0:1.7.0'), 1.193)
+            self.assertEqual(telegram.get_value('1-0:21.7.0'), 1.111)
+            self.assertEqual(telegram.objects['0-1:24.2.1'], ['101209112500W', '12785.123*m3'])
+            self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_only_decodes_given_references(self):
+        telegram = build_reader(load_telegram('dsmr5.txt')).read_telegram()
+        # 1-0:1.7.0 must not match 1-0:21.7.0 either.
+        self.assertEqual(sorted(telegram.objects), sorted(OBIS_REFERENCES))
+
+    def test_reads_consecutive_telegrams(self):
+        reader = build_reader(load_telegram('dsmr4.txt') + load_telegram('dsmr5.txt'))
+        self.assertEqual(reader.read_telegram().header, 'KFM5KAIFA-METER')
+        self.assertEqual(reader.read_telegram().header, 'ISk5\\2MT382-1000')
+
+    def test_discards_bytes_before_header(self):
+        reader = build_reader(b'1.0(garbage)\r\n' + load_telegram('dsmr5.txt'))
+        reader.read_telegram()
+
+        self.assertEqual(reader.statistics.discarded_bytes, 14)
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_rejects_crc_mismatch(self):
+        telegram = load_telegram('dsmr5.txt')
+        reader = build_reader(replace_crc(telegram, b'0000') + telegram)
+        reader.read_telegram()
+
+        self.assertEqual(reader.statistics.bad_frames, 1)
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_accepts_telegram_without_crc(self):
+        reader = build_reader(replace_crc(load_telegram('dsmr5.txt'), b''))
+        self.assertEqual(reader.read_telegram().get_value('1-0:1.7.0'), 1.193)
+        self.assertEqual(reader.statistics.unchecked_frames, 1)
+
+    def test_restarts_on_new_header(self):
+        telegram = load_telegram('dsmr5.txt')
+        truncated = telegram[:telegram.index(b'1-0:32.7.0')]
+        reader = build_reader(truncated + telegram)
+        reader.read_telegram()
+
+        self.assertEqual(reader.statistics.discarded_bytes, len(truncated))
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_rejects_oversized_frame(self):
+        telegram = load_telegram('dsmr5.txt')
+        reader = build_reader(telegram[:telegram.rindex(b'!')] + telegram, max_telegram_size=len(telegram))
+        self.assertEqual(reader.read_telegram().get_value('1-0:1.7.0'), 1.193)
+        self.assertGreaterEqual(reader.statistics.bad_frames, 1)
+
+    def test_decimation(self):
+        reader = build_reader(load_telegram('dsmr4.txt') + load_telegram('dsmr5.txt'), decimation=2)
+        self.assertEqual(reader.read_telegram().header, 'ISk5\\2MT382-1000')
+        # Skipped telegrams aren't checked.
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import unittest
+
+from smart_meter.dsmr_telegram_reader import DsmrTelegramReader, crc16
+
+# The example telegrams of the DSMR 4 and 5 P1 specifications, with their CRCs.
+TELEGRAMS = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'telegrams')
+
+
+def load_telegram(name: str) -> bytes:
+    with open(os.path.join(TELEGRAMS, name), 'rb') as file:
+        return file.read()
+
+
+class SerialStub:
+    # Stands in for serial.Serial, returning the data line by line, or in chunks of partial lines like readline does on
+    # a timeout. Raises once all data was read, instead of blocking.
+
+    def __init__(self, data: bytes, chunk_size: int = 0):
+        self.chunks = []
+        for line in data.splitlines(keepends=True):
+            size = chunk_size or len(line)
+            self.chunks += [line[start:start + size] for start in range(0, len(line), size)]
+
+    def readline(self) -> bytes:
+        if len(self.chunks) == 0:
+            raise Exception('No more data')
+        return self.chunks.pop(0)
+
+
+def replace_crc(telegram: bytes, crc: bytes) -> bytes:
+    end = telegram.rindex(b'!')
+    return telegram[:end + 1] + crc + b'\r\n'
+
+
+class Crc16Test(unittest.TestCase):
+
+    def test_check_value(self):
+        # The CRC16/ARC check value.
+        self.assertEqual(crc16(b'123456789'), 0xBB3D)
+
+    def test_incremental(self):
+        self.assertEqual(crc16(b'56789', crc16(b'1234')), crc16(b'123456789'))
+
+    def test_specification_telegrams(self):
+        for name in ('dsmr4.txt', 'dsmr5.txt'):
+            telegram = load_telegram(name)
+            end = telegram.rindex(b'!')
+            self.assertEqual(crc16(telegram[:end + 1]), int(telegram[end + 1:].strip(), 16), name)
+
+
+class DsmrTelegramReaderTest(unittest.TestCase):
+
+    def test_reads_telegram(self):
+        reader = DsmrTelegramReader(SerialStub(load_telegram('dsmr5.txt')))
+        telegram = reader.read_telegram()
+
+        self.assertEqual(telegram.header, 'ISk5\\2MT382-1000')
+        self.assertEqual(telegram.get_value('1-0:1.7.0'), 1.193)
+        self.assertEqual(telegram.get_value('1-0:32.7.0'), 220.1)
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_joins_partial_lines(self):
+        reader = DsmrTelegramReader(SerialStub(load_telegram('dsmr5.txt'), 7))
+        self.assertEqual(reader.read_telegram().get_value('1-0:61.7.0'), 3.333)
+
+    def test_discards_bytes_before_header(self):
+        reader = DsmrTelegramReader(SerialStub(b'1.0(garbage)\r\n' + load_telegram('dsmr4.txt')))
+        reader.read_telegram()
+
+        self.assertEqual(reader.statistics.discarded_bytes, 14)
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_rejects_crc_mismatch(self):
+        telegram = load_telegram('dsmr5.txt')
+        reader = DsmrTelegramReader(SerialStub(replace_crc(telegram, b'0000') + telegram))
+        reader.read_telegram()
+
+        self.assertEqual(reader.statistics.bad_frames, 1)
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_rejects_malformed_trailer(self):
+        telegram = load_telegram('dsmr5.txt')
+        reader = DsmrTelegramReader(SerialStub(replace_crc(telegram, b'XYZ!') + telegram))
+        reader.read_telegram()
+
+        self.assertEqual(reader.statistics.bad_frames, 1)
+
+    def test_accepts_telegram_without_crc(self):
+        # DSMR < 4 telegrams end in a bare '!'.
+        reader = DsmrTelegramReader(SerialStub(replace_crc(load_telegram('dsmr5.txt'), b'')))
+        self.assertEqual(reader.read_telegram().get_value('1-0:1.7.0'), 1.193)
+        self.assertEqual(reader.statistics.unchecked_frames, 1)
+
+    def test_restarts_on_new_header(self):
+        telegram = load_telegram('dsmr5.txt')
+        truncated = telegram[:telegram.index(b'1-0:32.7.0')]
+        reader = DsmrTelegramReader(SerialStub(truncated + telegram))
+        reader.read_telegram()
+
+        self.assertEqual(reader.statistics.discarded_bytes, len(truncated))
+        self.assertEqual(reader.statistics.good_frames, 1)
+
+    def test_rejects_oversized_frame(self):
+        telegram = load_telegram('dsmr5.txt')
+        reader = DsmrTelegramReader(SerialStub(telegram + telegram), max_telegram_size=len(telegram) - 1)
+        with self.assertRaises(Exception):
+            reader.read_telegram()
+        self.assertEqual(reader.statistics.bad_frames, 2)
+
+    def test_decimation(self):
+        telegrams = load_telegram('dsmr4.txt') + load_telegram('dsmr5.txt')
+        reader = DsmrTelegramReader(SerialStub(telegrams), decimation=2)
+
+        self.assertEqual(reader.read_telegram().header, 'ISk5\\2MT382-1000')
+        self.assertEqual(reader.statistics.good_frames, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import math
+import unittest
+from array import array
+
+from bridge.line_protocol import LineProtocolEncoder
+from smart_meter.packet_layout import FIELD_COUNT, FIELD_INDEX
+
+
+def build_values(**fields: float) -> array:
+    # Keyword arguments are packet fields with '_' for '/', eg. l1_voltage.
+    values = array('d', [math.nan] * FIELD_COUNT)
+    for name, value in fields.items():
+        values[FIELD_INDEX[name.replace('_', '/')]] = value
+    return values
+
+
+class LineProtocolEncoderTest(unittest.TestCase):
+
+    def test_line(self):
+        encoder = LineProtocolEncoder('smart_meter', {'meter': 'main'})
+        line = encoder.encode(1700000000.123456, build_values(l1_voltage=230.14, l1_power=0.2764, power=0.2764,
+                                                               tariff=2.0))
+        self.assertEqual(line, 'smart_meter,meter=main l1_voltage=230.1,l1_power=0.276,power=0.276,tariff=2i '
+                               '1700000000123456000\n')
+
+    def test_escapes_measurement(self):
+        encoder = LineProtocolEncoder('smart meter,v2=x', {})
+        line = encoder.encode(0.0, build_values(power=1.0))
+        # Commas and spaces are escaped in measurements, equal signs aren't.
+        self.assertTrue(line.startswith('smart\\ meter\\,v2=x power=1.0 '), line)
+
+    def test_escapes_tags(self):
+        encoder = LineProtocolEncoder('smart_meter', {'meter id': 'main, 1=a', 'site': 'home'})
+        line = encoder.encode(0.0, build_values(power=1.0))
+        self.assertTrue(line.startswith('smart_meter,meter\\ id=main\\,\\ 1\\=a,site=home power=1.0 '), line)
+
+    def test_sorts_tags_and_skips_empty_ones(self):
+        encoder = LineProtocolEncoder('smart_meter', {'site': 'home', 'meter': 'main', 'room': ''})
+        line = encoder.encode(0.0, build_values(power=1.0))
+        self.assertTrue(line.startswith('smart_meter,meter=main,site=home power=1.0 '), line)
+
+    def test_field_keys(self):
+        encoder = LineProtocolEncoder('smart_meter', {})
+        line = encoder.encode(0.0, build_values(l2_energy_delivery=1234.5678))
+        self.assertEqual(line, 'smart_meter l2_energy_delivery=1234.568 0\n')
+
+    def test_skips_missing_fields(self):
+        encoder = LineProtocolEncoder('smart_meter', {})
+        line = encoder.encode(0.0, build_values(l1_power=math.inf, l2_power=-math.inf, power=0.5))
+        self.assertEqual(line, 'smart_meter power=0.5 0\n')
+        self.assertIsNone(encoder.encode(0.0, build_values()))
+
+    def test_timestamp_rounded_to_microseconds(self):
+        encoder = LineProtocolEncoder('smart_meter', {})
+        line = encoder.encode(1700000000.1, build_values(power=1.0))
+        self.assertTrue(line.endswith(' 1700000000100000000\n'), line)
+
+
+if __name__ == '__main__':
+    unittest.main()
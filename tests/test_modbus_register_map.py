@@ -0,0 +1,118 @@
+import struct
+import unittest
+
+from smart_meter.modbus_read_planner import ModbusReadBlock
+from smart_meter.modbus_register_map import ModbusBlockDecoder, ModbusRegisterField, compile_register_map, \
+    find_register_map, list_register_maps, load_register_map
+
+
+def to_registers(format: str, *values) -> list[int]:
+    data = struct.pack(f'>{format}', *values)
+    return list(struct.unpack(f'>{len(data) // 2}H', data))
+
+
+def decode(block: ModbusReadBlock, fields: list[ModbusRegisterField], registers: list[int]) -> dict[str, float]:
+    decoder = ModbusBlockDecoder(block, {register_field.name: register_field for register_field in fields})
+    values = {}
+    decoder.decode(registers, values)
+    return values
+
+
+class ModbusBlockDecoderTest(unittest.TestCase):
+
+    def test_contiguous_fields(self):
+        block = ModbusReadBlock(address=0x10, count=4, fields={'l1_voltage': 0, 'l1_amperage': 2})
+        fields = [ModbusRegisterField('l1_voltage', 0x10), ModbusRegisterField('l1_amperage', 0x12)]
+
+        values = decode(block, fields, to_registers('ff', 230.5, 1.25))
+        self.assertEqual(values, {'l1_voltage': 230.5, 'l1_amperage': 1.25})
+
+    def test_gaps_are_skipped(self):
+        block = ModbusReadBlock(address=0, count=7, fields={'l1_power': 1, 'frequency': 5})
+        fields = [
+            ModbusRegisterField('l1_power', 1, 'int16'),
+            ModbusRegisterField('frequency', 5, 'uint16', scale=0.01),
+        ]
+
+        registers = to_registers('HhHHHHH', 0xFFFF, -1500, 0xFFFF, 0xFFFF, 0xFFFF, 5001, 0xFFFF)
+        values = decode(block, fields, registers)
+        self.assertEqual(values['l1_power'], -1500)
+        self.assertAlmostEqual(values['frequency'], 50.01)
+
+    def test_word_order(self):
+        block = ModbusReadBlock(address=0, count=6, fields={'total_delivery': 0, 'total_redelivery': 2, 'gas': 4})
+        fields = [
+            ModbusRegisterField('total_delivery', 0, 'uint32', word_order='little', scale=0.01),
+            ModbusRegisterField('total_redelivery', 2, 'uint32', scale=0.01),
+            ModbusRegisterField('gas', 4, 'float32', word_order='little'),
+        ]
+
+        delivery = to_registers('I', 12345678)
+        gas = to_registers('f', 1234.5)
+        registers = [delivery[1], delivery[0], *to_registers('I', 87654321), gas[1], gas[0]]
+        values = decode(block, fields, registers)
+        self.assertAlmostEqual(values['total_delivery'], 123456.78)
+        self.assertAlmostEqual(values['total_redelivery'], 876543.21)
+        self.assertEqual(values['gas'], 1234.5)
+
+    def test_64_bit_types(self):
+        block = ModbusReadBlock(address=0, count=8, fields={'total_delivery': 0, 'water': 4})
+        fields = [
+            ModbusRegisterField('total_delivery', 0, 'uint64', word_order='little'),
+            ModbusRegisterField('water', 4, 'float64'),
+        ]
+
+        delivery = to_registers('Q', 2 ** 40 + 7)
+        values = decode(block, fields, [*reversed(delivery), *to_registers('d', 0.125)])
+        self.assertEqual(values, {'total_delivery': 2 ** 40 + 7, 'water': 0.125})
+
+    def test_overlapping_fields(self):
+        block = ModbusReadBlock(address=0, count=3, fields={'l1_power': 0, 'l2_power': 1})
+        fields = {'l1_power': ModbusRegisterField('l1_power', 0), 'l2_power': ModbusRegisterField('l2_power', 1)}
+        with self.assertRaises(Exception):
+            ModbusBlockDecoder(block, fields)
+
+
+class RegisterMapTest(unittest.TestCase):
+
+    def test_compile(self):
+        register_map = compile_register_map('test', {
+            'register_type': 'input',
+            'scale': 0.001,
+            'fields': {
+                'total_power': {'address': '0x0034'},
+                'total_delivery': {'address': 72, 'type': 'uint32', 'word_order': 'little', 'scale': 0.01},
+            },
+            'defaults': {'serial_parity': 'N'},
+        })
+
+        total_power = register_map.fields['total_power']
+        self.assertEqual((total_power.address, total_power.data_type, total_power.scale, total_power.register_type),
+                         (0x34, 'float32', 0.001, 'input'))
+        total_delivery = register_map.fields['total_delivery']
+        self.assertEqual((total_delivery.address, total_delivery.word_order, total_delivery.scale),
+                         (72, 'little', 0.01))
+        self.assertEqual(register_map.defaults, {'serial_parity': 'N'})
+
+    def test_invalid(self):
+        for data in (
+            {'fields': {}},
+            {'fields': {'power': {'address': 0}}},
+            {'fields': {'total_power': {}}},
+            {'fields': {'total_power': {'address': 0, 'type': 'float16'}}},
+            {'fields': {'total_power': {'address': 0, 'word_order': 'middle'}}},
+            {'fields': {'total_power': {'address': 0xFFFF}}},
+            {'fields': {'total_power': {'address': 0, 'unit': 'W'}}},
+            {'fields': {'total_power': {'address': 0}}, 'name': 'test'},
+        ):
+            with self.assertRaises(Exception, msg=data):
+                compile_register_map('test', data)
+
+    def test_built_in_maps_load(self):
+        for name in list_register_maps():
+            register_map = load_register_map(find_register_map(name))
+            self.assertGreater(len(register_map.fields), 0, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
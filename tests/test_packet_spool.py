@@ -0,0 +1,94 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from bridge.packet_spool import PacketSpool
+
+
+class PacketSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'spool.db')
+        self.spools = []
+
+    def tearDown(self):
+        for spool in self.spools:
+            spool.connection.close()
+        self.directory.cleanup()
+
+    def open_spool(self, max_size: int = 1024 * 1024, max_age: float = 3600.0) -> PacketSpool:
+        spool = PacketSpool(self.path, max_size, max_age)
+        self.spools.append(spool)
+        return spool
+
+    def test_first_in_first_out(self):
+        spool = self.open_spool()
+        for index in range(5):
+            spool.append(f'topic/{index}', f'payload {index}'.encode())
+
+        messages = spool.peek(3)
+        self.assertEqual([message.topic for message in messages], ['topic/0', 'topic/1', 'topic/2'])
+        self.assertEqual(messages[0].payload, b'payload 0')
+
+        spool.remove(messages)
+        self.assertEqual(len(spool), 2)
+        self.assertEqual([message.topic for message in spool.peek(10)], ['topic/3', 'topic/4'])
+
+    def test_remove_nothing(self):
+        spool = self.open_spool()
+        spool.append('topic', b'payload')
+        spool.remove([])
+        self.assertEqual(len(spool), 1)
+
+    def test_persists_across_reopen(self):
+        spool = self.open_spool()
+        spool.append('topic/a', b'a')
+        spool.append('topic/b', b'bb')
+        spool.remove(spool.peek(1))
+        spool.connection.close()
+        self.spools.remove(spool)
+
+        spool = self.open_spool()
+        self.assertEqual(len(spool), 1)
+        self.assertEqual(spool.size, 2)
+        self.assertEqual(spool.peek(10)[0].topic, 'topic/b')
+
+    def test_drops_oldest_when_full(self):
+        spool = self.open_spool(max_size=100)
+        for index in range(20):
+            spool.append(f'topic/{index}', bytes(10))
+
+        self.assertLessEqual(spool.size, 100)
+        self.assertEqual(spool.dropped, 20 - len(spool))
+        # The newest messages are kept.
+        self.assertEqual(spool.peek(100)[-1].topic, 'topic/19')
+        self.assertEqual(spool.peek(1)[0].topic, f'topic/{spool.dropped}')
+
+    def test_drops_expired(self):
+        spool = self.open_spool(max_age=60.0)
+        spool.append('topic/old', b'old')
+        with mock.patch('time.time', return_value=time.time() + 120.0):
+            spool.append('topic/new', b'new')
+
+        self.assertEqual(spool.dropped, 1)
+        self.assertEqual([message.topic for message in spool.peek(10)], ['topic/new'])
+
+    def test_remove_after_drop_recounts(self):
+        # Messages dropped while they were being replayed are removed along with them.
+        spool = self.open_spool(max_size=30)
+        spool.append('topic/0', bytes(10))
+        spool.append('topic/1', bytes(10))
+        replaying = spool.peek(2)
+        spool.append('topic/2', bytes(10))
+        spool.append('topic/3', bytes(10))
+
+        spool.remove(replaying)
+        self.assertEqual(len(spool), len(spool.peek(10)))
+        self.assertEqual(spool.size, sum(len(message.payload) for message in spool.peek(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()